@@ -0,0 +1,101 @@
+"""
+Times exporting a synthetic project with analytics.export and running degree
+and BFS computations on it, against walking the graph's ports for the same
+results.
+
+    PYTHONPATH=python python benchmarks/bench_analytics.py --assets 2000 --shots 1000
+"""
+
+import argparse
+import time
+
+import numpy
+
+import analytics
+import loader
+import navigate
+
+import generate
+
+
+def build(config, assets, shots):
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+    graph = navigate.Graph()
+    for stage in stages:
+        graph.add_node(stage)
+        for connection in config_loader.create_connections(stage):
+            graph.add_connection(connection)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=2000)
+    parser.add_argument("--shots", type=int, default=1000)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sources", type=int, default=100)
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    graph = build(config, assets, shots)
+
+    start = time.perf_counter()
+    csr = analytics.export(graph)
+    export_time = time.perf_counter() - start
+    print("{} ports, {} edges".format(len(csr), csr.edge_count()))
+    print("{:<10} {:>10.3f} s".format("export", export_time))
+
+    # Connections arriving at each stage
+    connections = analytics.export(graph, workspaces=False)
+    start = time.perf_counter()
+    stage_degree = connections.stage_degree(connections.in_degree())
+    degree_time = time.perf_counter() - start
+    start = time.perf_counter()
+    walked = {}
+    for port in connections.ports:
+        stage = navigate._stage(port)
+        if stage is not None:
+            walked[stage] = walked.get(stage, 0) + len(graph.incoming(port))
+    walk_time = time.perf_counter() - start
+    assert walked == {
+        stage: degree
+        for stage, degree in zip(connections.stages, stage_degree)
+        if stage in walked
+    }
+    print(
+        "{:<10} {:>10.3f} s {:>10.3f} s walked".format(
+            "degrees", degree_time, walk_time
+        )
+    )
+
+    # Depth of everything downstream of each of the first asset outputs
+    sources = [
+        port
+        for port in csr.ports
+        if port.node().parent() is not None and port.type() == "output"
+    ][: args.sources]
+    start = time.perf_counter()
+    reached = [numpy.count_nonzero(csr.bfs(csr.ids([p])) > 0) for p in sources]
+    bfs_time = time.perf_counter() - start
+    start = time.perf_counter()
+    walked = [len(graph.downstream(p)) for p in sources]
+    walk_time = time.perf_counter() - start
+    assert reached == walked
+    print("{:<10} {:>10.3f} s {:>10.3f} s walked".format("bfs", bfs_time, walk_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Builds a synthetic production-scale project and times each phase of the
+build separately: create_stage_node (optionally lazy), create_connections,
+Graph.add_connection (or both streamed together) and the graph queries.
+Results can be written to JSON and compared against a previous run to catch
+regressions.
+
+    PYTHONPATH=python python benchmarks/bench_build.py --assets 10000 --shots 5000
+    PYTHONPATH=python python benchmarks/bench_build.py --output base.json
+    PYTHONPATH=python python benchmarks/bench_build.py --baseline base.json
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+import constants
+import loader
+import navigate
+import nodes
+import profiling
+
+import generate
+
+
+class Timer(object):
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+
+    def phase(self, name, count):
+        return _Phase(self, name, count)
+
+
+class _Phase(object):
+    def __init__(self, timer, name, count):
+        self._timer = timer
+        self._name = name
+        self._count = count
+
+    def __enter__(self):
+        if self._timer.trace_memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._start
+        result = {
+            "seconds": seconds,
+            "count": self._count,
+            "per_item_us": seconds / max(self._count, 1) * 1e6,
+        }
+        if self._timer.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["peak_memory_mb"] = peak / 1024 / 1024
+        self._timer.phases[self._name] = result
+
+
+def run(args):
+    config = generate.generate_config(extra_workspaces=args.extra_workspaces)
+    assets = generate.generate_assets(
+        args.assets, rigged_ratio=args.rigged_ratio, seed=args.seed
+    )
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    profiler = profiling.Profiler() if args.profile else None
+    config_loader = loader.ConfigLoader(config, profiler=profiler)
+    timer = Timer(trace_memory=args.trace_memory)
+
+    root = nodes.Node("root", "pipeline")
+    project = config_loader.create_stage_node("project", "project", {}, root)
+    asset_nodes = {}
+    if args.batch:
+        with timer.phase("create_stage_nodes.asset", len(assets)):
+            created = config_loader.create_stage_nodes(
+                "asset", assets, project, lazy=args.lazy
+            )
+        asset_nodes = {node.name(): node for node in created}
+    else:
+        with timer.phase("create_stage_node.asset", len(assets)):
+            for name, data in assets:
+                asset_nodes[name] = config_loader.create_stage_node(
+                    "asset", name, data, project, lazy=args.lazy
+                )
+
+    shot_data = [
+        (name, generate.shot_data(animated, static, asset_nodes))
+        for name, animated, static in shots
+    ]
+    shot_nodes = []
+    with timer.phase("create_stage_node.shot", len(shot_data)):
+        for name, data in shot_data:
+            shot_nodes.append(
+                config_loader.create_stage_node(
+                    "shot", name, data, project, lazy=args.lazy
+                )
+            )
+
+    stages = [project] + list(asset_nodes.values()) + shot_nodes
+    graph = navigate.Graph()
+    if args.stream:
+        with timer.phase("stream_connections", len(stages)):
+            for stage in stages:
+                graph.add_node(stage)
+            total = config_loader.stream_connections(stages, graph.add_connection)
+    else:
+        connections = []
+        with timer.phase("create_connections", len(stages)):
+            for stage in stages:
+                connections.append(config_loader.create_connections(stage))
+
+        total = sum(len(c) for c in connections)
+        with timer.phase("add_connection", total):
+            for stage, stage_connections in zip(stages, connections):
+                graph.add_node(stage)
+                for connection in stage_connections:
+                    graph.add_connection(connection)
+        del connections
+
+    rng = random.Random(args.seed)
+    sample = [asset_nodes[rng.choice(assets)[0]] for _ in range(args.queries)]
+    with timer.phase("query.node", len(sample)):
+        for node in sample:
+            graph.node(node.name(), node.type())
+
+    ports = [node.port(constants.PortType.Output, "model") for node in sample]
+    with timer.phase("query.connected", len(ports)):
+        for port in ports:
+            for _ in graph.connected(port):
+                pass
+
+    with timer.phase("query.downstream", len(ports)):
+        for port in ports:
+            graph.downstream(port)
+
+    if profiler is not None:
+        profiler.write(args.profile)
+
+    return {
+        "parameters": {
+            key: value
+            for key, value in sorted(vars(args).items())
+            if key not in ("output", "baseline", "tolerance", "profile")
+        },
+        "connections": total,
+        "phases": timer.phases,
+        # Linux reports the resident set size in kilobytes
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Returns the phases which are slower than the baseline by more than the
+    # tolerance, as a fraction of the baseline time per item
+    if results["parameters"] != baseline["parameters"]:
+        print("Warning: baseline was recorded with different parameters")
+
+    regressions = []
+    for name, phase in results["phases"].items():
+        previous = baseline["phases"].get(name)
+        if previous is None:
+            continue
+        change = phase["per_item_us"] / previous["per_item_us"] - 1
+        print("{:<26} {:>+8.1%}".format(name, change))
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def report(results):
+    print("{} connections".format(results["connections"]))
+    print("{:<26} {:>10} {:>10} {:>14}".format("phase", "count", "seconds", "per item"))
+    for name, phase in results["phases"].items():
+        line = "{:<26} {:>10} {:>10.3f} {:>11.3f} us".format(
+            name, phase["count"], phase["seconds"], phase["per_item_us"]
+        )
+        if "peak_memory_mb" in phase:
+            line += " {:>9.1f} MB".format(phase["peak_memory_mb"])
+        print(line)
+    print("peak rss: {:.1f} MB".format(results["peak_rss_mb"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=10000)
+    parser.add_argument("--shots", type=int, default=5000)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--rigged-ratio", type=float, default=0.5)
+    parser.add_argument("--extra-workspaces", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream connections into the graph instead of collecting them",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Create the assets with a single create_stage_nodes call",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="Create lazy stages, which are built by create_connections",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record the peak Python memory of each phase, slows the build",
+    )
+    parser.add_argument(
+        "--profile", help="Write a loader profiling report to a JSON file"
+    )
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--baseline", help="Compare against a previous JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown per item against the baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressed: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
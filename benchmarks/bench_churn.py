@@ -0,0 +1,88 @@
+"""
+Times churn on a synthetic project: repeatedly removing a shot from the graph
+with Graph.remove_node and adding it back with its connections, against
+rebuilding the whole graph.
+
+    PYTHONPATH=python python benchmarks/bench_churn.py --assets 2000 --shots 1000
+"""
+
+import argparse
+import random
+import time
+
+import loader
+import navigate
+
+import generate
+
+
+def add_stage(graph, config_loader, stage):
+    graph.add_node(stage)
+    for connection in config_loader.iter_connections(stage):
+        graph.add_connection(connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=2000)
+    parser.add_argument("--shots", type=int, default=1000)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--churn", type=int, default=200)
+    parser.add_argument(
+        "--indexed", action="store_true", help="Build the query indexes first"
+    )
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+
+    start = time.perf_counter()
+    graph = navigate.Graph()
+    for stage in stages:
+        add_stage(graph, config_loader, stage)
+    build_time = time.perf_counter() - start
+    connections = sum(1 for _ in graph.iter_connections())
+    if args.indexed:
+        graph.connections()
+        graph.ports()
+
+    rng = random.Random(args.seed)
+    shot_stages = [stage for stage in stages if stage.type() == "shot"]
+    removed = 0
+    remove_time = add_time = 0.0
+    for _ in range(args.churn):
+        shot = rng.choice(shot_stages)
+        start = time.perf_counter()
+        removed += len(graph.remove_node(shot))
+        remove_time += time.perf_counter() - start
+        start = time.perf_counter()
+        add_stage(graph, config_loader, shot)
+        add_time += time.perf_counter() - start
+    assert sum(1 for _ in graph.iter_connections()) == connections
+
+    print("{} connections, {} removed".format(connections, removed))
+    print("{:<10} {:>10.2f} ms".format("rebuild", build_time * 1000))
+    print("{:<10} {:>10.3f} ms".format("remove", remove_time * 1000 / args.churn))
+    print("{:<10} {:>10.3f} ms".format("add", add_time * 1000 / args.churn))
+    print(
+        "speedup    {:>10.0f} x".format(
+            build_time * args.churn / (remove_time + add_time)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Stress test of navigate.ConcurrentGraph. Reader threads query a synthetic
+project while a writer thread removes and re-adds connections, measuring the
+read throughput with and without the writer.
+
+    PYTHONPATH=python python benchmarks/bench_concurrent.py --readers 1 4 8
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import loader
+import navigate
+
+import generate
+
+
+def build(config, assets, shots):
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+    graph = navigate.Graph()
+    for stage in stages:
+        graph.add_node(stage)
+        for connection in config_loader.create_connections(stage):
+            graph.add_connection(connection)
+    return graph
+
+
+def run(graph, connections, readers, write, seconds, seed):
+    # Returns the reads and writes per second
+    stop = threading.Event()
+    counts = [0] * (readers + 1)
+    names = [node.name() for node in graph.iter_nodes()]
+
+    def read(index):
+        rng = random.Random(seed + index)
+        count = 0
+        while not stop.is_set():
+            connection = rng.choice(connections)
+            for _ in graph.connected(connection.source()):
+                pass
+            graph.incoming(connection.target())
+            graph.node(rng.choice(names))
+            count += 3
+        counts[index] = count
+
+    def update():
+        rng = random.Random(seed)
+        count = 0
+        while not stop.is_set():
+            connection = rng.choice(connections)
+            graph.remove_connection(connection)
+            graph.add_connection(connection)
+            count += 2
+        counts[-1] = count
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    if write:
+        threads.append(threading.Thread(target=update))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts[:-1]) / seconds, counts[-1] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--shots", type=int, default=100)
+    parser.add_argument("--min-instances", type=int, default=10)
+    parser.add_argument("--max-instances", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    graph = navigate.ConcurrentGraph(build(config, assets, shots))
+    connections = list(graph.iter_connections())
+
+    print(
+        "{:<8} {:>14} {:>14} {:>14}".format(
+            "readers", "reads/s", "reads/s (w)", "writes/s (w)"
+        )
+    )
+    for readers in args.readers:
+        reads, _ = run(graph, connections, readers, False, args.seconds, args.seed)
+        contended, writes = run(
+            graph, connections, readers, True, args.seconds, args.seed
+        )
+        print(
+            "{:<8} {:>14.0f} {:>14.0f} {:>14.0f}".format(
+                readers, reads, contended, writes
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
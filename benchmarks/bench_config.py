@@ -0,0 +1,56 @@
+"""
+Compares parsing and compiling a config with yaml.safe_load and ConfigLoader
+against loader.load, the first time when it compiles and caches the config and
+again when it reuses the cached config.
+
+    PYTHONPATH=python python benchmarks/bench_config.py --extra-workspaces 2000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+import loader
+
+import generate
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def compile_config(path):
+    with open(path) as f:
+        return loader.ConfigLoader(yaml.safe_load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--extra-workspaces", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "graph.yml")
+        with open(path, "w") as f:
+            yaml.safe_dump(generate.generate_config(args.extra_workspaces), f)
+        cache_dir = os.path.join(directory, "cache")
+
+        print("{:.1f} MB config".format(os.path.getsize(path) / 1024 / 1024))
+        print("{:<8} {:>10.3f} s".format("yaml", timed(compile_config, path)))
+        print("{:<8} {:>10.3f} s".format("cold", timed(loader.load, path, cache_dir)))
+        print("{:<8} {:>10.3f} s".format("cached", timed(loader.load, path, cache_dir)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Times diff.diff between two builds of a synthetic project, the second with
+some of the shots changed, for an increasing number of shots to show the
+diff grows linearly with the size of the graph.
+
+    PYTHONPATH=python python benchmarks/bench_diff.py --shots 250 500 1000
+"""
+
+import argparse
+import time
+
+import diff
+import loader
+import navigate
+
+import generate
+
+
+def build(config, assets, shots):
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+    graph = navigate.Graph()
+    for stage in stages:
+        graph.add_node(stage)
+        for connection in config_loader.create_connections(stage):
+            graph.add_connection(connection)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=500)
+    parser.add_argument("--shots", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--changed", type=int, default=10)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+
+    print(
+        "{:<8} {:>12} {:>10} {:>10} {:>10}".format(
+            "shots", "connections", "added", "removed", "seconds"
+        )
+    )
+    for count in args.shots:
+        shots = generate.generate_shots(
+            count,
+            assets,
+            min_instances=args.min_instances,
+            max_instances=args.max_instances,
+            seed=args.seed,
+        )
+        # The same shots with different instances for the last few
+        changed = (
+            shots[: -args.changed]
+            + generate.generate_shots(
+                count,
+                assets,
+                min_instances=args.min_instances,
+                max_instances=args.max_instances,
+                seed=args.seed + 1,
+            )[-args.changed :]
+        )
+        old = build(config, assets, shots)
+        new = build(config, assets, changed)
+        connections = sum(1 for _ in new.iter_connections())
+
+        start = time.perf_counter()
+        result = diff.diff(old, new)
+        seconds = time.perf_counter() - start
+        print(
+            "{:<8} {:>12} {:>10} {:>10} {:>10.2f}".format(
+                count,
+                connections,
+                len(result.connections.added),
+                len(result.connections.removed),
+                seconds,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares the per-call cost of the compiled expression cache against the
+original regex scan over every slice of the expression.
+
+    PYTHONPATH=python python benchmarks/bench_expression.py
+"""
+
+import argparse
+import re
+import timeit
+
+import exceptions
+import expression
+
+
+def legacy_parse_expression(expression, keywords):
+    current = None
+    index = 0
+    while index < len(expression):
+        match = re.match(r"((\.)|(\[))?(\w+)(?(3)\])", expression[index:])
+        if match is None:
+            raise exceptions.InvalidExpression("Malformed expression")
+
+        accessor, _, _, value = match.groups()
+        if current is None:
+            current = keywords[value]
+        elif accessor == ".":
+            current = getattr(current, value)
+        else:
+            current = current[value]
+
+        index += match.end()
+
+    return current
+
+
+class Instance(object):
+    def __init__(self, asset):
+        self.asset = asset
+
+
+CASES = [
+    ("stage[is_rigged]", {"stage": {"is_rigged": True}}),
+    ("item.asset", {"item": Instance("assetA")}),
+    ("stage[a][b][c]", {"stage": {"a": {"b": {"c": 1}}}}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(
+        "{:<20} {:>12} {:>12} {:>8}".format(
+            "expression", "legacy", "compiled", "speedup"
+        )
+    )
+    for text, keywords in CASES:
+        legacy = timeit.timeit(
+            lambda: legacy_parse_expression(text, keywords), number=args.number
+        )
+        compiled = timeit.timeit(
+            lambda: expression.parse(text, keywords), number=args.number
+        )
+        print(
+            "{:<20} {:>9.3f} us {:>9.3f} us {:>7.1f}x".format(
+                text,
+                legacy / args.number * 1e6,
+                compiled / args.number * 1e6,
+                legacy / compiled,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures Graph.add_connection, Graph.connected and Graph.connections at
+increasing graph sizes. The cost per connection and per query should stay
+flat as the graph grows.
+
+    PYTHONPATH=python python benchmarks/bench_graph.py
+"""
+
+import argparse
+import time
+
+import constants
+import navigate
+import nodes
+
+
+def build_ports(count):
+    sources = []
+    targets = []
+    for index in range(count):
+        node = nodes.Node("workspace", "node{}".format(index))
+        source = nodes.Port(constants.PortType.Output, "out")
+        target = nodes.Port(constants.PortType.Input, "in")
+        node.add_port(source)
+        node.add_port(target)
+        sources.append(source)
+        targets.append(target)
+    return sources, targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "sizes", nargs="*", type=int, default=[10000, 20000, 40000, 80000, 160000]
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:>10} {:>12} {:>14} {:>14} {:>14}".format(
+            "connections", "build", "per add", "per connected", "per group"
+        )
+    )
+    for size in args.sizes:
+        sources, targets = build_ports(size)
+        # Chain every node into the next so each input holds one connection,
+        # each in its own group
+        connections = [
+            nodes.Connection(sources[i], targets[i + 1], group=i)
+            for i in range(size - 1)
+        ]
+
+        graph = navigate.Graph()
+        start = time.perf_counter()
+        for connection in connections:
+            graph.add_connection(connection)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for port in sources:
+            for _ in graph.connected(port):
+                pass
+        query = time.perf_counter() - start
+
+        # The first query builds the indexes
+        graph.connections(group=-1)
+        groups = range(0, size - 1, max(1, size // 1000))
+        start = time.perf_counter()
+        for group in groups:
+            graph.connections(group=group, internal=True)
+        group_query = time.perf_counter() - start
+
+        print(
+            "{:>10} {:>10.3f} s {:>11.3f} us {:>11.3f} us {:>11.3f} us".format(
+                len(connections),
+                build,
+                build / len(connections) * 1e6,
+                query / len(sources) * 1e6,
+                group_query / len(groups) * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
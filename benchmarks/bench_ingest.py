@@ -0,0 +1,77 @@
+"""
+Times ingest.build_graph on a synthetic project whose stage data is fetched
+from an in-process provider with a simulated latency, for an increasing
+number of concurrent fetches.
+
+    PYTHONPATH=python python benchmarks/bench_ingest.py --delay 0.005 --limits 1 8 32
+"""
+
+import argparse
+import asyncio
+import time
+
+import ingest
+import loader
+import nodes
+
+import generate
+
+
+def convert(stage_type, name, data, parent):
+    # Shots are fetched as (name, animated, static) with assets by name
+    if stage_type != "shot":
+        return data
+    _, animated, static = data
+    asset_nodes = {asset: parent.child(asset) for _, asset in animated + static}
+    return generate.shot_data(animated, static, asset_nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--shots", type=int, default=100)
+    parser.add_argument("--min-instances", type=int, default=10)
+    parser.add_argument("--max-instances", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--delay", type=float, default=0.005)
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    data = {("asset", name): asset_data for name, asset_data in assets}
+    data.update({("shot", shot[0]): shot for shot in shots})
+
+    print("{:<10} {:>10} {:>10}".format("limit", "seconds", "speedup"))
+    serial = None
+    for limit in args.limits:
+        provider = ingest.LocalProvider(data, delay=args.delay)
+        project = nodes.Node("project", "project")
+        start = time.perf_counter()
+        asyncio.run(
+            ingest.build_graph(
+                loader.ConfigLoader(config),
+                provider,
+                list(data),
+                parent=project,
+                limit=limit,
+                convert=convert,
+            )
+        )
+        seconds = time.perf_counter() - start
+        if serial is None:
+            serial = seconds
+        print("{:<10} {:>10.2f} {:>9.1f}x".format(limit, seconds, serial / seconds))
+
+
+if __name__ == "__main__":
+    main()
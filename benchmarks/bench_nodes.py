@@ -0,0 +1,170 @@
+"""
+Compares memory and throughput of building a graph from the slotted
+nodes.Port/Node/Connection classes against dict-backed equivalents with
+uncached hashes, the layout they had before.
+
+    PYTHONPATH=python python benchmarks/bench_nodes.py --ports 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import constants
+import navigate
+import nodes
+
+
+class LegacyPort(object):
+    def __init__(self, type, name, multi=False, metadata=None):
+        self._type = type
+        self._name = name
+        self._node = None
+        self._is_multi = multi
+        self.metadata = metadata or {}
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, LegacyPort)
+            and self.node() == other.node()
+            and self.type() == other.type()
+            and self.name() == other.name()
+        )
+
+    def __hash__(self):
+        return hash((self.node(), self.type(), self.name()))
+
+    def name(self):
+        return self._name
+
+    def type(self):
+        return self._type
+
+    def is_multi(self):
+        return self._is_multi
+
+    def node(self):
+        return self._node
+
+
+class LegacyNode(object):
+    def __init__(self, type, name, metadata=None):
+        self._type = type
+        self._name = name
+        self._parent = None
+        self.metadata = metadata or {}
+        self._children = {}
+        self._ports = []
+        self._child_index = {}
+        self._port_index = {}
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__)
+            and self.type() == other.type()
+            and self.name() == other.name()
+        )
+
+    def __hash__(self):
+        return hash((self.type(), self.name()))
+
+    def name(self):
+        return self._name
+
+    def type(self):
+        return self._type
+
+    def add_port(self, port):
+        port._node = self
+        self._ports.append(port)
+        self._port_index.setdefault((port.type(), port.name()), port)
+
+
+class LegacyConnection(object):
+    def __init__(self, source, target, group=None, internal=True, metadata=None):
+        self._source = source
+        self._target = target
+        self._internal = internal
+        self.group = group
+        self.metadata = metadata or {}
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, LegacyConnection)
+            and self.source() == other.source()
+            and self.target() == other.target()
+        )
+
+    def __hash__(self):
+        return hash((self.source(), self.target()))
+
+    def source(self):
+        return self._source
+
+    def target(self):
+        return self._target
+
+
+# Port names repeat for every node, as they do for every stage in a project
+PORT_NAMES = ["model", "rig", "material", "texture", "review"]
+
+
+def build(port_count, node_cls, port_cls, connection_cls):
+    # Every node has an input and an output for each port name, each output
+    # connects to the matching input on the next node
+    node_count = port_count // (len(PORT_NAMES) * 2)
+    previous = None
+    graph = navigate.Graph()
+    for index in range(node_count):
+        node = node_cls("workspace", "node{}".format(index))
+        for name in PORT_NAMES:
+            # Built names mimic strings read from a config file, which are not
+            # shared between stages unless interned
+            node.add_port(port_cls(constants.PortType.Input, "".join(name)))
+            node.add_port(port_cls(constants.PortType.Output, "".join(name)))
+        if previous is not None:
+            for source, target in zip(previous._ports[1::2], node._ports[::2]):
+                graph.add_connection(connection_cls(source, target))
+        previous = node
+    return graph
+
+
+def measure(label, port_count, node_cls, port_cls, connection_cls):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    graph = build(port_count, node_cls, port_cls, connection_cls)
+    build_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Membership checks hash every connection and both of its ports
+    connections = list(graph.iter_connections())
+    start = time.perf_counter()
+    for connection in connections:
+        assert connection in graph._connections
+    lookup_time = time.perf_counter() - start
+
+    print(
+        "{:<8} {:>10.2f} s {:>10.1f} MB {:>10.3f} us".format(
+            label,
+            build_time,
+            peak / 1024 / 1024,
+            lookup_time / len(connections) * 1e6,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ports", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print("{:<8} {:>12} {:>13} {:>13}".format("", "build", "peak memory", "lookup"))
+    measure("legacy", args.ports, LegacyNode, LegacyPort, LegacyConnection)
+    measure("slotted", args.ports, nodes.Node, nodes.Port, nodes.Connection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Times parallel.build_graph on a synthetic project for an increasing number
+of processes, against the serial build.
+
+    PYTHONPATH=python python benchmarks/bench_parallel.py --processes 1 2 4 8
+"""
+
+import argparse
+import time
+
+import loader
+import parallel
+
+import generate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=2000)
+    parser.add_argument("--shots", type=int, default=1000)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+
+    print("{:<10} {:>10} {:>10}".format("processes", "seconds", "speedup"))
+    serial = None
+    for processes in args.processes:
+        start = time.perf_counter()
+        parallel.build_graph(config_loader, stages, processes=processes)
+        seconds = time.perf_counter() - start
+        if serial is None:
+            serial = seconds
+        print("{:<10} {:>10.2f} {:>9.1f}x".format(processes, seconds, serial / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares building a synthetic project from its config against loading it
+from a snapshot saved with snapshot.save.
+
+    PYTHONPATH=python python benchmarks/bench_snapshot.py --assets 2000 --shots 1000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import loader
+import navigate
+import snapshot
+
+import generate
+
+
+def build(config, assets, shots):
+    config_loader = loader.ConfigLoader(config)
+    _, stages = generate.create_project(config_loader, assets, shots)
+    graph = navigate.Graph()
+    for stage in stages:
+        graph.add_node(stage)
+        for connection in config_loader.create_connections(stage):
+            graph.add_connection(connection)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--assets", type=int, default=2000)
+    parser.add_argument("--shots", type=int, default=1000)
+    parser.add_argument("--min-instances", type=int, default=50)
+    parser.add_argument("--max-instances", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = generate.generate_config()
+    assets = generate.generate_assets(args.assets, seed=args.seed)
+    shots = generate.generate_shots(
+        args.shots,
+        assets,
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        seed=args.seed,
+    )
+
+    start = time.perf_counter()
+    graph = build(config, assets, shots)
+    build_time = time.perf_counter() - start
+    connections = sum(1 for _ in graph.iter_connections())
+
+    fd, path = tempfile.mkstemp(suffix=".snapshot")
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        snapshot.save(graph, path, snapshot.fingerprint(config))
+        save_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del graph
+
+        start = time.perf_counter()
+        loaded = snapshot.load(path, snapshot.fingerprint(config))
+        load_time = time.perf_counter() - start
+        assert sum(1 for _ in loaded.iter_connections()) == connections
+    finally:
+        os.remove(path)
+
+    print("{} connections, {:.1f} MB snapshot".format(connections, size / 1024 / 1024))
+    print("{:<8} {:>10.2f} s".format("build", build_time))
+    print("{:<8} {:>10.2f} s".format("save", save_time))
+    print("{:<8} {:>10.2f} s".format("load", load_time))
+    print("speedup  {:>10.1f} x".format(build_time / load_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Generates synthetic production-scale configs and stage data for the
+benchmarks. Everything is driven by a seeded random.Random so the same
+parameters always produce the same project.
+"""
+
+import os
+import random
+
+import yaml
+
+import nodes
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "graph.yml")
+
+
+class Instance(object):
+    def __init__(self, name, asset):
+        self.name = name
+        self.asset = asset
+
+    def __repr__(self):
+        return "{s.__class__.__name__}({s.name!r})".format(s=self)
+
+
+def generate_config(extra_workspaces=0, path=CONFIG_PATH):
+    # Extends the example config with extra asset and shot workspaces, each
+    # taking an internal input so that larger configs also produce more
+    # connections per stage
+    with open(path) as f:
+        config = yaml.safe_load(f)
+
+    stages = config["stages"]
+    for index in range(extra_workspaces):
+        for stage_type, source in (("asset", "modeling"), ("shot", "layout")):
+            source_port = "model" if stage_type == "asset" else "layout"
+            stages[stage_type]["workspaces"]["extra{}".format(index)] = {
+                "ports": {
+                    "input": {
+                        source_port: {
+                            "connections": [
+                                {
+                                    "type": "internal",
+                                    "workspace": source,
+                                    "port_name": source_port,
+                                }
+                            ]
+                        }
+                    },
+                    "output": {"cache": {}, "review": {}},
+                }
+            }
+    return config
+
+
+def generate_assets(count, rigged_ratio=0.5, seed=0):
+    # Returns a list of (name, data) for asset stages
+    rng = random.Random(seed)
+    return [
+        (
+            "asset{:05d}".format(index),
+            {"is_rigged": {"type": "bool", "value": rng.random() < rigged_ratio}},
+        )
+        for index in range(count)
+    ]
+
+
+def generate_shots(
+    count, assets, min_instances=50, max_instances=500, distinct=20, seed=0
+):
+    # Returns a list of (name, animated, static) where animated and static are
+    # lists of (instance name, asset name). Like crowds and set dressing, each
+    # shot reuses a handful of distinct assets many times. Only rigged assets
+    # are animated.
+    rng = random.Random(seed + 1)
+    rigged = [name for name, data in assets if data["is_rigged"]["value"]]
+    unrigged = [name for name, data in assets if not data["is_rigged"]["value"]]
+    shots = []
+    for index in range(count):
+        cast = rng.sample(rigged, min(len(rigged), distinct // 2))
+        dressing = rng.sample(unrigged, min(len(unrigged), distinct - len(cast)))
+        animated = []
+        static = []
+        for instance in range(rng.randint(min_instances, max_instances)):
+            if cast and (not dressing or rng.random() < 0.5):
+                asset = rng.choice(cast)
+                instances = animated
+            else:
+                asset = rng.choice(dressing)
+                instances = static
+            instances.append(("{}_{}".format(asset, instance), asset))
+        shots.append(("shot{:05d}".format(index), animated, static))
+    return shots
+
+
+def shot_data(animated, static, asset_nodes):
+    # Builds the stage data for a shot once its assets exist
+    return {
+        "animated_instances": {
+            "type": "list",
+            "value": [Instance(name, asset_nodes[asset]) for name, asset in animated],
+        },
+        "static_instances": {
+            "type": "list",
+            "value": [Instance(name, asset_nodes[asset]) for name, asset in static],
+        },
+    }
+
+
+def create_project(config_loader, assets, shots):
+    # Creates the stage nodes for a generated project. Returns the root node
+    # and the stages in creation order.
+    root = nodes.Node("root", "pipeline")
+    project = config_loader.create_stage_node("project", "project", {}, root)
+    stages = [project]
+    asset_nodes = {}
+    for name, data in assets:
+        asset_nodes[name] = config_loader.create_stage_node(
+            "asset", name, data, project
+        )
+        stages.append(asset_nodes[name])
+    for name, animated, static in shots:
+        stages.append(
+            config_loader.create_stage_node(
+                "shot", name, shot_data(animated, static, asset_nodes), project
+            )
+        )
+    return root, stages
@@ -0,0 +1,154 @@
+import numpy
+
+import constants
+import navigate
+
+# Ports and stages are numbered in the order they are first found, ids are
+# indexes into these arrays
+INDEX_TYPE = numpy.int64
+
+
+class CSR(object):
+    # The connections of a graph as compressed sparse row arrays: the targets
+    # of port i are indices[indptr[i]:indptr[i + 1]], and the sources of port
+    # i are reverse_indices[reverse_indptr[i]:reverse_indptr[i + 1]]. Each port
+    # belongs to the stage port_stages[i], or -1 if it has none.
+    def __init__(self, ports, port_ids, stages, port_stages, sources, targets):
+        self.ports = ports
+        self.port_ids = port_ids
+        self.stages = stages
+        self.port_stages = port_stages
+        self.indptr, self.indices = _compress(sources, targets, len(ports))
+        self.reverse_indptr, self.reverse_indices = _compress(
+            targets, sources, len(ports)
+        )
+
+    def __len__(self):
+        return len(self.ports)
+
+    def edge_count(self):
+        return len(self.indices)
+
+    def ids(self, ports):
+        return numpy.fromiter((self.port_ids[port] for port in ports), dtype=INDEX_TYPE)
+
+    def ports_for(self, ids):
+        return [self.ports[i] for i in ids]
+
+    def out_degree(self):
+        return numpy.diff(self.indptr)
+
+    def in_degree(self):
+        return numpy.diff(self.reverse_indptr)
+
+    def stage_degree(self, degree):
+        # Sums a per port degree for each stage, eg, the stage in_degree of
+        # the most depended upon assets
+        mask = self.port_stages >= 0
+        return numpy.bincount(
+            self.port_stages[mask],
+            weights=degree[mask],
+            minlength=len(self.stages),
+        ).astype(INDEX_TYPE)
+
+    def bfs(self, sources, reverse=False):
+        # Returns the number of steps from the nearest of the source port ids
+        # to each port, or -1 for ports which can't be reached. Follows
+        # connections upstream if reverse is set.
+        if reverse:
+            indptr, indices = self.reverse_indptr, self.reverse_indices
+        else:
+            indptr, indices = self.indptr, self.indices
+        distances = numpy.full(len(self.ports), -1, dtype=INDEX_TYPE)
+        frontier = numpy.unique(numpy.asarray(sources, dtype=INDEX_TYPE))
+        distances[frontier] = 0
+        depth = 0
+        while len(frontier):
+            depth += 1
+            neighbours = indices[_edge_range(indptr, frontier)]
+            frontier = numpy.unique(neighbours[distances[neighbours] < 0])
+            distances[frontier] = depth
+        return distances
+
+
+def _compress(sources, targets, size):
+    order = numpy.argsort(sources, kind="stable")
+    indptr = numpy.zeros(size + 1, dtype=INDEX_TYPE)
+    numpy.cumsum(numpy.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, targets[order]
+
+
+def _edge_range(indptr, frontier):
+    # The positions in the indices of the edges leaving each port in frontier,
+    # ie, the concatenated ranges indptr[i]:indptr[i + 1]
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = counts.sum()
+    if not total:
+        return numpy.zeros(0, dtype=INDEX_TYPE)
+    offsets = numpy.repeat(starts - numpy.cumsum(counts) + counts, counts)
+    return offsets + numpy.arange(total, dtype=INDEX_TYPE)
+
+
+# Exports the connections of a graph for analysis. If workspaces is set, the
+# inputs of a workspace also lead to its outputs, the same as the graph's
+# downstream() and upstream().
+def export(graph, workspaces=True):
+    ports = []
+    port_ids = {}
+    stages = []
+    stage_ids = {}
+    port_stages = []
+    sources = []
+    targets = []
+
+    def number(port):
+        index = port_ids.get(port)
+        if index is None:
+            index = port_ids[port] = len(ports)
+            ports.append(port)
+            stage = navigate._stage(port)
+            if stage is None:
+                port_stages.append(-1)
+            else:
+                stage_index = stage_ids.get(stage)
+                if stage_index is None:
+                    stage_index = stage_ids[stage] = len(stages)
+                    stages.append(stage)
+                port_stages.append(stage_index)
+        return index
+
+    # Workspaces are keyed by their identity, the same as their ports
+    workspace_nodes = {}
+    for connection in graph.iter_connections():
+        source = connection.source()
+        if source is None:
+            continue
+        sources.append(number(source))
+        targets.append(number(connection.target()))
+        if workspaces:
+            for port in (source, connection.target()):
+                node = port.node()
+                if node is not None and node.type() == constants.NodeType.Workspace:
+                    workspace_nodes.setdefault(node, node)
+
+    for node in workspace_nodes.values():
+        inputs = []
+        outputs = []
+        for port in node.ports():
+            if port.type() == constants.PortType.Input:
+                inputs.append(number(port))
+            elif port.type() == constants.PortType.Output:
+                outputs.append(number(port))
+        for source in inputs:
+            sources.extend([source] * len(outputs))
+            targets.extend(outputs)
+
+    return CSR(
+        ports,
+        port_ids,
+        stages,
+        numpy.array(port_stages, dtype=INDEX_TYPE),
+        numpy.array(sources, dtype=INDEX_TYPE),
+        numpy.array(targets, dtype=INDEX_TYPE),
+    )
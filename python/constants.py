@@ -1,3 +1,7 @@
 class PortType(object):
     Output = "output"
     Input = "input"
+
+
+class NodeType(object):
+    Workspace = "workspace"
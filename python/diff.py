@@ -0,0 +1,109 @@
+import collections
+import collections.abc
+import hashlib
+
+import nodes
+import snapshot
+
+# Items in the new graph which aren't in the old, items in the old graph which
+# aren't in the new and (old, new) pairs for items in both whose content
+# differs
+Changes = collections.namedtuple("Changes", ["added", "removed", "changed"])
+Diff = collections.namedtuple("Diff", ["nodes", "ports", "connections"])
+
+
+def _canonical(value, active):
+    # A representation of a value which is the same for equal content built
+    # in different processes. Nodes and ports are represented by their
+    # identity, other objects by their class and attributes.
+    if value is None or isinstance(value, (str, bytes, bool, int, float)):
+        return value
+    if isinstance(value, nodes.Node):
+        return ("Node", value.type(), value.name())
+    if isinstance(value, nodes.Port):
+        return ("Port", _canonical(value.node(), active), value.type(), value.name())
+
+    if id(value) in active:
+        # Recursive references
+        return ("...",)
+    active.add(id(value))
+    try:
+        if isinstance(value, collections.abc.Mapping):
+            return (
+                "dict",
+                tuple(
+                    sorted((repr(k), _canonical(v, active)) for k, v in value.items())
+                ),
+            )
+        if isinstance(value, (list, tuple, collections.abc.Sequence)):
+            return ("list", tuple(_canonical(v, active) for v in value))
+        if isinstance(value, (set, frozenset)):
+            return ("set", tuple(sorted(repr(_canonical(v, active)) for v in value)))
+        attributes = getattr(value, "__dict__", None)
+        if attributes is not None:
+            return (
+                value.__class__.__name__,
+                _canonical(attributes, active),
+            )
+        return (value.__class__.__name__, repr(value))
+    finally:
+        active.discard(id(value))
+
+
+def content_hash(item):
+    # A hash of the content of a node, port or connection which is stable
+    # across processes, excluding its identity
+    if isinstance(item, nodes.Connection):
+        content = (item.is_internal(), item.group, item.metadata)
+    elif isinstance(item, nodes.Port):
+        content = (item.is_multi(), item.metadata)
+    else:
+        content = (item.metadata,)
+    data = repr(_canonical(content, set())).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _collect(graph):
+    # The nodes, ports and connections of a graph, each keyed by itself so
+    # that the item equal to another can be looked up. Ports include those on
+    # the descendants of the graph's nodes.
+    graph_nodes = {}
+    ports = {}
+    for node in graph.iter_nodes():
+        graph_nodes.setdefault(node, node)
+        for descendant in graph.iter_descendants(node):
+            for port in descendant.ports():
+                ports.setdefault(port, port)
+
+    connections = {}
+    for connection in graph.iter_connections():
+        connections.setdefault(connection, connection)
+        for port in (connection.source(), connection.target()):
+            if port is not None:
+                ports.setdefault(port, port)
+    return graph_nodes, ports, connections
+
+
+def _changes(old, new):
+    added = [item for item in new if item not in old]
+    removed = [item for item in old if item not in new]
+    changed = []
+    for item, new_item in new.items():
+        old_item = old.get(item)
+        if old_item is not None and content_hash(old_item) != content_hash(new_item):
+            changed.append((old_item, new_item))
+    return Changes(added, removed, changed)
+
+
+# Compares two graphs using the identity of nodes (type and name), ports
+# (node, type and name) and connections (source and target), so items from
+# separate builds match up. Items present in both are compared by their
+# content_hash(). Workspaces share their identity across stages, so only the
+# first of each workspace port found is compared.
+def diff(old, new):
+    return Diff(*(_changes(a, b) for a, b in zip(_collect(old), _collect(new))))
+
+
+def diff_snapshot(path, graph, fingerprint=None):
+    # Compares a graph against a snapshot saved with snapshot.save()
+    return diff(snapshot.load(path, fingerprint), graph)
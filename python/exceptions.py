@@ -12,3 +12,11 @@ class InvalidExpression(ExpressionError):
 
 class MissingData(ExpressionError):
     pass
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class StaleSnapshot(SnapshotError):
+    pass
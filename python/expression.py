@@ -0,0 +1,87 @@
+import functools
+import operator
+import re
+
+import exceptions
+
+# Matches any of the following:
+#   word
+#   .word
+#   [word]
+TOKEN_PATTERN = re.compile(r"((\.)|(\[))?(\w+)(?(3)\])")
+
+# Maximum number of distinct expressions held by the compile cache
+CACHE_SIZE = 1024
+
+
+class Expression(object):
+    def __init__(self, text, keyword, accessors):
+        self._text = text
+        self._keyword = keyword
+        self._accessors = tuple(accessors)
+        self._getters = tuple(
+            (
+                operator.attrgetter(value)
+                if accessor == "."
+                else operator.itemgetter(value)
+            )
+            for accessor, value in self._accessors
+        )
+
+    def __repr__(self):
+        return "{s.__class__.__name__}({s._text!r})".format(s=self)
+
+    def text(self):
+        return self._text
+
+    def keyword(self):
+        return self._keyword
+
+    def accessors(self):
+        return self._accessors
+
+    def evaluate(self, keywords):
+        if self._keyword is None:
+            return None
+
+        try:
+            current = keywords[self._keyword]
+            for getter in self._getters:
+                current = getter(current)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise exceptions.MissingData(
+                "Failed to resolve expression {} with keywords {}: {}".format(
+                    self._text, keywords, e
+                )
+            ) from e
+
+        return current
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile(expression):
+    keyword = None
+    accessors = []
+    index = 0
+    while index < len(expression):
+        match = TOKEN_PATTERN.match(expression, index)
+        if match is None:
+            raise exceptions.InvalidExpression("Malformed expression")
+
+        accessor, _, _, value = match.groups()
+        if keyword is None:
+            keyword = value
+        elif accessor is None:
+            raise exceptions.InvalidExpression(
+                "Missing accessor for keyword: {}".format(value)
+            )
+        else:
+            accessors.append((accessor, value))
+
+        index = match.end()
+
+    return Expression(expression, keyword, accessors)
+
+
+def parse(expression, keywords):
+    return compile(expression).evaluate(keywords)
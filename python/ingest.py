@@ -0,0 +1,71 @@
+import asyncio
+
+import navigate
+
+# The default number of stages whose data is fetched at once
+DEFAULT_LIMIT = 16
+
+
+class LocalProvider(object):
+    # An in-process provider for tests and benchmarks, returning the data held
+    # for each (stage type, name) after an optional delay which stands in for
+    # the latency of a tracking service. Records the most fetches in flight
+    # at once as max_active.
+    def __init__(self, data, delay=0.0):
+        self._data = data
+        self._delay = delay
+        self._active = 0
+        self.max_active = 0
+
+    async def __call__(self, stage_type, name):
+        self._active += 1
+        self.max_active = max(self.max_active, self._active)
+        try:
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            return self._data[(stage_type, name)]
+        finally:
+            self._active -= 1
+
+
+async def _fetch(provider, semaphore, stage_type, name):
+    async with semaphore:
+        return await provider(stage_type, name)
+
+
+# Builds a graph of stages whose data is fetched by provider, an async
+# callable taking a stage type and name and returning the stage data. Up to
+# limit stages are fetched at once while earlier stages are created and
+# connected, in the order given, so the graph is the same as a serial build.
+#
+# Data can only refer to nodes once they exist, so stages must come after the
+# stages their data refers to, and convert, if given, is called with
+# (stage_type, name, data, parent) as each stage is created to return the data
+# to create it with, eg, replacing asset names with the asset nodes.
+async def build_graph(
+    config_loader, provider, stages, parent=None, limit=DEFAULT_LIMIT, convert=None
+):
+    if limit < 1:
+        raise ValueError("Limit must be at least 1: {}".format(limit))
+    stages = list(stages)
+    semaphore = asyncio.Semaphore(limit)
+    fetches = [
+        asyncio.ensure_future(_fetch(provider, semaphore, stage_type, name))
+        for stage_type, name in stages
+    ]
+
+    graph = navigate.Graph()
+    try:
+        for (stage_type, name), fetch in zip(stages, fetches):
+            data = await fetch
+            if convert is not None:
+                data = convert(stage_type, name, data, parent)
+            stage_node = config_loader.create_stage_node(stage_type, name, data, parent)
+            graph.add_node(stage_node)
+            for connection in config_loader.iter_connections(stage_node):
+                graph.add_connection(connection)
+    finally:
+        # Stops fetching the remaining stages if one fails
+        for fetch in fetches:
+            fetch.cancel()
+    return graph
@@ -1,165 +1,458 @@
 import copy
+import hashlib
+import os
+import pickle
+import tempfile
+
+import yaml
 
 import constants
+import expression
+import meta
 import nodes
-import util
+import templates
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maximum number of resolved scopes held before the cache is reset
+RESOLVED_SCOPE_CACHE_SIZE = 4096
+
+# Types of values compared all at once with numpy, as long as all the values
+# compared have the same type
+_VECTORIZED_TYPES = {bool, int, float, str}
+
+
+def _source_hash(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Part of the key for compiled configs cached by load(), a hash of the modules
+# which define what is pickled, so that compiled configs are never reused
+# after any of them changes
+COMPILED_VERSION = _source_hash(
+    [templates.__file__, expression.__file__, meta.__file__, __file__]
+)
+
+# The C YAML loader is much faster, but is only available if PyYAML was built
+# against libyaml
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _depends_on(dependencies, keys):
+    return dependencies is None or not keys.isdisjoint(dependencies)
 
 
 class ConfigLoader(object):
-    def __init__(self, config):
+    # Timings and counts are collected into profiler if one is given, see
+    # profiling.Profiler
+    def __init__(self, config, profiler=None):
         self._config = config
+        self._profiler = profiler
+        # Each stage type is compiled once into a template which is reused for
+        # every stage created from it
+        self._templates = {
+            stage_type: templates.StageTemplate(stage_type, stage_config)
+            for stage_type, stage_config in config["stages"].items()
+        }
+        # Resolved scopes keyed by the scope and the values of the stage
+        # metadata its conditions read
+        self._resolved_scopes = {}
+
+    def __getstate__(self):
+        # The profiler and resolved scopes are specific to a build
+        state = self.__dict__.copy()
+        state["_profiler"] = None
+        state["_resolved_scopes"] = {}
+        return state
+
+    def config(self):
+        return self._config
 
     def _merge_metadata(self, metadata, data):
-        d = copy.deepcopy(metadata)
-        # TODO: Recursive merge
-        d.update(data)
-        return d
-
-    def _resolve_conditional(self, conditional, keywords):
-        condition_type = conditional["type"]
-        if condition_type == "boolean":
-            value = bool(util.parse_expression(conditional["source"], keywords))
-            return not value if conditional.get("invert") else value
-        elif condition_type == "comparison":
-            comparison = conditional["comparison"]
-            source = util.parse_expression(conditional["source"], keywords)
-            target = util.parse_expression(conditional["target"], keywords)
-            if comparison == "in":
-                return source in target
-            else:
-                raise ValueError(
-                    "Unsupported comparison operator: {}".format(comparison)
-                )
+        # The stage defaults are shared with the template until written to
+        return meta.Metadata(metadata, data)
+
+    def _resolve_conditional(self, condition, keywords):
+        if self._profiler is None:
+            return self._evaluate_conditional(condition, keywords)
+
+        start = self._profiler.timer()
+        result = self._evaluate_conditional(condition, keywords)
+        self._profiler.add_condition(condition, self._profiler.timer() - start)
+        for expression in condition.expressions():
+            self._profiler.add_expression(expression)
+        return result
+
+    def _evaluate_conditional(self, condition, keywords):
+        if condition.type == "boolean":
+            value = bool(condition.source.evaluate(keywords))
+            return not value if condition.invert else value
         else:
-            raise ValueError("Unsupported conditional type: {}".format(condition_type))
-
-    def _load_port(self, node, port_type, port_name, port_config):
+            source = condition.source.evaluate(keywords)
+            target = condition.target.evaluate(keywords)
+            return source in target
+
+    def _evaluate_scope(self, scope, keywords):
+        # Returns the workspace and port templates in the scope whose
+        # conditions pass, in the order they are defined
+        workspaces = list(scope.workspaces)
+        ports = list(scope.ports)
+        for branch in scope.branches:
+            if all(
+                self._resolve_conditional(condition, keywords)
+                for condition in branch.conditions
+            ):
+                branch_workspaces, branch_ports = self._evaluate_scope(
+                    branch.scope, keywords
+                )
+                workspaces.extend(branch_workspaces)
+                ports.extend(branch_ports)
+        return workspaces, ports
+
+    def _resolve_scope(self, scope, keywords):
+        # Stages which share the values their conditions read share the same
+        # outcome, so only the first of them needs evaluating
+        if scope.dependencies is None:
+            return self._evaluate_scope(scope, keywords)
+
+        stage = keywords["stage"]
+        try:
+            key = (scope, tuple(stage[k] for k in scope.dependencies))
+            resolved = self._resolved_scopes.get(key)
+        except (KeyError, TypeError):
+            # Missing or unhashable values are evaluated directly
+            return self._evaluate_scope(scope, keywords)
+
+        if resolved is None:
+            workspaces, ports = self._evaluate_scope(scope, keywords)
+            resolved = (tuple(workspaces), tuple(ports))
+            if len(self._resolved_scopes) >= RESOLVED_SCOPE_CACHE_SIZE:
+                self._resolved_scopes.clear()
+            self._resolved_scopes[key] = resolved
+        return resolved
+
+    def _load_port(self, node, port_template):
         port = nodes.Port(
-            port_type,
-            port_name,
-            multi=port_config.get("multi", False),
-            metadata=port_config.get("data", {}),
+            port_template.type,
+            port_template.name,
+            multi=port_template.multi,
+            metadata=meta.Metadata(port_template.data),
         )
         node.add_port(port)
         return port
 
-    def _load_workspace(self, workspace_node, workspace_name, workspace_data):
+    def _load_workspace(self, stage_node, workspace_template):
         workspace = nodes.Node(
-            "workspace",
-            workspace_name,
-            parent=workspace_node,
-            metadata=workspace_data.get("data", {}),
+            constants.NodeType.Workspace,
+            workspace_template.name,
+            parent=stage_node,
+            metadata=meta.Metadata(workspace_template.data),
         )
-        for port_type, port_name, port_config in self._iter_port_configs(
-            workspace,
-            workspace_data,
-            {"stage": workspace.parent(), "workspace": workspace},
-        ):
-            self._load_port(workspace, port_type, port_name, port_config)
+        _, port_templates = self._resolve_scope(
+            workspace_template.scope, {"stage": stage_node, "workspace": workspace}
+        )
+        for port_template in port_templates:
+            self._load_port(workspace, port_template)
 
         return workspace
 
-    def _iter_port_configs(self, node, config, keywords):
-        for port_type, ports in config.get("ports", {}).items():
-            for port_name, port_config in ports.items():
-                yield port_type, port_name, port_config
-
-        for condition_data in config.get("conditional", []):
-            for conditional in condition_data["conditions"]:
-                if not self._resolve_conditional(conditional, keywords):
-                    break
-            else:
-                yield from self._iter_port_configs(node, condition_data, keywords)
+    def _load_stage(self, stage_node):
+        if self._profiler is not None:
+            start = self._profiler.timer()
+            self._build_stage(stage_node)
+            self._profiler.add_stage(stage_node.type(), self._profiler.timer() - start)
+        else:
+            self._build_stage(stage_node)
+
+    def _pending_stage(self, stage_node):
+        # Returns a callback which builds a lazy stage from its metadata as it
+        # is now, so that it is built the same as an eager stage even if the
+        # metadata changes, even in place, before it is first accessed
+        created = stage_node.metadata.copy(deep=True)
+        if self._profiler is not None:
+            self._profiler.add_copy("ConfigLoader.lazy_stage")
+
+        def load(node):
+            current = node.metadata
+            node.metadata = created
+            try:
+                self._load_stage(node)
+            finally:
+                node.metadata = current
+
+        return load
+
+    def _build_stage(self, stage_node):
+        template = self._templates[stage_node.type()]
+        workspace_templates, port_templates = self._resolve_scope(
+            template.scope, {"stage": stage_node}
+        )
+        self._load_templates(stage_node, workspace_templates, port_templates)
 
-    def _iter_workspace_configs(self, stage_node, stage_config):
-        for workspace_name, workspace_data in stage_config["workspaces"].items():
-            yield workspace_name, workspace_data
+    def _load_templates(self, stage_node, workspace_templates, port_templates):
+        for workspace_template in workspace_templates:
+            self._load_workspace(stage_node, workspace_template)
 
-        for condition_data in stage_config.get("conditional", []):
-            for conditional in condition_data["conditions"]:
-                if not self._resolve_conditional(conditional, {"stage": stage_node}):
-                    break
-            else:
-                yield from self._iter_workspace_configs(stage_node, condition_data)
+        for port_template in port_templates:
+            self._load_port(stage_node, port_template)
 
     # Creates an entity node and all it's contained workspaces. Does not create
-    # connections.
-    def create_stage_node(self, type, name, data, parent=None):
-        config = self._config["stages"][type]
-        metadata = self._merge_metadata(config.get("data", {}), data)
+    # connections. Lazy nodes create their workspaces and ports on first
+    # access, from the stage metadata as it was when the node was created.
+    def create_stage_node(self, type, name, data, parent=None, lazy=False):
+        template = self._templates[type]
+        metadata = self._merge_metadata(template.data, data)
 
         stage_node = nodes.Node(type, name, parent=parent, metadata=metadata)
-        for workspace_name, workspace_config in self._iter_workspace_configs(
-            stage_node, config
-        ):
-            self._load_workspace(stage_node, workspace_name, workspace_config)
-
-        for port_type, port_name, port_config in self._iter_port_configs(
-            stage_node, config, {"stage": stage_node}
-        ):
-            self._load_port(stage_node, port_type, port_name, port_config)
-
+        if lazy:
+            stage_node.set_pending(self._pending_stage(stage_node))
+        else:
+            self._load_stage(stage_node)
         return stage_node
 
-    def _resolve_group(self, connection_data, keywords):
-        group_expr = connection_data.get("group")
-        return util.parse_expression(group_expr, keywords) if group_expr else None
+    def _condition_mask(self, condition, keywords):
+        # Evaluates a condition for each set of keywords, returning a boolean
+        # array, or a list without numpy
+        sources = [condition.source.evaluate(k) for k in keywords]
+        if condition.type == "boolean":
+            if numpy is None:
+                return [bool(s) != condition.invert for s in sources]
+            mask = numpy.fromiter(map(bool, sources), dtype=bool, count=len(sources))
+            return ~mask if condition.invert else mask
+
+        targets = [condition.target.evaluate(k) for k in keywords]
+        if (
+            numpy is not None
+            and isinstance(targets[0], (list, tuple))
+            and all(t is targets[0] for t in targets)
+        ):
+            # A shared list, eg, in the config, can be tested for all the
+            # sources at once if the sources and the list all hold values of
+            # one plain type. numpy converts mixed values to a common type, eg,
+            # 1 to "1", so anything else, eg, strings testing for substrings
+            # or lists of lists, is compared one at a time.
+            value_types = set(map(type, sources))
+            value_types.update(map(type, targets[0]))
+            if len(value_types) == 1 and value_types <= _VECTORIZED_TYPES:
+                return numpy.isin(numpy.asarray(sources), numpy.asarray(targets[0]))
+        mask = [s in t for s, t in zip(sources, targets)]
+        return numpy.array(mask, dtype=bool) if numpy is not None else mask
+
+    def _branch_selections(self, scope, keywords, selected, selections):
+        # Appends the indices of the stages taking each branch in the scope,
+        # in the order _evaluate_scope visits them. Conditions are only
+        # evaluated for the stages still selected, as all() would.
+        for branch in scope.branches:
+            branch_selected = selected
+            for condition in branch.conditions:
+                if not len(branch_selected):
+                    break
+                start = self._profiler.timer() if self._profiler is not None else 0
+                mask = self._condition_mask(
+                    condition, [keywords[i] for i in branch_selected]
+                )
+                if self._profiler is not None:
+                    self._profiler.add_condition(
+                        condition,
+                        self._profiler.timer() - start,
+                        count=len(branch_selected),
+                    )
+                if numpy is None:
+                    branch_selected = [
+                        i for i, passed in zip(branch_selected, mask) if passed
+                    ]
+                else:
+                    branch_selected = branch_selected[mask]
+            selections.append(branch_selected)
+            self._branch_selections(branch.scope, keywords, branch_selected, selections)
+
+    def _collect_scope(self, scope, taken, branches, workspaces, ports):
+        # Collects the templates of a scope for the set of branches taken
+        workspaces.extend(scope.workspaces)
+        ports.extend(scope.ports)
+        for branch in scope.branches:
+            index = len(branches)
+            branches.append(branch)
+            if index in taken:
+                self._collect_scope(branch.scope, taken, branches, workspaces, ports)
+            else:
+                # Skip the numbering of the branches nested in this one
+                self._count_branches(branch.scope, branches)
+
+    def _count_branches(self, scope, branches):
+        for branch in scope.branches:
+            branches.append(branch)
+            self._count_branches(branch.scope, branches)
+
+    def _resolve_scopes(self, scope, stage_nodes):
+        # Evaluates the scope for many stages at once. Returns a list of
+        # ((workspaces, ports), indices) for each distinct outcome, with the
+        # indices of the stages in stage_nodes that share it.
+        keywords = [{"stage": stage_node} for stage_node in stage_nodes]
+        if numpy is None:
+            selected = list(range(len(stage_nodes)))
+        else:
+            selected = numpy.arange(len(stage_nodes))
+        selections = []
+        self._branch_selections(scope, keywords, selected, selections)
 
-    def _resolve_source_port(self, source_node, connection_data):
-        ws_name = connection_data.get("workspace")
-        port_type = connection_data.get("port_type", constants.PortType.Output)
-        port_name = connection_data["port_name"]
-        if ws_name:
-            source_node = source_node.child(ws_name)
-        return source_node.port(port_type, port_name)
+        resolved = []
+        for branch_indices, indices in self._group_selections(
+            len(stage_nodes), selections
+        ):
+            workspaces = []
+            ports = []
+            self._collect_scope(scope, set(branch_indices), [], workspaces, ports)
+            resolved.append(((workspaces, ports), indices))
+        return resolved
+
+    def _group_selections(self, count, selections):
+        # Groups the stages by the branches they take. Returns a list of
+        # (branch indices, stage indices), ordered by the first stage of each.
+        if numpy is None or not selections:
+            taken = [[] for _ in range(count)]
+            for branch_index, branch_selected in enumerate(selections):
+                for i in branch_selected:
+                    taken[i].append(branch_index)
+            groups = {}
+            for i, branch_indices in enumerate(taken):
+                groups.setdefault(tuple(branch_indices), []).append(i)
+            return list(groups.items())
+
+        taken = numpy.zeros((count, len(selections)), dtype=bool)
+        for branch_index, branch_selected in enumerate(selections):
+            taken[branch_selected, branch_index] = True
+        rows, inverse = numpy.unique(taken, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = numpy.argsort(inverse, kind="stable")
+        splits = numpy.flatnonzero(numpy.diff(inverse[order])) + 1
+        groups = [
+            (tuple(numpy.flatnonzero(rows[inverse[indices[0]]])), indices.tolist())
+            for indices in numpy.split(order, splits)
+        ]
+        groups.sort(key=lambda group: group[1][0])
+        return groups
+
+    # Creates many stage nodes of the same type from (name, data) pairs, in
+    # order, as create_stage_node would. The conditions of the stage are
+    # evaluated across all the stages at once, vectorised with numpy if it is
+    # available, and the stages sharing the same outcome are built together.
+    def create_stage_nodes(self, type, stages, parent=None, lazy=False):
+        template = self._templates[type]
+        stage_nodes = [
+            nodes.Node(
+                type,
+                name,
+                parent=parent,
+                metadata=self._merge_metadata(template.data, data),
+            )
+            for name, data in stages
+        ]
+        if lazy:
+            for stage_node in stage_nodes:
+                stage_node.set_pending(self._pending_stage(stage_node))
+            return stage_nodes
+
+        for (workspaces, ports), indices in self._resolve_scopes(
+            template.scope, stage_nodes
+        ):
+            start = self._profiler.timer() if self._profiler is not None else 0
+            for i in indices:
+                self._load_templates(stage_nodes[i], workspaces, ports)
+            if self._profiler is not None:
+                self._profiler.add_stage(
+                    type, self._profiler.timer() - start, count=len(indices)
+                )
+        return stage_nodes
+
+    def _resolve_group(self, group, keywords):
+        if group is None:
+            return None
+        if self._profiler is not None:
+            self._profiler.add_expression(group)
+        return group.evaluate(keywords)
+
+    def _resolve_source_port(self, source_node, connection_template):
+        if connection_template.workspace:
+            source_node = source_node.child(connection_template.workspace)
+        return source_node.port(
+            connection_template.port_type, connection_template.port_name
+        )
 
-    def _resolve_internal_connection(self, target_port, connection_data):
-        metadata = connection_data.get("data", {})
+    def _resolve_internal_connection(self, target_port, connection_template):
         source_node = target_port.node().parent()
-        source_port = self._resolve_source_port(source_node, connection_data)
+        source_port = self._resolve_source_port(source_node, connection_template)
         group = self._resolve_group(
-            connection_data, {"source": source_port, "target": target_port}
+            connection_template.group, {"source": source_port, "target": target_port}
         )
         return nodes.Connection(
             source_port,
             target_port,
             group=group,
             internal=True,
-            metadata=copy.deepcopy(metadata),
+            metadata=meta.Metadata(connection_template.data),
         )
 
-    def _resolve_external_connection(self, target_port, connection_data, keywords):
-        metadata = connection_data.get("data", {})
-        foreach_data = connection_data["foreach"]
-        item_expression = foreach_data.get("item", "item")
-
+    def _resolve_external_connection(self, target_port, connection_template, keywords):
         keywords["port"] = target_port
-        for item in util.parse_expression(foreach_data["loop"], keywords):
+        if self._profiler is not None:
+            self._profiler.add_expression(connection_template.loop)
+        # Items typically share a handful of source nodes, eg, many instances
+        # of the same asset, so each source port is only resolved once. Nodes
+        # are keyed by identity, as equal nodes can have different ports, and
+        # kept alive so that their ids aren't reused.
+        source_ports = {}
+        group_keywords = {"target": target_port}
+        checked = False
+        for item in connection_template.loop.evaluate(keywords):
             keywords["item"] = item
-            conditions = foreach_data.get("conditions", [])
-            if all(
-                self._resolve_conditional(conditional, keywords)
-                for conditional in conditions
+            # Conditions which don't read the item are checked for the first
+            # item only
+            if not checked:
+                if not all(
+                    self._resolve_conditional(condition, keywords)
+                    for condition in connection_template.loop_conditions
+                ):
+                    return
+                checked = True
+            if connection_template.item_conditions and not all(
+                self._resolve_conditional(condition, keywords)
+                for condition in connection_template.item_conditions
             ):
-                # Add a copy of the metadata to each connection so that it's
-                # not shared
-                source_node = util.parse_expression(item_expression, keywords)
-                source_port = self._resolve_source_port(source_node, connection_data)
-                group = self._resolve_group(
-                    foreach_data,
-                    {"source": source_port, "target": target_port, "item": item},
-                )
-                yield nodes.Connection(
-                    source_port,
-                    target_port,
-                    group=group,
-                    internal=False,
-                    metadata=copy.deepcopy(metadata),
+                continue
+
+            if self._profiler is not None:
+                self._profiler.add_expression(connection_template.item)
+            source_node = connection_template.item.evaluate(keywords)
+            try:
+                source_port = source_ports[id(source_node)][1]
+            except KeyError:
+                source_port = self._resolve_source_port(
+                    source_node, connection_template
                 )
+                source_ports[id(source_node)] = (source_node, source_port)
+            group_keywords["source"] = source_port
+            group_keywords["item"] = item
+            # Each connection gets its own copy-on-write view of the metadata
+            # so that writes are not shared
+            yield nodes.Connection(
+                source_port,
+                target_port,
+                group=self._resolve_group(connection_template.group, group_keywords),
+                internal=False,
+                metadata=meta.Metadata(connection_template.data),
+            )
 
-    def _resolve_promoted_connection(self, target_port, connection_data):
-        port_name = connection_data.get("port_name", target_port.name())
-        port_type = connection_data.get("port_type", constants.PortType.Input)
+    def _resolve_promoted_connection(self, target_port, connection_template):
+        port_type = connection_template.port_type
+        port_name = connection_template.port_name
         stage = target_port.node().parent()
         source_port = stage.port(port_type, port_name)
         if source_port is None:
@@ -170,81 +463,249 @@ class ConfigLoader(object):
             )
 
         group = self._resolve_group(
-            connection_data, {"source": source_port, "target": target_port}
+            connection_template.group, {"source": source_port, "target": target_port}
         )
         return nodes.Connection(source_port, target_port, group, internal=True)
 
-    def _resolve_demoted_connection(self, target_port, connection_data):
-        port_name = connection_data.get("port_name", target_port.name())
-        port_type = connection_data.get("port_type", target_port.type())
-        workspace_name = connection_data["workspace"]
-        workspace = target_port.node().child(workspace_name)
-        source_port = workspace.port(port_type, port_name)
+    def _resolve_demoted_connection(self, target_port, connection_template):
+        port_name = connection_template.port_name
+        workspace = target_port.node().child(connection_template.workspace)
+        source_port = workspace.port(connection_template.port_type, port_name)
         if source_port is None:
             raise ValueError(
                 "Demoted port does not exist: {}.{}".format(workspace.name(), port_name)
             )
 
         group = self._resolve_group(
-            connection_data, {"source": source_port, "target": target_port}
+            connection_template.group, {"source": source_port, "target": target_port}
         )
         return nodes.Connection(source_port, target_port, group, internal=True)
 
-    def _resolve_connections(self, target_port, connection_data, keywords):
-        connection_type = connection_data.get("type")
+    def _resolve_connections(self, target_port, connection_template, keywords):
+        # Connection types are validated when the template is compiled
+        connection_type = connection_template.type
         if connection_type == "internal":
-            yield self._resolve_internal_connection(target_port, connection_data)
+            yield self._resolve_internal_connection(target_port, connection_template)
         elif connection_type == "external":
             yield from self._resolve_external_connection(
-                target_port, connection_data, keywords
+                target_port, connection_template, keywords
             )
         elif connection_type == "promoted":
-            yield self._resolve_promoted_connection(target_port, connection_data)
-        elif connection_type == "demoted":
-            yield self._resolve_demoted_connection(target_port, connection_data)
+            yield self._resolve_promoted_connection(target_port, connection_template)
         else:
-            raise ValueError("Unknown connection type: {}".format(connection_type))
+            yield self._resolve_demoted_connection(target_port, connection_template)
 
-    def _load_connections(self, node, node_config, keywords):
-        for port_type, input_name, input_config in self._iter_port_configs(
-            node, node_config, keywords,
-        ):
-            target_port = node.port(port_type, input_name)
-            for connection_data in input_config.get("connections", []):
+    def _load_connections(self, node, port_templates, keywords):
+        for port_template in port_templates:
+            target_port = node.port(port_template.type, port_template.name)
+            for connection_template in port_template.connections:
                 yield from self._resolve_connections(
-                    target_port, connection_data, keywords
+                    target_port, connection_template, keywords
                 )
 
+    # Yields all the connections the configuration defines for the workspaces
+    # inside the node as they are resolved. Cannot be given a workspace node
+    # directly.
+    def iter_connections(self, stage_node):
+        if self._profiler is not None:
+            return self._profile_connections(stage_node)
+        return self._iter_connections(stage_node)
+
+    def _profile_connections(self, stage_node):
+        # Times resolving the connections, but not the caller's handling of
+        # each one
+        profiler = self._profiler
+        seconds = 0.0
+        start = profiler.timer()
+        for connection in self._iter_connections(stage_node):
+            seconds += profiler.timer() - start
+            profiler.add_connection(connection)
+            yield connection
+            start = profiler.timer()
+        seconds += profiler.timer() - start
+        profiler.add_stage_connections(stage_node.type(), seconds)
+
+    def _iter_connections(self, stage_node):
+        template = self._templates[stage_node.type()]
+        workspace_templates, port_templates = self._resolve_scope(
+            template.scope, {"stage": stage_node}
+        )
+        for workspace_template in workspace_templates:
+            workspace = stage_node.child(workspace_template.name)
+            keywords = {"stage": stage_node, "workspace": workspace}
+            _, workspace_port_templates = self._resolve_scope(
+                workspace_template.scope, keywords
+            )
+            yield from self._load_connections(
+                workspace, workspace_port_templates, keywords
+            )
+
+        yield from self._load_connections(
+            stage_node, port_templates, {"stage": stage_node}
+        )
+
     # Creates all the connections the configuration defines for the workspaces
     # inside the node. Cannot be given a workspace node directly.
     def create_connections(self, stage_node):
-        config = self._config["stages"][stage_node.type()]
-        connections = []
-        for workspace_name, workspace_config in self._iter_workspace_configs(
-            stage_node, config
-        ):
-            workspace = stage_node.child(workspace_name)
-            connections.extend(
-                self._load_connections(
+        return list(self.iter_connections(stage_node))
+
+    # Passes the connections of each stage to sink as they are resolved,
+    # without collecting them first. The sink is any callable taking a
+    # connection, eg, Graph.add_connection or one of the sinks module's
+    # writers. Returns the number of connections passed.
+    def stream_connections(self, stages, sink):
+        count = 0
+        for stage_node in stages:
+            for connection in self.iter_connections(stage_node):
+                sink(connection)
+                count += 1
+        return count
+
+    def _resolve_changed_ports(self, node, scope, port_templates, keywords, keys):
+        # Returns (port, connections) for each port on the node whose
+        # connections may change when the given stage metadata keys change,
+        # with None as the connections of ports a condition has removed
+        scope_changed = _depends_on(scope.dependencies, keys)
+        changed = []
+        if scope_changed:
+            in_scope = {(t.type, t.name) for t in port_templates}
+            for port in node.ports():
+                if (port.type(), port.name()) not in in_scope:
+                    changed.append((port, None))
+
+        for port_template in port_templates:
+            if not (scope_changed or _depends_on(port_template.dependencies, keys)):
+                continue
+            port = node.port(port_template.type, port_template.name)
+            if port is None:
+                raise ValueError(
+                    "Port {}.{} is not built, the stage must be recreated".format(
+                        node.name(), port_template.name
+                    )
+                )
+            connections = list(self._load_connections(node, [port_template], keywords))
+            changed.append((port, connections))
+        return changed
+
+    # Re-resolves the connections of the ports which read any of the changed
+    # metadata keys on the stage and applies the delta to the graph. Ports
+    # which a condition has removed lose their connections in both directions,
+    # including those made by other stages, but new workspaces or ports
+    # require the stage to be recreated.
+    def update_connections(self, graph, stage_node, keys):
+        keys = set(keys)
+        template = self._templates[stage_node.type()]
+        keywords = {"stage": stage_node}
+        workspace_templates, port_templates = self._resolve_scope(
+            template.scope, keywords
+        )
+
+        changed = []
+        if _depends_on(template.scope.dependencies, keys):
+            names = {t.name for t in workspace_templates}
+            for child in stage_node.children():
+                if (
+                    child.type() == constants.NodeType.Workspace
+                    and child.name() not in names
+                ):
+                    changed.extend((port, None) for port in child.ports())
+
+        for workspace_template in workspace_templates:
+            workspace = stage_node.child(workspace_template.name)
+            if workspace is None:
+                raise ValueError(
+                    "Workspace {}.{} is not built, the stage must be "
+                    "recreated".format(stage_node.name(), workspace_template.name)
+                )
+            workspace_keywords = {"stage": stage_node, "workspace": workspace}
+            _, workspace_port_templates = self._resolve_scope(
+                workspace_template.scope, workspace_keywords
+            )
+            changed.extend(
+                self._resolve_changed_ports(
                     workspace,
-                    workspace_config,
-                    {"stage": stage_node, "workspace": workspace},
+                    workspace_template.scope,
+                    workspace_port_templates,
+                    workspace_keywords,
+                    keys,
                 )
             )
 
-        connections.extend(
-            self._load_connections(stage_node, config, {"stage": stage_node})
+        changed.extend(
+            self._resolve_changed_ports(
+                stage_node, template.scope, port_templates, keywords, keys
+            )
         )
-        return connections
+
+        added = []
+        removed = []
+        for port, connections in changed:
+            if connections is None:
+                # Connections leaving the port were made by the stages it
+                # leads to
+                for connection in graph.outgoing(port):
+                    if connection.source() is port:
+                        graph.remove_connection(connection)
+                        removed.append(connection)
+                connections = []
+            port_added, port_removed = graph.replace_connections(port, connections)
+            added.extend(port_added)
+            removed.extend(port_removed)
+        return added, removed
 
     def metadata(self, stage_type):
         metadata = self._config["stages"][stage_type]["data"]
+        if self._profiler is not None:
+            self._profiler.add_copy("ConfigLoader.metadata")
         return copy.deepcopy(metadata or {})
 
 
-if __name__ == "__main__":
-    import yaml
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pipegraph")
+
+
+# Loads a config file into a ConfigLoader. The config is validated and compiled
+# once, then cached in cache_dir keyed by a hash of the file contents and
+# COMPILED_VERSION, so later loads of an unchanged file only unpickle it.
+# Caching is best effort, the config is compiled as usual if the cache can't be
+# read or written.
+def load(path, cache_dir=None, profiler=None):
+    with open(path, "rb") as f:
+        data = f.read()
+    key = hashlib.sha256(
+        "{}:".format(COMPILED_VERSION).encode("utf-8") + data
+    ).hexdigest()
+    cache_path = os.path.join(cache_dir or default_cache_dir(), key + ".pickle")
+
+    try:
+        with open(cache_path, "rb") as f:
+            config_loader = pickle.load(f)
+    except Exception:
+        config_loader = None
+    if isinstance(config_loader, ConfigLoader):
+        config_loader._profiler = profiler
+        return config_loader
+
+    config_loader = ConfigLoader(yaml.load(data, Loader=YAML_LOADER), profiler)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Written to a temporary file first so that other processes never read
+        # a partially written cache
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(config_loader, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except OSError:
+        pass
+    return config_loader
 
+
+if __name__ == "__main__":
     # TODO: What if ports had a flag to promote themselves as a stage port.
     # Promotions with the same name are merged together, or an optional keyword
     # could be used to separate them, eg, promote_name: "surfModel"
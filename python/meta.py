@@ -0,0 +1,277 @@
+import collections.abc
+import copy
+
+import util
+
+
+def _merge_values(base, data):
+    # Plain dictionaries are merged key by key, anything else is replaced
+    if isinstance(base, collections.abc.Mapping) and isinstance(
+        data, collections.abc.Mapping
+    ):
+        merged = {k: copy.deepcopy(v) for k, v in base.items() if k not in data}
+        for key, value in data.items():
+            merged[key] = _merge_values(base.get(key), value)
+        return merged
+    return data
+
+
+def merge_entry(base, entry):
+    # Merges a metadata entry over a base entry. Dict entries are merged
+    # recursively, mixed dicts entry by entry, anything else is replaced.
+    # Values taken from the base are copied, the entry is not, so that the
+    # merged entry can be modified in place without changing the base.
+    if (
+        base is None
+        or base.get("type") != "dict"
+        or entry.get("type") != "dict"
+        or not isinstance(base.get("value"), collections.abc.Mapping)
+        or not isinstance(entry.get("value"), collections.abc.Mapping)
+    ):
+        return entry
+
+    merged = dict(entry)
+    if entry.get("subtype") == util.Subtype.Mixed.value:
+        merged["value"] = merge(base["value"], entry["value"])
+    else:
+        merged["value"] = _merge_values(base["value"], entry["value"])
+    return merged
+
+
+def copy_containers(value):
+    # Copies the dicts and lists of a value, eg, a metadata entry, sharing
+    # anything else, eg, nodes referenced from the metadata
+    if isinstance(value, dict):
+        return {key: copy_containers(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_containers(item) for item in value]
+    return value
+
+
+def merge(base, data):
+    merged = {k: copy.deepcopy(v) for k, v in base.items() if k not in data}
+    for key, entry in data.items():
+        merged[key] = merge_entry(base.get(key), entry)
+    return merged
+
+
+# Shared base for metadata created without one, writes never reach the base
+_EMPTY = {}
+
+
+def view(entry):
+    # Returns the value of a metadata entry. Mixed dicts and lists are wrapped
+    # in views which collapse their items as they are accessed
+    if entry.get("subtype") == util.Subtype.Mixed.value:
+        if entry["type"] == "dict":
+            return DictView(entry)
+        elif entry["type"] == "list":
+            return ListView(entry)
+    return entry["value"]
+
+
+class _ViewCache(object):
+    # Caches the views for nested entries. Each view is stored with the entry
+    # it was built from so that replacing the entry invalidates it
+    __slots__ = ()
+
+    def _view(self, key, entry):
+        if self._views is not None:
+            cached = self._views.get(key)
+            if cached is not None and cached[0] is entry:
+                return cached[1]
+
+        value = view(entry)
+        if isinstance(value, (DictView, ListView)):
+            if self._views is None:
+                self._views = {}
+            self._views[key] = (entry, value)
+        return value
+
+
+class DictView(_ViewCache, collections.abc.Mapping):
+    __slots__ = ("_entry", "_views")
+
+    def __init__(self, entry):
+        self._entry = entry
+        self._views = None
+
+    def __getitem__(self, key):
+        return self._view(key, self._entry["value"][key])
+
+    def __iter__(self):
+        return iter(self._entry["value"])
+
+    def __len__(self):
+        return len(self._entry["value"])
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, dict(self.items()))
+
+
+class ListView(_ViewCache, collections.abc.Sequence):
+    __slots__ = ("_entry", "_views")
+
+    def __init__(self, entry):
+        self._entry = entry
+        self._views = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        entries = self._entry["value"]
+        if index < 0:
+            index += len(entries)
+        return self._view(index, entries[index])
+
+    def __len__(self):
+        return len(self._entry["value"])
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, ListView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, list(self))
+
+
+class Metadata(_ViewCache, collections.abc.MutableMapping):
+    # Copy-on-write metadata which shares its entries with a base mapping,
+    # typically the template data from the config. Writes only touch this
+    # instance, and an entry read from the base is copied into the instance
+    # first, so that entries can be modified in place as with a dict.
+    __slots__ = ("_base", "_data", "_deleted", "_views")
+
+    def __init__(self, base=None, data=None):
+        self._base = base if base is not None else _EMPTY
+        self._data = None
+        self._deleted = None
+        self._views = None
+        if data:
+            self._data = {
+                key: merge_entry(self._base.get(key), entry)
+                for key, entry in data.items()
+            }
+
+    def __getitem__(self, key):
+        if self._data is not None and key in self._data:
+            return self._data[key]
+        entry = copy.deepcopy(self._entry(key))
+        self[key] = entry
+        return entry
+
+    def _entry(self, key):
+        # The entry for the key without copying it from the base, which must
+        # not be modified in place
+        if self._data is not None and key in self._data:
+            return self._data[key]
+        if self._deleted is not None and key in self._deleted:
+            raise KeyError(key)
+        return self._base[key]
+
+    def _entries(self):
+        return {key: self._entry(key) for key in self}
+
+    def __setitem__(self, key, entry):
+        if self._data is None:
+            self._data = {}
+        self._data[key] = entry
+        if self._deleted is not None:
+            self._deleted.discard(key)
+        if self._views is not None:
+            self._views.pop(key, None)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if self._data is not None:
+            self._data.pop(key, None)
+        if key in self._base:
+            if self._deleted is None:
+                self._deleted = set()
+            self._deleted.add(key)
+        if self._views is not None:
+            self._views.pop(key, None)
+
+    def __iter__(self):
+        for key in self._base:
+            if self._deleted is not None and key in self._deleted:
+                continue
+            yield key
+        if self._data is not None:
+            for key in self._data:
+                if key not in self._base:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if self._data is not None and key in self._data:
+            return True
+        if self._deleted is not None and key in self._deleted:
+            return False
+        return key in self._base
+
+    # Compared and printed without copying entries from the base
+    def __eq__(self, other):
+        if isinstance(other, Metadata):
+            return self._entries() == other._entries()
+        if isinstance(other, collections.abc.Mapping):
+            return self._entries() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._entries())
+
+    # Cached views are not pickled, they are rebuilt on access
+    def __getstate__(self):
+        return self._base, self._data, self._deleted
+
+    def __setstate__(self, state):
+        self._base, self._data, self._deleted = state
+        self._views = None
+
+    def unmodified_base(self):
+        # The base mapping if the metadata is still equal to Metadata(base),
+        # ie, nothing was deleted and the entries held are unmodified copies
+        # of the base entries, otherwise None
+        if self._deleted:
+            return None
+        if self._data and any(
+            key not in self._base or self._base[key] != entry
+            for key, entry in self._data.items()
+        ):
+            return None
+        return self._base
+
+    def copy(self, deep=False):
+        # The entries held by the instance are shared with the copy, unless
+        # deep is set, in which case their dicts and lists are copied
+        copied = self.__class__(self._base)
+        if self._data is not None:
+            if deep:
+                copied._data = {k: copy_containers(e) for k, e in self._data.items()}
+            else:
+                copied._data = dict(self._data)
+        if self._deleted is not None:
+            copied._deleted = set(self._deleted)
+        return copied
+
+    def value(self, key):
+        # The collapsed value of an entry, see view(). Immutable values are
+        # read from the base without copying the entry
+        entry = self._entry(key)
+        if isinstance(entry["value"], (dict, list)):
+            entry = self[key]
+        return self._view(key, entry)
+
+    def mutable(self, key):
+        # Returns an entry that is safe to modify in place, which any entry
+        # read is, as entries are copied from the base when first read
+        return self[key]
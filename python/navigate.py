@@ -1,53 +1,621 @@
+import collections
+import contextlib
+
 import constants
+import util
+
+# Matches any group in Graph.connections(), None is a valid group
+ANY = object()
+
+
+def _stage(port):
+    # The stage a port belongs to, either its node or its workspace's stage
+    if port is None:
+        return None
+    node = port.node()
+    if node is not None and node.type() == constants.NodeType.Workspace:
+        return node.parent()
+    return node
+
+
+def _index(index, key, item):
+    index.setdefault(key, set()).add(item)
+
+
+def _unindex(index, key, item):
+    items = index.get(key)
+    if items is not None:
+        items.discard(item)
+        if not items:
+            del index[key]
+
+
+def _index_identity(index, key, item):
+    # For items which can be equal but distinct, eg, ports, each bucket holds
+    # the items keyed by their id
+    index.setdefault(key, {})[id(item)] = item
+
+
+def _unindex_identity(index, key, item):
+    items = index.get(key)
+    if items is not None:
+        items.pop(id(item), None)
+        if not items:
+            del index[key]
+
+
+def _query(candidates, predicates):
+    # Intersects the candidate sets and applies the predicates, starting from
+    # the smallest set so that queries cost the size of their most selective
+    # index
+    candidates.sort(key=len)
+    others = candidates[1:]
+    return {
+        item
+        for item in candidates[0]
+        if all(item in other for other in others) and all(p(item) for p in predicates)
+    }
+
+
+def _query_identity(candidates, predicates):
+    # The same as _query() for buckets keyed by id, returning a list of items
+    candidates.sort(key=len)
+    others = candidates[1:]
+    return [
+        item
+        for key, item in candidates[0].items()
+        if all(key in other for other in others) and all(p(item) for p in predicates)
+    ]
 
 
 class Graph(object):
-    def __init__(self):
+    # Connections are indexed by group, whether they are internal and the
+    # stage which declares them, ie, the stage of the target port. Ports on
+    # the nodes added and on connections are indexed by type and name. Each
+    # of the metadata keys given is indexed for ports and connections, from
+    # their metadata when they are added to the graph.
+    def __init__(self, metadata_keys=()):
         self._connections = set()
-        self._nodes = set()
+        # Nodes indexed by name, then type
+        self._nodes = {}
+        # Connections indexed by the port they leave from and arrive at
+        self._outgoing = {}
+        self._incoming = {}
+        # Transitive closures by port, cleared whenever connections change
+        self._downstream = {}
+        self._upstream = {}
+        # Secondary indexes, see connections() and ports(). They are built by
+        # the first query and maintained from then on, so building a graph
+        # which is never queried doesn't pay for them.
+        self._indexed = False
+        self._metadata_keys = tuple(metadata_keys)
+        self._group_index = {}
+        self._unhashable_groups = set()
+        self._internal_index = {}
+        self._stage_index = {}
+        self._connection_metadata_index = {}
+        # Ports are indexed by identity, as ports on same named workspaces of
+        # different stages are equal
+        self._indexed_ports = {}
+        self._port_index = {}
+        self._port_type_index = {}
+        self._port_name_index = {}
+        self._port_metadata_index = {}
+        # Nodes whose ports are indexed on the first port query, so that
+        # lazy nodes aren't built when added. Keyed by id for removal.
+        self._unindexed_nodes = {}
+        # Roots of the subtrees removed from the graph, which are skipped when
+        # walking the descendants of its nodes until they are added again.
+        # The node hierarchy itself is never changed. Keyed by id.
+        self._removed = {}
 
     def add_connection(self, connection):
+        if connection in self._connections:
+            return False
+
         # Input ports only accept a single connection unless declared as "multi"
         # If a connection exists for a non-multi Input port, raise an error
-        single_inputs = [
-            p.type() == constants.PortType.Input and not p.is_multi()
-            for p in (connection.source(), connection.target())
-        ]
-        if single_inputs:
-            for con in self._connections:
-                if any(p == con.source() or p == con.target() for p in single_inputs):
-                    raise ValueError(
-                        "Multiple connections for single-connection port: {}".format(
-                            connection
-                        )
-                    )
-
-        total = len(self._connections)
+        target = connection.target()
+        if (
+            target.type() == constants.PortType.Input
+            and not target.is_multi()
+            and self._incoming.get(target)
+        ):
+            raise ValueError(
+                "Multiple connections for single-connection port: {}".format(connection)
+            )
+
         self._connections.add(connection)
-        return len(self._connections) != total
+        self._outgoing.setdefault(connection.source(), set()).add(connection)
+        self._incoming.setdefault(target, set()).add(connection)
+        if self._indexed:
+            self._index_connection(connection)
+        self._clear_reachability()
+        return True
+
+    def remove_connection(self, connection):
+        if connection not in self._connections:
+            return False
+
+        self._connections.remove(connection)
+        for index, port in (
+            (self._outgoing, connection.source()),
+            (self._incoming, connection.target()),
+        ):
+            connections = index[port]
+            connections.discard(connection)
+            if not connections:
+                del index[port]
+        if self._indexed:
+            self._unindex_connection(connection)
+        self._clear_reachability()
+        return True
+
+    def _index_connection(self, connection):
+        try:
+            _index(self._group_index, connection.group, connection)
+        except TypeError:
+            self._unhashable_groups.add(connection)
+        _index(self._internal_index, connection.is_internal(), connection)
+        _index(self._stage_index, _stage(connection.target()), connection)
+        for key in self._metadata_keys:
+            if key in connection.metadata:
+                _index(self._connection_metadata_index, key, connection)
+        self._index_port(connection.source())
+        self._index_port(connection.target())
+
+    def _unindex_connection(self, connection):
+        try:
+            _unindex(self._group_index, connection.group, connection)
+        except TypeError:
+            self._unhashable_groups.discard(connection)
+        _unindex(self._internal_index, connection.is_internal(), connection)
+        _unindex(self._stage_index, _stage(connection.target()), connection)
+        for key in self._metadata_keys:
+            _unindex(self._connection_metadata_index, key, connection)
+
+    def _index_port(self, port):
+        if port is None or id(port) in self._indexed_ports:
+            return
+        self._indexed_ports[id(port)] = port
+        _index_identity(self._port_index, (port.type(), port.name()), port)
+        _index_identity(self._port_type_index, port.type(), port)
+        _index_identity(self._port_name_index, port.name(), port)
+        for key in self._metadata_keys:
+            if key in port.metadata:
+                _index_identity(self._port_metadata_index, key, port)
+
+    def _unindex_port(self, port):
+        if self._indexed_ports.pop(id(port), None) is None:
+            return
+        _unindex_identity(self._port_index, (port.type(), port.name()), port)
+        _unindex_identity(self._port_type_index, port.type(), port)
+        _unindex_identity(self._port_name_index, port.name(), port)
+        for key in self._metadata_keys:
+            _unindex_identity(self._port_metadata_index, key, port)
+
+    def _update_indexes(self):
+        if not self._indexed:
+            self._indexed = True
+            for connection in self._connections:
+                self._index_connection(connection)
+        while self._unindexed_nodes:
+            for node in self.iter_descendants(self._unindexed_nodes.popitem()[1]):
+                for port in node.ports():
+                    self._index_port(port)
+
+    def replace_connections(self, port, connections):
+        # Replaces the connections arriving at port with the given connections
+        # and returns the (added, removed) delta. Existing connections whose
+        # group has changed are replaced.
+        current = {c: c for c in self._incoming.get(port, ())}
+        replacements = {}
+        for connection in connections:
+            if connection.target() != port:
+                raise ValueError(
+                    "Connection does not target {}: {}".format(port, connection)
+                )
+            replacements.setdefault(connection, connection)
+
+        removed = [
+            existing
+            for connection, existing in current.items()
+            if connection not in replacements
+            or replacements[connection].group != existing.group
+        ]
+        for connection in removed:
+            self.remove_connection(connection)
+
+        added = [
+            connection
+            for connection in replacements
+            if connection not in self._connections
+        ]
+        for connection in added:
+            self.add_connection(connection)
+        return added, removed
 
     def add_node(self, node):
-        total = len(self._nodes)
-        self._nodes.add(node)
-        return len(self._nodes) != total
+        nodes_by_type = self._nodes.setdefault(node.name(), {})
+        if node.type() in nodes_by_type:
+            return False
+
+        nodes_by_type[node.type()] = node
+        self._unindexed_nodes[id(node)] = node
+        self._removed.pop(id(node), None)
+        return True
+
+    def remove_node(self, node):
+        # Removes a node and its descendants from the graph along with their
+        # ports and every connection to or from those ports, in time
+        # proportional to the size of the subtree and its connections. The
+        # node stays in the hierarchy, but is skipped by iter_descendants()
+        # until it is added again. Returns the connections removed.
+        #
+        # Only connections made with the node's own ports are removed. Ports
+        # equal to them, eg, on same named workspaces of other stages, share
+        # connections, and a connection is only added for the first of them.
+        removed = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            nodes_by_type = self._nodes.get(current.name())
+            if nodes_by_type and nodes_by_type.get(current.type()) is current:
+                del nodes_by_type[current.type()]
+                if not nodes_by_type:
+                    del self._nodes[current.name()]
+                self._unindexed_nodes.pop(id(current), None)
+            # A node which hasn't been built has no ports or children yet, so
+            # nothing can be connected to it
+            if current.is_pending():
+                continue
+
+            for port in current.ports():
+                for connection in list(self._incoming.get(port, ())):
+                    if connection.target() is port:
+                        self.remove_connection(connection)
+                        removed.append(connection)
+                for connection in list(self._outgoing.get(port, ())):
+                    if connection.source() is port:
+                        self.remove_connection(connection)
+                        removed.append(connection)
+                if self._indexed:
+                    self._unindex_port(port)
+            stack.extend(current.children())
+        self._removed[id(node)] = node
+        return removed
+
+    def connections(self, group=ANY, internal=None, stage=None, metadata=None):
+        # Returns the set of connections matching all the given criteria: the
+        # group, whether they are internal, the stage that declares them and a
+        # metadata key, which must be one of the indexed keys
+        self._update_indexes()
+        candidates = []
+        if group is not ANY:
+            try:
+                candidates.append(self._group_index.get(group, ()))
+            except TypeError:
+                candidates.append(
+                    {c for c in self._unhashable_groups if c.group == group}
+                )
+        if internal is not None:
+            candidates.append(self._internal_index.get(bool(internal), ()))
+        if stage is not None:
+            candidates.append(self._stage_index.get(stage, ()))
+        if metadata is not None:
+            self._check_metadata_key(metadata)
+            candidates.append(self._connection_metadata_index.get(metadata, ()))
+        if not candidates:
+            return set(self._connections)
+        return _query(candidates, [])
+
+    def ports(self, type=None, name=None, multi=None, metadata=None):
+        # Returns a list of the ports on the graph's nodes, their descendants
+        # and connections matching all the given criteria: the port type,
+        # name, whether they are multi and a metadata key, which must be one
+        # of the indexed keys. Equal ports, eg, on same named workspaces of
+        # different stages, are each returned.
+        self._update_indexes()
+        candidates = []
+        predicates = []
+        if type is not None and name is not None:
+            candidates.append(self._port_index.get((type, name), {}))
+        elif type is not None:
+            candidates.append(self._port_type_index.get(type, {}))
+        elif name is not None:
+            candidates.append(self._port_name_index.get(name, {}))
+        if multi is not None:
+            predicates.append(lambda port: port.is_multi() == bool(multi))
+        if metadata is not None:
+            self._check_metadata_key(metadata)
+            candidates.append(self._port_metadata_index.get(metadata, {}))
+        if not candidates:
+            candidates.append(self._indexed_ports)
+        return _query_identity(candidates, predicates)
+
+    def _check_metadata_key(self, key):
+        if key not in self._metadata_keys:
+            raise ValueError("Metadata key is not indexed: {}".format(key))
 
     def iter_connections(self):
         yield from self._connections
 
     def iter_nodes(self):
-        yield from self._nodes
+        for nodes_by_type in self._nodes.values():
+            yield from nodes_by_type.values()
+
+    def iter_descendants(self, node):
+        # Yields the node and its descendants, skipping the subtrees removed
+        # from the graph
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(
+                child for child in node.children() if id(child) not in self._removed
+            )
+
+    def removed_nodes(self):
+        # The roots of the subtrees removed from the graph, see remove_node()
+        return list(self._removed.values())
+
+    def connected(self, port):
+        for connection in self._outgoing.get(port, ()):
+            yield connection.target()
+        for connection in self._incoming.get(port, ()):
+            yield connection.source()
+
+    def incoming(self, port):
+        return set(self._incoming.get(port, ()))
+
+    def outgoing(self, port):
+        return set(self._outgoing.get(port, ()))
+
+    def _clear_reachability(self):
+        if self._downstream:
+            self._downstream = {}
+        if self._upstream:
+            self._upstream = {}
+
+    # Traversal follows connections and passes through workspaces, ie, a
+    # workspace's outputs are downstream of its inputs
+    def _successors(self, port):
+        for connection in self._outgoing.get(port, ()):
+            yield connection.target()
+        node = port.node()
+        if (
+            port.type() == constants.PortType.Input
+            and node is not None
+            and node.type() == constants.NodeType.Workspace
+        ):
+            for other in node.ports():
+                if other.type() == constants.PortType.Output:
+                    yield other
+
+    def _predecessors(self, port):
+        for connection in self._incoming.get(port, ()):
+            yield connection.source()
+        node = port.node()
+        if (
+            port.type() == constants.PortType.Output
+            and node is not None
+            and node.type() == constants.NodeType.Workspace
+        ):
+            for other in node.ports():
+                if other.type() == constants.PortType.Input:
+                    yield other
+
+    def _closure(self, port, step, cache):
+        closure = cache.get(port)
+        if closure is not None:
+            return closure
+
+        reached = set()
+        stack = [port]
+        while stack:
+            for other in step(stack.pop()):
+                if other in reached:
+                    continue
+                reached.add(other)
+                # A cached closure is complete, there is no need to walk it
+                known = cache.get(other)
+                if known is None:
+                    stack.append(other)
+                else:
+                    reached.update(known)
+
+        closure = frozenset(reached)
+        cache[port] = closure
+        return closure
+
+    def downstream(self, port):
+        return self._closure(port, self._successors, self._downstream)
+
+    def upstream(self, port):
+        return self._closure(port, self._predecessors, self._upstream)
+
+    def _reachable_ports(self):
+        # All ports reachable from a connection, including workspace ports
+        # that are only connected through their workspace
+        ports = set(self._outgoing)
+        ports.update(self._incoming)
+        stack = list(ports)
+        while stack:
+            port = stack.pop()
+            for step in (self._successors, self._predecessors):
+                for other in step(port):
+                    if other not in ports:
+                        ports.add(other)
+                        stack.append(other)
+        return ports
+
+    def topological_order(self):
+        ports = self._reachable_ports()
+        in_degree = dict.fromkeys(ports, 0)
+        for port in ports:
+            for other in self._successors(port):
+                in_degree[other] += 1
+
+        order = []
+        ready = collections.deque(
+            port for port, count in in_degree.items() if not count
+        )
+        while ready:
+            port = ready.popleft()
+            order.append(port)
+            for other in self._successors(port):
+                in_degree[other] -= 1
+                if not in_degree[other]:
+                    ready.append(other)
+
+        if len(order) != len(ports):
+            raise ValueError("Graph contains a cycle: {}".format(self.find_cycle()))
+        return order
+
+    def find_cycle(self):
+        # Returns the ports in the first cycle found, or None
+        finished = set()
+        for start in self._reachable_ports():
+            if start in finished:
+                continue
+            path = [start]
+            positions = {start: 0}
+            pending = [self._successors(start)]
+            while pending:
+                other = next(pending[-1], None)
+                if other is None:
+                    pending.pop()
+                    port = path.pop()
+                    del positions[port]
+                    finished.add(port)
+                elif other in positions:
+                    return path[positions[other] :]
+                elif other not in finished:
+                    positions[other] = len(path)
+                    path.append(other)
+                    pending.append(self._successors(other))
+        return None
+
+    def node(self, name, type=None):
+        nodes_by_type = self._nodes.get(name)
+        if not nodes_by_type:
+            return None
+        if type is None:
+            return next(iter(nodes_by_type.values()))
+        return nodes_by_type.get(type)
+
+
+class ConcurrentGraph(object):
+    # A Graph which can be read from many threads while other threads update
+    # it. Reads share a lock and writes take it exclusively, so readers only
+    # wait for writes and always see the graph between updates. Iterators are
+    # over a copy taken when they are created, so they are unaffected by later
+    # updates. Use read() to make several calls against the same view.
+    def __init__(self, graph=None, metadata_keys=()):
+        self._graph = Graph(metadata_keys) if graph is None else graph
+        self._lock = util.ReadWriteLock()
+
+    @contextlib.contextmanager
+    def read(self):
+        # Holds off updates for the duration, yielding the underlying graph,
+        # which must not be modified
+        self._ensure_indexed()
+        with self._lock.read():
+            yield self._graph
+
+    def _ensure_indexed(self):
+        # Queries build the indexes on first use, which must happen under the
+        # write lock. Once built, they are kept current by every update.
+        graph = self._graph
+        if not graph._indexed or graph._unindexed_nodes:
+            with self._lock.write():
+                graph._update_indexes()
+
+    def add_connection(self, connection):
+        with self._lock.write():
+            return self._graph.add_connection(connection)
+
+    def remove_connection(self, connection):
+        with self._lock.write():
+            return self._graph.remove_connection(connection)
+
+    def replace_connections(self, port, connections):
+        connections = list(connections)
+        with self._lock.write():
+            return self._graph.replace_connections(port, connections)
+
+    def add_node(self, node):
+        # Lazy nodes are built here rather than by a reader
+        stack = [node]
+        while stack:
+            stack.extend(stack.pop().children())
+        with self._lock.write():
+            added = self._graph.add_node(node)
+            if self._graph._indexed:
+                self._graph._update_indexes()
+            return added
+
+    def remove_node(self, node):
+        with self._lock.write():
+            return self._graph.remove_node(node)
+
+    def connections(self, group=ANY, internal=None, stage=None, metadata=None):
+        with self.read() as graph:
+            return graph.connections(group, internal, stage, metadata)
+
+    def ports(self, type=None, name=None, multi=None, metadata=None):
+        with self.read() as graph:
+            return graph.ports(type, name, multi, metadata)
+
+    def iter_connections(self):
+        with self._lock.read():
+            return iter(list(self._graph.iter_connections()))
+
+    def iter_nodes(self):
+        with self._lock.read():
+            return iter(list(self._graph.iter_nodes()))
+
+    def iter_descendants(self, node):
+        with self._lock.read():
+            return iter(list(self._graph.iter_descendants(node)))
+
+    def removed_nodes(self):
+        with self._lock.read():
+            return self._graph.removed_nodes()
 
     def connected(self, port):
-        for connection in self._connections:
-            if connection.source() == port:
-                yield connection.target()
-            elif connection.target() == port:
-                yield connection.source()
+        with self._lock.read():
+            return iter(list(self._graph.connected(port)))
+
+    def incoming(self, port):
+        with self._lock.read():
+            return self._graph.incoming(port)
+
+    def outgoing(self, port):
+        with self._lock.read():
+            return self._graph.outgoing(port)
+
+    # Closures are cached by readers, which only add entries for the current
+    # connections, each an atomic dict update
+    def downstream(self, port):
+        with self._lock.read():
+            return self._graph.downstream(port)
+
+    def upstream(self, port):
+        with self._lock.read():
+            return self._graph.upstream(port)
+
+    def topological_order(self):
+        with self._lock.read():
+            return self._graph.topological_order()
+
+    def find_cycle(self):
+        with self._lock.read():
+            return self._graph.find_cycle()
 
     def node(self, name, type=None):
-        for node in self._nodes:
-            if node.name() == name and (type is None or type == node.type()):
-                return node
+        with self._lock.read():
+            return self._graph.node(name, type)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,52 @@
-import util
+import sys
 
+import meta
+
+
+def _metadata(metadata):
+    if isinstance(metadata, meta.Metadata):
+        return metadata
+    return meta.Metadata(metadata)
+
+
+def _intern(value):
+    # Names and types repeat across every stage, share a single copy of each
+    return sys.intern(value) if type(value) is str else value
+
+
+class _Slotted(object):
+    # Hashes are cached on creation/attachment, but string hashes differ
+    # between processes so they are dropped when pickling and recomputed on
+    # first use
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if slot != "_hash" and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._hash = None
+
+
+class Port(_Slotted):
+    __slots__ = ("_type", "_name", "_node", "_is_multi", "_hash", "metadata")
 
-class Port(object):
     def __init__(self, type, name, multi=False, metadata=None):
-        self._type = type
-        self._name = name
+        self._type = _intern(type)
+        self._name = _intern(name)
         self._node = None
         self._is_multi = multi
-        self.metadata = metadata or {}
+        self._hash = None
+        self.metadata = _metadata(metadata)
 
     def __getitem__(self, item):
-        return util.collapse_meta(self.metadata[item])
+        return self.metadata.value(item)
 
     def __str__(self):
         return "{s.__class__.__name__}({s._type}, {s._name})".format(s=self)
@@ -22,15 +58,18 @@ class Port(object):
         )
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, Port)
-            and self.node() == other.node()
-            and self.type() == other.type()
-            and self.name() == other.name()
+            and hash(self) == hash(other)
+            and self._type == other._type
+            and self._name == other._name
+            and self._node == other._node
         )
 
     def __hash__(self):
-        return hash((self.node(), self.type(), self.name()))
+        if self._hash is None:
+            self._hash = hash((self._node, self._type, self._name))
+        return self._hash
 
     def name(self):
         return self._name
@@ -45,33 +84,71 @@ class Port(object):
         return self._node
 
 
-class Node(object):
+class Node(_Slotted):
+    __slots__ = (
+        "_type",
+        "_name",
+        "_parent",
+        "_children",
+        "_ports",
+        "_child_index",
+        "_port_index",
+        "_pending",
+        "_hash",
+        "metadata",
+    )
+
     def __init__(self, type, name, parent=None, metadata=None):
-        self._type = type
-        self._name = name
-        self._parent = parent
-        self.metadata = metadata or {}
-        self._children = []
+        self._type = _intern(type)
+        self._name = _intern(name)
+        self._hash = hash((self._type, self._name))
+        self._parent = None
+        self.metadata = _metadata(metadata)
+        # Children are keyed by identity to keep insertion order and allow
+        # constant time removal when reparenting
+        self._children = {}
         self._ports = []
+        # Lookup indexes, lookups return the first child/port added for a key
+        self._child_index = {}
+        self._port_index = {}
+        # Builds the children and ports on first access, see set_pending()
+        self._pending = None
 
         if parent is not None:
             self.set_parent(parent)
 
     def __getitem__(self, item):
-        return util.collapse_meta(self.metadata[item])
+        return self.metadata.value(item)
 
     def __repr__(self):
         return "{s.__class__.__name__}({s._type!r}, {s._name!r})".format(s=self)
 
+    def __getstate__(self):
+        # The pending callback is not pickled, the node is built instead.
+        # Children are keyed by id, which differs once loaded, so only the
+        # list of children is pickled.
+        if self._pending is not None:
+            self._materialize()
+        state = super(Node, self).__getstate__()
+        state["_children"] = list(self._children.values())
+        return state
+
+    def __setstate__(self, state):
+        super(Node, self).__setstate__(state)
+        self._children = {id(child): child for child in self._children}
+
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, self.__class__)
-            and self.type() == other.type()
-            and self.name() == other.name()
+            and hash(self) == hash(other)
+            and self._type == other._type
+            and self._name == other._name
         )
 
     def __hash__(self):
-        return hash((self.type(), self.name()))
+        if self._hash is None:
+            self._hash = hash((self._type, self._name))
+        return self._hash
 
     def name(self):
         return self._name
@@ -79,47 +156,98 @@ class Node(object):
     def type(self):
         return self._type
 
+    def set_pending(self, callback):
+        # Defers building the children and ports until they are first
+        # accessed, the callback is called with the node to build them
+        self._pending = callback
+
+    def is_pending(self):
+        return self._pending is not None
+
+    def _materialize(self):
+        callback = self._pending
+        self._pending = None
+        callback(self)
+
     def child(self, name):
-        for child in self._children:
-            if child.name() == name:
-                return child
+        if self._pending is not None:
+            self._materialize()
+        children = self._child_index.get(name)
+        return children[0] if children else None
 
     def children(self):
-        return self._children[:]
+        if self._pending is not None:
+            self._materialize()
+        return list(self._children.values())
 
     def parent(self):
         return self._parent
 
+    def path(self):
+        # The names from the root down to this node, eg, "project.assetA"
+        names = []
+        node = self
+        while node is not None:
+            names.append(node._name)
+            node = node._parent
+        return ".".join(reversed(names))
+
     def add_port(self, port):
         if port.node() is not None:
             raise ValueError("Port already belongs to a node")
+        if self._pending is not None:
+            self._materialize()
 
         port._node = self
+        port._hash = hash((self, port._type, port._name))
         self._ports.append(port)
+        self._port_index.setdefault((port.type(), port.name()), port)
 
     def port(self, type, name):
-        for port in self._ports:
-            if port.type() == type and port.name() == name:
-                return port
+        if self._pending is not None:
+            self._materialize()
+        return self._port_index.get((type, name))
 
     def ports(self):
+        if self._pending is not None:
+            self._materialize()
         return self._ports[:]
 
     def set_parent(self, parent):
-        parent._children.append(self)
+        # A parent of None detaches the node from its parent
+        if self._parent is not None:
+            self._parent._remove_child(self)
+        if parent is None:
+            self._parent = None
+            return
+        # Pending children are built first to keep the order they are added in
+        if parent._pending is not None:
+            parent._materialize()
+        parent._children[id(self)] = self
+        parent._child_index.setdefault(self.name(), []).append(self)
         self._parent = parent
 
+    def _remove_child(self, child):
+        del self._children[id(child)]
+        children = self._child_index[child.name()]
+        children[:] = [c for c in children if c is not child]
+        if not children:
+            del self._child_index[child.name()]
+
+
+class Connection(_Slotted):
+    __slots__ = ("_source", "_target", "_internal", "_hash", "group", "metadata")
 
-class Connection(object):
     def __init__(self, source, target, group=None, internal=True, metadata=None):
         self._source = source
         self._target = target
         self._internal = internal
+        self._hash = hash((source, target))
         self.group = group
-        self.metadata = metadata or {}
+        self.metadata = _metadata(metadata)
 
     def __getitem__(self, item):
-        return util.collapse_meta(self.metadata[item])
+        return self.metadata.value(item)
 
     def __repr__(self):
         return (
@@ -128,14 +256,17 @@ class Connection(object):
         )
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, Connection)
-            and self.source() == other.source()
-            and self.target() == other.target()
+            and hash(self) == hash(other)
+            and self._source == other._source
+            and self._target == other._target
         )
 
     def __hash__(self):
-        return hash((self.source(), self.target()))
+        if self._hash is None:
+            self._hash = hash((self._source, self._target))
+        return self._hash
 
     def is_internal(self):
         return self._internal
@@ -0,0 +1,267 @@
+import array
+import io
+import multiprocessing
+import os
+import pickle
+
+import loader
+import meta
+import navigate
+import nodes
+
+# Stages are split into this many chunks per process so that processes which
+# finish early can pick up more work
+CHUNKS_PER_PROCESS = 4
+
+# Immutable values are copied between processes rather than referenced
+_VALUES = (str, bytes, int, float, complex, bool, type(None))
+_VALUE_TYPES = frozenset(_VALUES)
+
+# Each connection is sent as CONNECTION_FIELDS integers: the registry numbers
+# of its source and target ports, whether it is internal, its group and the
+# base of its metadata. Groups and metadata which aren't registered objects
+# are sent separately, keyed by the connection's position.
+CONNECTION_FIELDS = 5
+NONE = -1
+SEPARATE = -2
+
+
+class _Registry(object):
+    # Numbers the nodes, ports and the objects held in the config and the node
+    # metadata. Every process walks its copy of the project in the same order,
+    # so an object can be pickled as its number and loaded as the matching
+    # object in another process.
+    def __init__(self, config, stages):
+        self._objects = []
+        self._ids = {}
+        # The number of the first port equal to each port, eg, on same named
+        # workspaces of different stages, which make equal connections
+        self._canonical = {NONE: NONE}
+        first_ports = {}
+
+        roots = {}
+        for node in stages:
+            while node.parent() is not None:
+                node = node.parent()
+            roots.setdefault(id(node), node)
+
+        hierarchy = []
+        for root in roots.values():
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                hierarchy.append(node)
+                self._add(node)
+                for port in node.ports():
+                    index = len(self._objects)
+                    self._add(port)
+                    self._canonical[index] = first_ports.setdefault(port, index)
+                stack.extend(reversed(node.children()))
+
+        self._walk(config)
+        for node in hierarchy:
+            self._walk(node.metadata)
+
+    def _add(self, obj):
+        self._ids[id(obj)] = len(self._objects)
+        self._objects.append(obj)
+
+    def _walk(self, value):
+        # Exact type checks first, this walks every value in the project
+        ids = self._ids
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            value_type = type(value)
+            if value_type in _VALUE_TYPES or id(value) in ids:
+                continue
+            if isinstance(value, _VALUES):
+                continue
+            self._add(value)
+            if value_type is dict:
+                stack.extend(value.values())
+            elif value_type is list or value_type is tuple:
+                stack.extend(value)
+            elif isinstance(value, dict):
+                stack.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+            elif isinstance(value, meta.Metadata):
+                stack.extend(value[key] for key in value)
+
+    def index(self, obj):
+        return self._ids.get(id(obj))
+
+    def get(self, index):
+        return self._objects[index]
+
+    def connection_key(self, source, target):
+        # Equal for the numbers of the ports of equal connections
+        return self._canonical[source], self._canonical[target]
+
+    def dumps(self, obj):
+        f = io.BytesIO()
+        pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self._persistent_id
+        pickler.dump(obj)
+        return f.getvalue()
+
+    def loads(self, data):
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = self._objects.__getitem__
+        return unpickler.load()
+
+    def _persistent_id(self, obj):
+        index = self._ids.get(id(obj))
+        if index is None and isinstance(obj, (nodes.Node, nodes.Port)):
+            raise ValueError("{!r} is not part of the project".format(obj))
+        return index
+
+
+# The loader, stages and registry of a worker process
+_worker = None
+
+
+def _initialize(config, stages):
+    global _worker
+    _worker = (loader.ConfigLoader(config), stages, _Registry(config, stages))
+
+
+def _port_index(registry, port):
+    if port is None:
+        return NONE
+    index = registry.index(port)
+    if index is None:
+        raise ValueError("{!r} is not part of the project".format(port))
+    return index
+
+
+def _resolve(chunk):
+    # Resolves the connections of a range of stages, returning the number of
+    # connections for each stage, the connections as integers and the pickled
+    # groups and metadata which are sent separately
+    config_loader, stages, registry = _worker
+    start, end = chunk
+    counts = array.array("q")
+    fields = array.array("q")
+    separate = {}
+    # A graph only keeps the first of equal connections, so later ones in the
+    # chunk aren't sent
+    seen = set()
+    for stage in stages[start:end]:
+        count = 0
+        for connection in config_loader.iter_connections(stage):
+            source = _port_index(registry, connection.source())
+            target = _port_index(registry, connection.target())
+            key = registry.connection_key(source, target)
+            if key in seen:
+                continue
+            seen.add(key)
+            position = len(fields) // CONNECTION_FIELDS
+            group = connection.group
+            if group is None:
+                group_index = NONE
+            else:
+                group_index = registry.index(group)
+                if group_index is None:
+                    group_index = SEPARATE
+                    separate[position, "group"] = group
+            # Metadata is usually an unmodified view of the template data in
+            # the config, which is rebuilt as a view of the same data
+            base = connection.metadata.unmodified_base()
+            if base is not None and not base:
+                metadata_index = NONE
+            else:
+                metadata_index = None if base is None else registry.index(base)
+                if metadata_index is None:
+                    metadata_index = SEPARATE
+                    separate[position, "metadata"] = connection.metadata
+            fields.extend(
+                (
+                    source,
+                    target,
+                    connection.is_internal(),
+                    group_index,
+                    metadata_index,
+                )
+            )
+            count += 1
+        counts.append(count)
+    return counts, fields, registry.dumps(separate)
+
+
+def _iter_serial(config_loader, stages):
+    for stage in stages:
+        yield stage, config_loader.iter_connections(stage)
+
+
+def _iter_parallel(config_loader, stages, processes):
+    # Workers are given the config and stages when they start and return the
+    # connections for each chunk of stages, in order. Only the first of equal
+    # connections is rebuilt, as the graph would discard the others.
+    chunk_size = -(-len(stages) // (processes * CHUNKS_PER_PROCESS))
+    chunks = [
+        (start, min(start + chunk_size, len(stages)))
+        for start in range(0, len(stages), chunk_size)
+    ]
+    with multiprocessing.Pool(
+        processes, _initialize, (config_loader.config(), stages)
+    ) as pool:
+        results = pool.imap(_resolve, chunks)
+        # Numbered while the workers resolve the first chunks
+        registry = _Registry(config_loader.config(), stages)
+        seen = set()
+        for (start, end), resolved in zip(chunks, results):
+            counts, fields, separate = resolved
+            separate = registry.loads(separate)
+            values = iter(fields)
+            rows = enumerate(zip(*[values] * CONNECTION_FIELDS))
+            for stage, count in zip(stages[start:end], counts):
+                connections = []
+                for _, row in zip(range(count), rows):
+                    position, (source, target, internal, group, metadata) = row
+                    key = registry.connection_key(source, target)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if group == SEPARATE:
+                        group = separate[position, "group"]
+                    elif group != NONE:
+                        group = registry.get(group)
+                    else:
+                        group = None
+                    if metadata == SEPARATE:
+                        metadata = separate[position, "metadata"]
+                    elif metadata != NONE:
+                        metadata = meta.Metadata(registry.get(metadata))
+                    else:
+                        metadata = None
+                    connections.append(
+                        nodes.Connection(
+                            registry.get(source) if source != NONE else None,
+                            registry.get(target),
+                            group=group,
+                            internal=bool(internal),
+                            metadata=metadata,
+                        )
+                    )
+                yield stage, connections
+
+
+# Creates the connections for the stages across a pool of processes and adds
+# them to a graph, in the same order as a serial build. Stages must all belong
+# to the same node hierarchy, and any nodes held in their metadata too.
+def build_graph(config_loader, stages, processes=None):
+    stages = list(stages)
+    processes = min(processes or os.cpu_count() or 1, len(stages))
+    if processes > 1:
+        resolved = _iter_parallel(config_loader, stages, processes)
+    else:
+        resolved = _iter_serial(config_loader, stages)
+
+    graph = navigate.Graph()
+    for stage, connections in resolved:
+        graph.add_node(stage)
+        for connection in connections:
+            graph.add_connection(connection)
+    return graph
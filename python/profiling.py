@@ -0,0 +1,86 @@
+import collections
+import json
+import time
+
+import constants
+
+
+class Profiler(object):
+    # Collects timings and counts from a ConfigLoader or parse_expression it
+    # is passed to. Nothing is collected unless a profiler is given, the
+    # instrumented code only checks whether it has one.
+    timer = time.perf_counter
+
+    def __init__(self):
+        # Stage type -> [stages created, seconds creating], and
+        # [stages connected, seconds resolving connections]
+        self._stages = collections.defaultdict(lambda: [0, 0.0, 0, 0.0])
+        # Condition -> [evaluations, seconds]
+        self._conditions = collections.defaultdict(lambda: [0, 0.0])
+        self._expressions = collections.Counter()
+        # Port, eg, "shot.layout.input.model" -> connections
+        self._ports = collections.Counter()
+        self._copies = collections.Counter()
+
+    def add_stage(self, stage_type, seconds, count=1):
+        stats = self._stages[stage_type]
+        stats[0] += count
+        stats[1] += seconds
+
+    def add_stage_connections(self, stage_type, seconds):
+        stats = self._stages[stage_type]
+        stats[2] += 1
+        stats[3] += seconds
+
+    def add_condition(self, condition, seconds, count=1):
+        stats = self._conditions[str(condition)]
+        stats[0] += count
+        stats[1] += seconds
+
+    def add_expression(self, expression):
+        self._expressions[expression.text()] += 1
+
+    def add_connection(self, connection):
+        # Ports are identified by the stage type, the workspace if the port
+        # belongs to one, the port type and the port name
+        port = connection.target()
+        node = port.node()
+        names = [node.type()]
+        parent = node.parent()
+        if parent is not None and node.type() == constants.NodeType.Workspace:
+            names = [parent.type(), node.name()]
+        names.extend((port.type(), port.name()))
+        self._ports[".".join(names)] += 1
+
+    def add_copy(self, kind):
+        self._copies[kind] += 1
+
+    def report(self):
+        # The collected results as plain data, see write()
+        return {
+            "stages": {
+                stage_type: {
+                    "created": created,
+                    "create_seconds": create_seconds,
+                    "connected": connected,
+                    "connect_seconds": connect_seconds,
+                }
+                for stage_type, (
+                    created,
+                    create_seconds,
+                    connected,
+                    connect_seconds,
+                ) in sorted(self._stages.items())
+            },
+            "conditions": {
+                condition: {"count": count, "seconds": seconds}
+                for condition, (count, seconds) in sorted(self._conditions.items())
+            },
+            "expressions": dict(self._expressions.most_common()),
+            "connections": dict(self._ports.most_common()),
+            "copies": dict(self._copies.most_common()),
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,78 @@
+import json
+
+# Sinks receive connections one at a time from ConfigLoader.stream_connections
+# so that a build can be written out without holding every connection in
+# memory. Sinks must be closed to flush anything they have buffered.
+
+
+def describe_connection(connection):
+    # A JSON serialisable description of a connection. Groups which aren't
+    # JSON types are written as their string representation.
+    source = connection.source()
+    target = connection.target()
+    return {
+        "source": [source.node().path(), source.type(), source.name()],
+        "target": [target.node().path(), target.type(), target.name()],
+        "internal": connection.is_internal(),
+        "group": connection.group,
+        "metadata": dict(connection.metadata),
+    }
+
+
+class FileSink(object):
+    # Writes each connection as a line of JSON to a path or open text file
+    def __init__(self, file, describe=describe_connection):
+        if isinstance(file, str):
+            self._file = open(file, "w")
+            self._owned = True
+        else:
+            self._file = file
+            self._owned = False
+        self._describe = describe
+
+    def __call__(self, connection):
+        json.dump(self._describe(connection), self._file, default=str)
+        self._file.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+class BatchSink(object):
+    # Collects connections into lists of up to size connections and passes
+    # each list to callback, eg, a database cursor's executemany
+    def __init__(self, callback, size=1000):
+        if size < 1:
+            raise ValueError("Batch size must be at least 1: {}".format(size))
+        self._callback = callback
+        self._size = size
+        self._batch = []
+
+    def __call__(self, connection):
+        self._batch.append(connection)
+        if len(self._batch) >= self._size:
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def flush(self):
+        if self._batch:
+            batch = self._batch
+            self._batch = []
+            self._callback(batch)
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,581 @@
+import array
+import gc
+import hashlib
+import io
+import json
+import mmap
+import pickle
+import struct
+import sys
+
+import exceptions
+import meta
+import navigate
+import nodes
+
+# A snapshot is laid out as:
+#   header
+#   string table offsets (uint32 * strings + 1) and the utf-8 string data
+#   node table (int32 * 4): type, name, parent, metadata
+#   port table (int32 * 5): node, type, name, multi, metadata
+#   connection table (int32 * 5): source, target, internal, group, metadata
+#   graph nodes (int32): the nodes added to the graph
+#   removed nodes (int32): the roots of the subtrees removed from the graph
+#   object offsets (uint64 * objects + 1) and the objects: the metadata and
+#     groups, each pickled on its own so that they are loaded on first use
+# Strings, nodes, ports and objects are referenced by their index, with -1 for
+# none. Every section starts on an 8 byte boundary and integers are little
+# endian, so the tables can be read in place from a memory map.
+#
+# Pickled objects reference nodes by their index, ports by the number of nodes
+# plus their index and other objects by the number of nodes and ports plus
+# their index. Objects referenced from more than one object, eg, the instances
+# held in shot metadata which are also connection groups, are stored on their
+# own so that they are still shared once loaded.
+MAGIC = b"PGSNAP"
+VERSION = 3
+FINGERPRINT_SIZE = 64
+# magic, version, fingerprint, then the number of strings, nodes, ports,
+# connections, graph nodes, removed nodes and objects, and the size of the
+# objects
+HEADER = struct.Struct("<6sH{}s7IQ".format(FINGERPRINT_SIZE))
+NODE_FIELDS = 4
+PORT_FIELDS = 5
+CONNECTION_FIELDS = 5
+NONE = -1
+
+# Immutable values and classes aren't stored on their own when shared between
+# objects, nor are tuples, eg, the arguments objects are reduced to by pickle
+_UNTRACKED_TYPES = frozenset(
+    (str, bytes, int, float, complex, bool, type(None), tuple, type)
+)
+
+
+def fingerprint(config):
+    # A digest of the config a graph is built from, stored in the snapshot so
+    # that stale snapshots can be detected
+    data = json.dumps(config, sort_keys=True, default=repr).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _iter_roots(graph):
+    # The roots of every hierarchy the graph's nodes and ports belong to
+    roots = {}
+    seen = set()
+    owners = [node for node in graph.iter_nodes()]
+    for connection in graph.iter_connections():
+        owners.append(connection.source().node())
+        owners.append(connection.target().node())
+    for node in owners:
+        if id(node) in seen:
+            continue
+        while node.parent() is not None:
+            seen.add(id(node))
+            node = node.parent()
+        seen.add(id(node))
+        roots.setdefault(id(node), node)
+    return roots.values()
+
+
+def _iter_hierarchy(roots):
+    # Parents always come before their children
+    for root in roots:
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children()))
+
+
+class _Pickler(pickle.Pickler):
+    # Pickles each object on its own, recording the objects referenced from
+    # more than one of them as shared
+    def __init__(self, node_ids, port_ids, object_ids):
+        self._file = io.BytesIO()
+        super(_Pickler, self).__init__(self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._node_ids = node_ids
+        self._port_ids = port_ids
+        self._object_ids = object_ids
+        self._object_offset = len(node_ids) + len(port_ids)
+        self._root = None
+        self._index = None
+        # The object each object was first found in, and the objects found in
+        # each, which also keeps them alive so that their ids aren't reused
+        self._owners = {}
+        self._owned = {}
+        # The shared objects found with the objects to pickle again
+        self.shared = {}
+        self.changed = set()
+        # The objects referenced from each object, see _check_cycles()
+        self.references = {}
+
+    def dump_object(self, index, value):
+        self._root = value
+        self._index = index
+        self._owned[index] = []
+        self.references[index] = []
+        self._file.seek(0)
+        self._file.truncate()
+        self.clear_memo()
+        self.dump(value)
+        return self._file.getvalue()
+
+    def release(self, index):
+        # Forgets the objects found in an object before it is pickled again
+        for obj in self._owned.pop(index):
+            del self._owners[id(obj)]
+
+    def persistent_id(self, obj):
+        obj_type = type(obj)
+        if obj_type in _UNTRACKED_TYPES:
+            return None
+        key = id(obj)
+        index = self._object_ids.get(key)
+        if index is not None and obj is not self._root:
+            self.references[self._index].append(index)
+            return self._object_offset + index
+        if isinstance(obj, nodes.Node):
+            index = self._node_ids.get(key)
+            if index is None:
+                raise exceptions.SnapshotError(
+                    "Metadata references a node outside the graph: {!r}".format(obj)
+                )
+            return index
+        elif isinstance(obj, nodes.Port):
+            index = self._port_ids.get(key)
+            if index is None:
+                raise exceptions.SnapshotError(
+                    "Metadata references a port outside the graph: {!r}".format(obj)
+                )
+            return len(self._node_ids) + index
+        owner = self._owners.get(key)
+        if owner is None:
+            self._owners[key] = self._index
+            self._owned[self._index].append(obj)
+            return None
+        elif owner == self._index:
+            return None
+        self.shared[key] = obj
+        self.changed.update((owner, self._index))
+        return NONE
+
+
+def _dump(objects, object_ids, node_ids, port_ids):
+    # Pickles each object, returning their offsets, data and the objects each
+    # references. Objects found to be shared are stored on their own, and the
+    # objects they were found in pickled again, until none are found.
+    pickler = _Pickler(node_ids, port_ids, object_ids)
+    data = [None] * len(objects)
+    pending = range(len(objects))
+    while pending:
+        for index in pending:
+            data[index] = pickler.dump_object(index, objects[index])
+        start = len(objects)
+        for obj in pickler.shared.values():
+            object_ids[id(obj)] = len(objects)
+            objects.append(obj)
+            data.append(None)
+        for index in pickler.changed:
+            pickler.release(index)
+        pending = sorted(pickler.changed) + list(range(start, len(objects)))
+        pickler.shared = {}
+        pickler.changed = set()
+
+    offsets = array.array("Q", [0])
+    for value in data:
+        offsets.append(offsets[-1] + len(value))
+    references = [pickler.references[index] for index in range(len(objects))]
+    return offsets, b"".join(data), references
+
+
+def _check_cycles(references):
+    # Each object is loaded on its own, so objects stored on their own can't
+    # reference each other in a cycle
+    state = [0] * len(references)
+    for start in range(len(references)):
+        if state[start]:
+            continue
+        state[start] = 1
+        stack = [(start, iter(references[start]))]
+        while stack:
+            index, remaining = stack[-1]
+            for reference in remaining:
+                if state[reference] == 1:
+                    raise exceptions.SnapshotError(
+                        "Metadata contains a reference cycle: {!r}".format(stack[-1][0])
+                    )
+                if not state[reference]:
+                    state[reference] = 1
+                    stack.append((reference, iter(references[reference])))
+                    break
+            else:
+                state[index] = 2
+                stack.pop()
+
+
+def save(graph, path, fingerprint=""):
+    encoded_fingerprint = fingerprint.encode("ascii")
+    if len(encoded_fingerprint) > FINGERPRINT_SIZE:
+        raise ValueError(
+            "Fingerprint is longer than {} bytes: {!r}".format(
+                FINGERPRINT_SIZE, fingerprint
+            )
+        )
+
+    strings = {}
+    # Metadata is stored as its state, once for each metadata. Groups and the
+    # bases shared by metadata, eg, the template data of a stage, are stored
+    # on their own, see _dump().
+    objects = []
+    metadata_ids = {}
+    object_ids = {}
+    bases = set()
+
+    def string(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    def shared(value):
+        index = object_ids.get(id(value))
+        if index is None:
+            index = object_ids[id(value)] = len(objects)
+            objects.append(value)
+        return index
+
+    def metadata(value):
+        # Empty metadata is not stored
+        if not value:
+            return NONE
+        index = metadata_ids.get(id(value))
+        if index is None:
+            index = metadata_ids[id(value)] = len(objects)
+            state = nodes._metadata(value).__getstate__()
+            objects.append(state)
+            base = state[0]
+            if base and id(base) in bases:
+                shared(base)
+            bases.add(id(base))
+        return index
+
+    node_list = list(_iter_hierarchy(_iter_roots(graph)))
+    node_ids = {id(node): index for index, node in enumerate(node_list)}
+    port_ids = {}
+    node_table = array.array("i")
+    port_table = array.array("i")
+    for index, node in enumerate(node_list):
+        parent = node.parent()
+        node_table.extend(
+            (
+                string(node.type()),
+                string(node.name()),
+                NONE if parent is None else node_ids[id(parent)],
+                metadata(node.metadata),
+            )
+        )
+        for port in node.ports():
+            port_ids[id(port)] = len(port_ids)
+            port_table.extend(
+                (
+                    index,
+                    string(port.type()),
+                    string(port.name()),
+                    int(port.is_multi()),
+                    metadata(port.metadata),
+                )
+            )
+
+    connection_table = array.array("i")
+    for connection in graph.iter_connections():
+        try:
+            source = port_ids[id(connection.source())]
+            target = port_ids[id(connection.target())]
+        except KeyError:
+            raise exceptions.SnapshotError(
+                "Connection port does not belong to its node: {!r}".format(connection)
+            )
+        connection_table.extend(
+            (
+                source,
+                target,
+                int(connection.is_internal()),
+                NONE if connection.group is None else shared(connection.group),
+                metadata(connection.metadata),
+            )
+        )
+
+    graph_nodes = array.array("i", (node_ids[id(node)] for node in graph.iter_nodes()))
+    # Removed subtrees are still in the hierarchy, they are only skipped
+    removed_nodes = array.array(
+        "i",
+        (node_ids[id(node)] for node in graph.removed_nodes() if id(node) in node_ids),
+    )
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = array.array("I", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    object_offsets, blob, references = _dump(objects, object_ids, node_ids, port_ids)
+    _check_cycles(references)
+
+    with open(path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                encoded_fingerprint,
+                len(encoded),
+                len(node_list),
+                len(port_ids),
+                len(connection_table) // CONNECTION_FIELDS,
+                len(graph_nodes),
+                len(removed_nodes),
+                len(objects),
+                len(blob),
+            )
+        )
+        f.write(b"\0" * _padding(HEADER.size))
+        sections = [
+            _little_endian(offsets).tobytes(),
+            b"".join(encoded),
+            _little_endian(node_table).tobytes(),
+            _little_endian(port_table).tobytes(),
+            _little_endian(connection_table).tobytes(),
+            _little_endian(graph_nodes).tobytes(),
+            _little_endian(removed_nodes).tobytes(),
+            _little_endian(object_offsets).tobytes(),
+            blob,
+        ]
+        for section in sections:
+            f.write(section)
+            f.write(b"\0" * _padding(len(section)))
+
+
+class _Objects(object):
+    # The objects of a snapshot, each unpickled on first use
+    def __init__(self, data, offsets, node_list, port_list):
+        self._data = data
+        self._offsets = offsets
+        self._node_list = node_list
+        self._port_list = port_list
+        # Objects which may be referenced again, ie, groups and shared objects
+        self._values = {}
+        self._metadata = {}
+
+    def get(self, index):
+        value = self._values.get(index, _MISSING)
+        if value is _MISSING:
+            value = self._values[index] = self.unpickle(index)
+        return value
+
+    def unpickle(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        unpickler = pickle.Unpickler(io.BytesIO(self._data[start:end]))
+        unpickler.persistent_load = self._persistent_load
+        return unpickler.load()
+
+    def metadata(self, index):
+        # Metadata is shared by the objects it was saved on
+        if index == NONE:
+            return None
+        metadata = self._metadata.get(index)
+        if metadata is None:
+            metadata = self._metadata[index] = _LazyMetadata.__new__(_LazyMetadata)
+            metadata._objects = self
+            metadata._index = index
+        return metadata
+
+    def _persistent_load(self, pid):
+        if pid < len(self._node_list):
+            return self._node_list[pid]
+        pid -= len(self._node_list)
+        if pid < len(self._port_list):
+            return self._port_list[pid]
+        return self.get(pid - len(self._port_list))
+
+
+_MISSING = object()
+
+
+class _LazyMetadata(meta.Metadata):
+    # Metadata whose state is unpickled from the snapshot on first use. Until
+    # then the state slots aren't set, so reading them calls __getattr__().
+    __slots__ = ("_objects", "_index")
+
+    _STATE = frozenset(("_base", "_data", "_deleted", "_views"))
+
+    def __getattr__(self, name):
+        if name not in self._STATE:
+            raise AttributeError(name)
+        self.__setstate__(self._objects.unpickle(self._index))
+        self._objects = None
+        return getattr(self, name)
+
+    # Copies are plain metadata
+    def __reduce__(self):
+        return meta.Metadata, (), self.__getstate__()
+
+
+def _read_header(buffer):
+    if len(buffer) < HEADER.size:
+        raise exceptions.SnapshotError("Not a graph snapshot")
+    header = HEADER.unpack_from(buffer)
+    if header[0] != MAGIC:
+        raise exceptions.SnapshotError("Not a graph snapshot")
+    if header[1] != VERSION:
+        raise exceptions.SnapshotError(
+            "Unsupported snapshot version: {}".format(header[1])
+        )
+    return header
+
+
+def read_fingerprint(path):
+    with open(path, "rb") as f:
+        header = _read_header(f.read(HEADER.size))
+    return header[2].rstrip(b"\0").decode("ascii")
+
+
+def load(path, fingerprint=None):
+    # Loads a graph saved with save(). If a fingerprint is given and does not
+    # match the one the snapshot was saved with, StaleSnapshot is raised.
+    # Metadata is unpickled when it is first used, groups as they are loaded.
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            views = []
+            # Everything loaded is kept, so collecting while the objects are
+            # created would only scan them over and over
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                return _load(buffer, views, fingerprint)
+            finally:
+                if collecting:
+                    gc.enable()
+                # Views on the map must be released before it can be closed
+                for view in reversed(views):
+                    view.release()
+
+
+def _load(buffer, views, fingerprint):
+    (
+        _,
+        _,
+        stored_fingerprint,
+        string_count,
+        node_count,
+        port_count,
+        connection_count,
+        graph_node_count,
+        removed_node_count,
+        object_count,
+        blob_size,
+    ) = _read_header(buffer)
+    stored_fingerprint = stored_fingerprint.rstrip(b"\0").decode("ascii")
+    if fingerprint is not None and fingerprint != stored_fingerprint:
+        raise exceptions.StaleSnapshot(
+            "Snapshot fingerprint {} does not match {}".format(
+                stored_fingerprint, fingerprint
+            )
+        )
+
+    view = memoryview(buffer)
+    views.append(view)
+    position = [HEADER.size + _padding(HEADER.size)]
+
+    def section(size, typecode=None):
+        start = position[0]
+        position[0] = start + size + _padding(size)
+        data = view[start : start + size]
+        views.append(data)
+        if typecode is None:
+            return data
+        if sys.byteorder != "little":
+            values = array.array(typecode, data)
+            values.byteswap()
+            return values
+        values = data.cast(typecode)
+        views.append(values)
+        return values
+
+    offsets = section((string_count + 1) * 4, "I")
+    string_data = section(offsets[-1])
+    strings = [
+        sys.intern(str(string_data[offsets[i] : offsets[i + 1]], "utf-8"))
+        for i in range(string_count)
+    ]
+    node_table = section(node_count * NODE_FIELDS * 4, "i")
+    port_table = section(port_count * PORT_FIELDS * 4, "i")
+    connection_table = section(connection_count * CONNECTION_FIELDS * 4, "i")
+    graph_nodes = section(graph_node_count * 4, "i")
+    removed_nodes = section(removed_node_count * 4, "i")
+    object_offsets = section((object_count + 1) * 8, "Q")
+    blob = section(blob_size)
+
+    # The objects outlive the map, so their data is copied
+    node_list = []
+    port_list = []
+    objects = _Objects(bytes(blob), object_offsets.tolist(), node_list, port_list)
+
+    for index in range(0, node_count * NODE_FIELDS, NODE_FIELDS):
+        type, name, parent, metadata = node_table[index : index + NODE_FIELDS]
+        node_list.append(
+            nodes.Node(
+                strings[type],
+                strings[name],
+                parent=None if parent == NONE else node_list[parent],
+                metadata=objects.metadata(metadata),
+            )
+        )
+
+    for index in range(0, port_count * PORT_FIELDS, PORT_FIELDS):
+        node, type, name, multi, metadata = port_table[index : index + PORT_FIELDS]
+        port = nodes.Port(
+            strings[type],
+            strings[name],
+            multi=bool(multi),
+            metadata=objects.metadata(metadata),
+        )
+        node_list[node].add_port(port)
+        port_list.append(port)
+
+    graph = navigate.Graph()
+    for index in graph_nodes:
+        graph.add_node(node_list[index])
+    for index in removed_nodes:
+        node = node_list[index]
+        graph._removed[id(node)] = node
+    # The connections of a saved graph are valid, so they are added to its
+    # maps directly rather than checked again by add_connection()
+    connections = graph._connections
+    outgoing = graph._outgoing
+    incoming = graph._incoming
+    for index in range(0, connection_count * CONNECTION_FIELDS, CONNECTION_FIELDS):
+        source, target, internal, group, metadata = connection_table[
+            index : index + CONNECTION_FIELDS
+        ]
+        source = port_list[source]
+        target = port_list[target]
+        connection = nodes.Connection(
+            source,
+            target,
+            group=None if group == NONE else objects.get(group),
+            internal=bool(internal),
+            metadata=objects.metadata(metadata),
+        )
+        connections.add(connection)
+        outgoing.setdefault(source, set()).add(connection)
+        incoming.setdefault(target, set()).add(connection)
+    return graph
@@ -0,0 +1,252 @@
+import constants
+import exceptions
+import expression
+
+
+def _compile_expression(config, key, required=True):
+    text = config.get(key)
+    if text is None:
+        if required:
+            raise exceptions.ConfigurationError(
+                "Missing expression {!r} in {}".format(key, config)
+            )
+        return None
+    return expression.compile(text)
+
+
+def _stage_key(expression):
+    # Returns the stage metadata key an expression reads, eg, "is_rigged" for
+    # "stage[is_rigged]", or None if it reads anything else. Expressions which
+    # read further into the value, eg, "stage[hero][is_rigged]", can't be
+    # keyed on it as the object it refers to may change.
+    accessors = expression.accessors()
+    if (
+        expression.keyword() == "stage"
+        and len(accessors) == 1
+        and accessors[0][0] == "["
+    ):
+        return accessors[0][1]
+    return None
+
+
+class Condition(object):
+    def __init__(self, config):
+        self.type = config.get("type")
+        self.source = _compile_expression(config, "source")
+        if self.type == "boolean":
+            self.invert = bool(config.get("invert"))
+        elif self.type == "comparison":
+            self.comparison = config.get("comparison")
+            if self.comparison != "in":
+                raise exceptions.ConfigurationError(
+                    "Unsupported comparison operator: {}".format(self.comparison)
+                )
+            self.target = _compile_expression(config, "target")
+        else:
+            raise exceptions.ConfigurationError(
+                "Unsupported conditional type: {}".format(self.type)
+            )
+
+    def __str__(self):
+        if self.type == "comparison":
+            return "{} {} {}".format(
+                self.source.text(), self.comparison, self.target.text()
+            )
+        return "not " + self.source.text() if self.invert else self.source.text()
+
+    def expressions(self):
+        if self.type == "comparison":
+            return [self.source, self.target]
+        return [self.source]
+
+
+class Branch(object):
+    def __init__(self, config, workspaces=False):
+        self.conditions = [Condition(c) for c in config.get("conditions", [])]
+        self.scope = Scope(config, workspaces=workspaces)
+
+
+class Scope(object):
+    def __init__(self, config, workspaces=False):
+        self.workspaces = []
+        if workspaces:
+            workspace_configs = config.get("workspaces") or {}
+            self.workspaces = [
+                WorkspaceTemplate(name, workspace_config or {})
+                for name, workspace_config in workspace_configs.items()
+            ]
+        self.ports = [
+            PortTemplate(port_type, port_name, port_config or {})
+            for port_type, ports in (config.get("ports") or {}).items()
+            for port_name, port_config in (ports or {}).items()
+        ]
+        self.branches = [
+            Branch(branch_config, workspaces=workspaces)
+            for branch_config in config.get("conditional", [])
+        ]
+        self.dependencies = self._find_dependencies()
+
+    def _find_dependencies(self):
+        # The stage metadata keys the branch conditions read. None if any
+        # condition reads something that can't be keyed on, eg, "stage.name"
+        keys = set()
+        for branch in self.branches:
+            for condition in branch.conditions:
+                for expression in condition.expressions():
+                    key = _stage_key(expression)
+                    if key is None:
+                        return None
+                    keys.add(key)
+            if branch.scope.dependencies is None:
+                return None
+            keys.update(branch.scope.dependencies)
+        return tuple(sorted(keys))
+
+
+class InternalConnection(object):
+    type = "internal"
+
+    def __init__(self, port, config):
+        self.workspace = config.get("workspace")
+        self.port_type = config.get("port_type", constants.PortType.Output)
+        self.port_name = config.get("port_name")
+        if self.port_name is None:
+            raise exceptions.ConfigurationError(
+                "Internal connection for {} requires a port_name".format(port.name)
+            )
+        self.group = _compile_expression(config, "group", required=False)
+        self.data = config.get("data", {})
+
+    def expressions(self):
+        return [self.group] if self.group is not None else []
+
+
+class ExternalConnection(object):
+    type = "external"
+
+    def __init__(self, port, config):
+        self.workspace = config.get("workspace")
+        self.port_type = config.get("port_type", constants.PortType.Output)
+        self.port_name = config.get("port_name")
+        if self.port_name is None:
+            raise exceptions.ConfigurationError(
+                "External connection for {} requires a port_name".format(port.name)
+            )
+        self.data = config.get("data", {})
+
+        foreach = config.get("foreach")
+        if foreach is None:
+            raise exceptions.ConfigurationError(
+                "External connection for {} requires a foreach".format(port.name)
+            )
+        self.loop = _compile_expression(foreach, "loop")
+        self.item = expression.compile(foreach.get("item", "item"))
+        self.conditions = [Condition(c) for c in foreach.get("conditions", [])]
+        self.group = _compile_expression(foreach, "group", required=False)
+        # Conditions which don't read the item have the same outcome for
+        # every item in the loop
+        self.item_conditions = []
+        self.loop_conditions = []
+        for condition in self.conditions:
+            if any(e.keyword() == "item" for e in condition.expressions()):
+                self.item_conditions.append(condition)
+            else:
+                self.loop_conditions.append(condition)
+
+    def expressions(self):
+        expressions = [self.loop, self.item]
+        for condition in self.conditions:
+            expressions.extend(condition.expressions())
+        if self.group is not None:
+            expressions.append(self.group)
+        return expressions
+
+
+class PromotedConnection(object):
+    type = "promoted"
+
+    def __init__(self, port, config):
+        self.port_type = config.get("port_type", constants.PortType.Input)
+        self.port_name = config.get("port_name", port.name)
+        self.group = _compile_expression(config, "group", required=False)
+
+    def expressions(self):
+        return [self.group] if self.group is not None else []
+
+
+class DemotedConnection(object):
+    type = "demoted"
+
+    def __init__(self, port, config):
+        self.workspace = config.get("workspace")
+        if self.workspace is None:
+            raise exceptions.ConfigurationError(
+                "Demoted connection for {} requires a workspace".format(port.name)
+            )
+        self.port_type = config.get("port_type", port.type)
+        self.port_name = config.get("port_name", port.name)
+        self.group = _compile_expression(config, "group", required=False)
+
+    def expressions(self):
+        return [self.group] if self.group is not None else []
+
+
+CONNECTION_TYPES = {
+    cls.type: cls
+    for cls in (
+        InternalConnection,
+        ExternalConnection,
+        PromotedConnection,
+        DemotedConnection,
+    )
+}
+
+
+class PortTemplate(object):
+    def __init__(self, type, name, config):
+        self.type = type
+        self.name = name
+        self.multi = config.get("multi", False)
+        self.data = config.get("data", {})
+        self.connections = []
+        for connection_config in config.get("connections", []):
+            connection_type = connection_config.get("type")
+            cls = CONNECTION_TYPES.get(connection_type)
+            if cls is None:
+                raise exceptions.ConfigurationError(
+                    "Unknown connection type: {}".format(connection_type)
+                )
+            self.connections.append(cls(self, connection_config))
+        self.dependencies = self._find_dependencies()
+
+    def _find_dependencies(self):
+        # The stage metadata keys the connections read, eg, the foreach loop.
+        # None if a connection reads the stage in a way that can't be keyed on
+        keys = set()
+        for connection in self.connections:
+            for expression in connection.expressions():
+                if expression.keyword() != "stage":
+                    continue
+                key = _stage_key(expression)
+                if key is None:
+                    return None
+                keys.add(key)
+        return tuple(sorted(keys))
+
+
+class WorkspaceTemplate(object):
+    def __init__(self, name, config):
+        self.name = name
+        self.data = config.get("data", {})
+        self.scope = Scope(config)
+
+
+class StageTemplate(object):
+    def __init__(self, type, config):
+        if "workspaces" not in config:
+            raise exceptions.ConfigurationError(
+                "Stage {} does not define any workspaces".format(type)
+            )
+        self.type = type
+        self.data = config.get("data") or {}
+        self.scope = Scope(config, workspaces=True)
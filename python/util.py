@@ -1,7 +1,8 @@
+import contextlib
 import enum
-import re
+import threading
 
-import exceptions
+import expression as expressions
 
 
 class Subtype(enum.Enum):
@@ -16,9 +17,9 @@ class Subtype(enum.Enum):
 
 def collapse_meta(meta):
     value = meta["value"]
-    if meta["type"] == "dict" and meta["subtype"] == Subtype.Mixed.value:
+    if meta["type"] == "dict" and meta.get("subtype") == Subtype.Mixed.value:
         value = collapse_metadata_dict(value)
-    elif meta["type"] == "list" and meta["subtype"] == Subtype.Mixed.value:
+    elif meta["type"] == "list" and meta.get("subtype") == Subtype.Mixed.value:
         value = collapse_metadata_list(value)
     return value
 
@@ -31,44 +32,65 @@ def collapse_metadata_dict(metadata):
     return {key: collapse_meta(meta) for key, meta in metadata.items()}
 
 
-def parse_expression(expression, keywords):
-    current = None
-    index = 0
-    while index < len(expression):
-        # Attempts to match any of the following:
-        #   word
-        #   .word
-        #   [word]
-        match = re.match(r"((\.)|(\[))?(\w+)(?(3)\])", expression[index:])
-        if match is None:
-            raise exceptions.InvalidExpression("Malformed expression")
+def parse_expression(expression, keywords, profiler=None):
+    # Calls are counted by the profiler if given, see profiling.Profiler
+    if profiler is not None:
+        profiler.add_expression(expressions.compile(expression))
+    return expressions.parse(expression, keywords)
+
+
+class ReadWriteLock(object):
+    # Allows any number of readers at once, or a single writer. Waiting
+    # writers hold off new readers so that a steady stream of reads can't
+    # starve them. Neither side is reentrant.
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
 
-        accessor, _, _, value = match.groups()
+    @contextlib.contextmanager
+    def write(self):
+        self.acquire_write()
         try:
-            if current is None:
-                current = keywords[value]
-            elif accessor == ".":
-                current = getattr(current, value)
-            elif accessor == "[":
-                current = current[value]
-            elif accessor is None:
-                raise exceptions.InvalidExpression(
-                    "Missing accessor for keyword: {}".format(value)
-                )
-            else:
-                raise exceptions.InvalidExpression(
-                    "Unknown accessor: {}".format(accessor)
-                )
-        except (KeyError, TypeError, AttributeError) as e:
-            raise exceptions.MissingData(
-                "Failed to resolve expression {} with keywords {}: {}".format(
-                    expression, keywords, e
-                )
-            ) from e
-
-        index += match.end()
-
-    return current
+            yield
+        finally:
+            self.release_write()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+import yaml
+
+import loader, navigate
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "graph.yml")
+
+
+class Instance(object):
+    def __init__(self, name, asset):
+        self.name = name
+        self.asset = asset
+
+    def __str__(self):
+        return self.name
+
+
+@pytest.fixture
+def config():
+    with open(CONFIG_PATH) as f:
+        return yaml.safe_load(f)
+
+
+@pytest.fixture
+def config_loader(config):
+    return loader.ConfigLoader(config)
+
+
+def make_shot(config_loader, parent, name, animated=(), static=()):
+    return config_loader.create_stage_node(
+        "shot",
+        name,
+        {
+            "animated_instances": {"type": "list", "value": list(animated)},
+            "static_instances": {"type": "list", "value": list(static)},
+        },
+        parent,
+    )
+
+
+def build_graph(config_loader, stages):
+    graph = navigate.Graph()
+    for stage in stages:
+        graph.add_node(stage)
+        for connection in config_loader.create_connections(stage):
+            graph.add_connection(connection)
+    return graph
+
+
+def describe(connection):
+    # A connection as plain values, to compare graphs built separately
+    ports = [
+        None if port is None else (port.node().path(), port.type(), port.name())
+        for port in (connection.source(), connection.target())
+    ]
+    return (
+        ports[0],
+        ports[1],
+        connection.is_internal(),
+        getattr(connection.group, "name", connection.group),
+        dict(connection.metadata),
+    )
@@ -0,0 +1,79 @@
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import analytics, constants, navigate, nodes
+
+
+def make_stage(name, workspaces):
+    # A stage with workspaces given as name -> (inputs, outputs)
+    stage = nodes.Node("asset", name)
+    for workspace_name, (inputs, outputs) in workspaces.items():
+        workspace = nodes.Node(constants.NodeType.Workspace, workspace_name, stage)
+        for port_name in inputs:
+            workspace.add_port(nodes.Port(constants.PortType.Input, port_name))
+        for port_name in outputs:
+            workspace.add_port(nodes.Port(constants.PortType.Output, port_name))
+    return stage
+
+
+def port(stage, workspace, type, name):
+    return stage.child(workspace).port(type, name)
+
+
+@pytest.fixture
+def graph():
+    # a.model -> a.rig -> b.anim, a.model -> b.anim, with c unconnected
+    a = make_stage("a", {"model": ((), ["model"]), "rig": (["model"], ["rig"])})
+    b = make_stage("b", {"anim": (["rig", "model"], ["cache"])})
+    c = make_stage("c", {"light": (["cache"], [])})
+    graph = navigate.Graph()
+    for stage in (a, b, c):
+        graph.add_node(stage)
+    Input, Output = constants.PortType.Input, constants.PortType.Output
+    for source, target in (
+        (port(a, "model", Output, "model"), port(a, "rig", Input, "model")),
+        (port(a, "rig", Output, "rig"), port(b, "anim", Input, "rig")),
+        (port(a, "model", Output, "model"), port(b, "anim", Input, "model")),
+    ):
+        graph.add_connection(nodes.Connection(source, target))
+    return graph
+
+
+def test_export(graph):
+    csr = analytics.export(graph)
+    assert len(csr) == 6
+    # Three connections and three workspace input to output edges
+    assert csr.edge_count() == 6
+    for index, port in enumerate(csr.ports):
+        assert csr.port_ids[port] == index
+        assert set(
+            csr.ports_for(csr.indices[csr.indptr[index] : csr.indptr[index + 1]])
+        ) == set(graph._successors(port))
+        assert csr.stages[csr.port_stages[index]] is port.node().parent()
+
+    assert analytics.export(graph, workspaces=False).edge_count() == 3
+
+
+def test_degrees(graph):
+    csr = analytics.export(graph, workspaces=False)
+    a, b = graph.node("a", "asset"), graph.node("b", "asset")
+    out_degree = dict(zip(csr.ports, csr.out_degree()))
+    assert out_degree[port(a, "model", constants.PortType.Output, "model")] == 2
+    assert dict(zip(csr.stages, csr.stage_degree(csr.in_degree()))) == {a: 1, b: 2}
+    assert dict(zip(csr.stages, csr.stage_degree(csr.out_degree()))) == {a: 3, b: 0}
+
+
+def test_bfs(graph):
+    csr = analytics.export(graph)
+    start = port(graph.node("a", "asset"), "model", constants.PortType.Output, "model")
+    distances = csr.bfs(csr.ids([start]))
+    reached = {p: d for p, d in zip(csr.ports, distances) if d >= 0 and p != start}
+    assert set(reached) == graph.downstream(start)
+    cache = port(graph.node("b", "asset"), "anim", constants.PortType.Output, "cache")
+    # model -> anim.model -> cache is shorter than through the rig
+    assert reached[cache] == 2
+
+    upstream = csr.bfs(csr.ids([cache]), reverse=True)
+    assert {p for p, d in zip(csr.ports, upstream) if d > 0} == graph.upstream(cache)
+    assert list(csr.bfs(numpy.zeros(0, dtype=int))) == [-1] * len(csr)
@@ -0,0 +1,99 @@
+import diff, loader, nodes, snapshot
+from conftest import Instance, build_graph, make_shot
+
+
+def build(config, assets, instances):
+    # Builds a graph of assets, given as name -> is_rigged, and a shot with
+    # the given asset instances
+    config_loader = loader.ConfigLoader(config)
+    project = nodes.Node("project", "project")
+    stages = {}
+    for name, is_rigged in assets.items():
+        stages[name] = config_loader.create_stage_node(
+            "asset", name, {"is_rigged": {"type": "bool", "value": is_rigged}}, project
+        )
+    shot = make_shot(
+        config_loader,
+        project,
+        "shotA",
+        animated=[Instance(name + "_1", stages[name]) for name in instances],
+    )
+    return build_graph(config_loader, list(stages.values()) + [shot])
+
+
+def test_unchanged(config):
+    old = build(config, {"assetA": True}, ["assetA"])
+    new = build(config, {"assetA": True}, ["assetA"])
+    for changes in diff.diff(old, new):
+        assert changes == ([], [], [])
+
+
+def test_diff(config):
+    old = build(config, {"assetA": True}, ["assetA"])
+    new = build(config, {"assetA": True, "assetB": False}, ["assetA", "assetB"])
+    result = diff.diff(old, new)
+
+    assert result.nodes.added == [nodes.Node("asset", "assetB")]
+    assert result.nodes.removed == []
+    # The shot's instances changed
+    assert [(a.name(), b.name()) for a, b in result.nodes.changed] == [
+        ("shotA", "shotA")
+    ]
+
+    assert result.connections.added
+    assert result.connections.removed == []
+    # Only connections from assetB, its rig port is missing as it isn't rigged
+    for connection in result.connections.added:
+        ports = [connection.source(), connection.target()]
+        assert any(port is None or "assetB" in port.node().path() for port in ports)
+
+    reverse = diff.diff(new, old)
+    assert reverse.nodes.removed == result.nodes.added
+    assert set(reverse.connections.removed) == set(result.connections.added)
+    assert set(reverse.ports.removed) == set(result.ports.added)
+
+
+def test_diff_changed_metadata(config):
+    old = build(config, {"assetA": True}, ["assetA"])
+    new = build(config, {"assetA": True}, ["assetA"])
+    connection = next(iter(new.iter_connections()))
+    connection.metadata["extra"] = {"type": "int", "value": 1}
+    result = diff.diff(old, new)
+    assert [b for _, b in result.connections.changed] == [connection]
+    assert result.connections.added == result.connections.removed == []
+
+
+def test_content_hash(config):
+    old = build(config, {"assetA": True}, ["assetA"])
+    new = build(config, {"assetA": True}, ["assetA"])
+    shots = [graph.node("shotA", "shot") for graph in (old, new)]
+    assert diff.content_hash(shots[0]) == diff.content_hash(shots[1])
+    assert diff.content_hash(shots[0]) != diff.content_hash(old.node("assetA", "asset"))
+
+
+def test_diff_snapshot(config, tmp_path):
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(build(config, {"assetA": True}, ["assetA"]), path)
+
+    unchanged = diff.diff_snapshot(path, build(config, {"assetA": True}, ["assetA"]))
+    for changes in unchanged:
+        assert changes == ([], [], [])
+
+    result = diff.diff_snapshot(
+        path, build(config, {"assetA": True, "assetB": True}, ["assetA"])
+    )
+    assert result.nodes.added == [nodes.Node("asset", "assetB")]
+    assert result.nodes.changed == []
+
+
+def test_diff_removed_node(config):
+    old = build(config, {"assetA": True}, ["assetA"])
+    new = build(config, {"assetA": True}, ["assetA"])
+    rigging = new.node("assetA", "asset").child("rigging")
+    removed = new.remove_node(rigging)
+    result = diff.diff(old, new)
+
+    assert removed and rigging.parent() is not None
+    assert set(result.connections.removed) == set(removed)
+    assert set(result.ports.removed) == set(rigging.ports())
+    assert result.ports.added == []
@@ -40,3 +40,19 @@ def test_valid(expr, keywords, expected):
 def test_exception(expr, keywords, exc):
     with pytest.raises(exc):
         expression.parse(expr, keywords)
+
+
+def test_compile_is_cached():
+    assert expression.compile("a[b][c]") is expression.compile("a[b][c]")
+
+
+@pytest.mark.parametrize("expr", ["key+value", "key[value", "a[b]c"])
+def test_compile_invalid(expr):
+    with pytest.raises(exceptions.InvalidExpression):
+        expression.compile(expr)
+
+
+def test_compiled_reuse():
+    compiled = expression.compile("key.attr[key]")
+    assert compiled.evaluate({"key": Temp({"key": 1})}) == 1
+    assert compiled.evaluate({"key": Temp({"key": 2})}) == 2
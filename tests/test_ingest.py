@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import ingest, loader, nodes
+from conftest import Instance, build_graph, describe
+
+
+@pytest.fixture
+def data():
+    # Stage data as returned by the tracking service, with shots referring to
+    # assets by name
+    data = {}
+    for index in range(6):
+        data[("asset", "asset{}".format(index))] = {
+            "is_rigged": {"type": "bool", "value": index % 2 == 0}
+        }
+    for index in range(4):
+        data[("shot", "shot{}".format(index))] = {
+            "animated": [("a", "asset{}".format(index))],
+            "static": [("b", "asset{}".format(index + 1))],
+        }
+    return data
+
+
+def convert(stage_type, name, data, parent):
+    if stage_type != "shot":
+        return data
+    return {
+        key
+        + "_instances": {
+            "type": "list",
+            "value": [Instance(i, parent.child(asset)) for i, asset in data[key]],
+        }
+        for key in ("animated", "static")
+    }
+
+
+def test_build_graph(config, data):
+    config_loader = loader.ConfigLoader(config)
+    project = nodes.Node("project", "project")
+    stages = [
+        config_loader.create_stage_node(
+            stage_type, name, convert(stage_type, name, stage_data, project), project
+        )
+        for (stage_type, name), stage_data in data.items()
+    ]
+    expected = build_graph(config_loader, stages)
+
+    provider = ingest.LocalProvider(data, delay=0.01)
+    project = nodes.Node("project", "project")
+    graph = asyncio.run(
+        ingest.build_graph(
+            loader.ConfigLoader(config),
+            provider,
+            list(data),
+            parent=project,
+            limit=3,
+            convert=convert,
+        )
+    )
+    # Groups are instances, which differ between builds, so compare by name
+    assert list(map(describe, graph.iter_connections())) == list(
+        map(describe, expected.iter_connections())
+    )
+    assert list(graph.iter_nodes()) == list(expected.iter_nodes())
+    assert provider.max_active == 3
+
+
+def test_build_graph_error(config, data):
+    provider = ingest.LocalProvider(data)
+    stages = list(data) + [("asset", "missing")]
+    with pytest.raises(KeyError):
+        asyncio.run(
+            ingest.build_graph(
+                loader.ConfigLoader(config),
+                provider,
+                stages,
+                parent=nodes.Node("project", "project"),
+                convert=convert,
+            )
+        )
+
+    with pytest.raises(ValueError):
+        asyncio.run(
+            ingest.build_graph(loader.ConfigLoader(config), provider, stages, limit=0)
+        )
@@ -0,0 +1,487 @@
+import copy
+import os
+
+import pytest
+import yaml
+
+import constants, exceptions, loader, nodes
+from conftest import CONFIG_PATH, Instance, build_graph, make_shot
+
+
+def port_names(node):
+    return sorted((port.type(), port.name()) for port in node.ports())
+
+
+def test_create_stage_node(config_loader):
+    asset = config_loader.create_stage_node("asset", "assetA", {})
+    assert [c.name() for c in asset.children()] == ["modeling", "surfacing"]
+    assert port_names(asset) == [("output", "material"), ("output", "model")]
+    assert port_names(asset.child("modeling")) == [
+        ("output", "model"),
+        ("output", "review"),
+    ]
+
+
+def test_create_stage_node_conditional(config_loader):
+    asset = config_loader.create_stage_node(
+        "asset", "assetB", {"is_rigged": {"type": "bool", "value": True}}
+    )
+    assert [c.name() for c in asset.children()] == [
+        "modeling",
+        "surfacing",
+        "rigging",
+    ]
+    assert port_names(asset) == [
+        ("output", "material"),
+        ("output", "model"),
+        ("output", "rig"),
+    ]
+    assert port_names(asset.child("modeling")) == [
+        ("output", "animGeo"),
+        ("output", "blendshape"),
+        ("output", "model"),
+        ("output", "review"),
+    ]
+
+
+def test_create_connections_internal(config_loader):
+    asset = config_loader.create_stage_node("asset", "assetA", {})
+    connections = config_loader.create_connections(asset)
+    pairs = [
+        (c.source().node().name(), c.target().node().name(), c.target().name())
+        for c in connections
+    ]
+    assert pairs == [
+        ("modeling", "surfacing", "model"),
+        ("modeling", "assetA", "model"),
+        ("surfacing", "assetA", "model"),
+        ("surfacing", "assetA", "material"),
+    ]
+    assert all(c.is_internal() for c in connections)
+
+
+def test_create_connections_external(config_loader):
+    project = nodes.Node("project", "project")
+    assetA = config_loader.create_stage_node("asset", "assetA", {}, project)
+    assetB = config_loader.create_stage_node(
+        "asset", "assetB", {"is_rigged": {"type": "bool", "value": True}}, project
+    )
+    instances = [Instance("assetB_1", assetB), Instance("assetA_1", assetA)]
+    shot = make_shot(config_loader, project, "shotA", static=instances)
+
+    external = [
+        c for c in config_loader.create_connections(shot) if not c.is_internal()
+    ]
+    assert [(c.source().node(), c.target().name(), c.group) for c in external] == [
+        (assetB, "model", instances[0]),
+        (assetA, "model", instances[1]),
+    ]
+    assert external[0].source() is assetB.port(constants.PortType.Output, "model")
+
+
+def test_invalid_connection_type(config):
+    config["stages"]["asset"]["ports"]["output"]["model"]["connections"][0][
+        "type"
+    ] = "unknown"
+    with pytest.raises(exceptions.ConfigurationError):
+        loader.ConfigLoader(config)
+
+
+def test_invalid_conditional_type(config):
+    config["stages"]["asset"]["conditional"][0]["conditions"][0]["type"] = "unknown"
+    with pytest.raises(exceptions.ConfigurationError):
+        loader.ConfigLoader(config)
+
+
+def test_conditions_memoized(config_loader, monkeypatch):
+    calls = []
+    resolve_conditional = config_loader._resolve_conditional
+    monkeypatch.setattr(
+        config_loader,
+        "_resolve_conditional",
+        lambda *args: calls.append(args) or resolve_conditional(*args),
+    )
+
+    for index in range(10):
+        config_loader.create_stage_node(
+            "asset",
+            "asset{}".format(index),
+            {"is_rigged": {"type": "bool", "value": index % 2 == 0}},
+        )
+    # One evaluation for each distinct value of is_rigged, for the stage scope
+    # and for the modeling workspace scope
+    assert len(calls) == 4
+
+    rigged = config_loader.create_stage_node(
+        "asset", "rigged", {"is_rigged": {"type": "bool", "value": True}}
+    )
+    assert len(calls) == 4
+    assert rigged.child("rigging") is not None
+
+
+def test_conditions_nested_not_memoized(config):
+    # The shot's fx workspace depends on data of the asset it refers to
+    config["stages"]["shot"].setdefault("conditional", []).append(
+        {
+            "conditions": [{"type": "boolean", "source": "stage[hero][is_rigged]"}],
+            "workspaces": {"fx": {}},
+        }
+    )
+    config_loader = loader.ConfigLoader(config)
+    hero = config_loader.create_stage_node("asset", "hero", {})
+    data = {
+        "animated_instances": {"type": "list", "value": []},
+        "static_instances": {"type": "list", "value": []},
+        "hero": {"type": "object", "value": hero},
+    }
+    shotA = config_loader.create_stage_node("shot", "shotA", data)
+    assert shotA.child("fx") is None
+
+    hero.metadata["is_rigged"] = {"type": "bool", "value": True}
+    shotB = config_loader.create_stage_node("shot", "shotB", data)
+    assert shotB.child("fx") is not None
+
+
+def test_update_connections(config_loader):
+    project = nodes.Node("project", "project")
+    assetA = config_loader.create_stage_node("asset", "assetA", {}, project)
+    assetB = config_loader.create_stage_node("asset", "assetB", {}, project)
+    instanceA = Instance("assetA_1", assetA)
+    shot = make_shot(config_loader, project, "shotA", static=[instanceA])
+    graph = build_graph(config_loader, [assetA, assetB, shot])
+    model = shot.port(constants.PortType.Input, "model")
+
+    instanceB = Instance("assetB_1", assetB)
+    shot.metadata["static_instances"] = {
+        "type": "list",
+        "value": [instanceA, instanceB],
+    }
+    added, removed = config_loader.update_connections(graph, shot, ["static_instances"])
+    assert [(c.source().node(), c.group) for c in added] == [(assetB, instanceB)]
+    assert removed == []
+    assert {c.source() for c in graph.incoming(model)} == {
+        assetA.port(constants.PortType.Output, "model"),
+        assetB.port(constants.PortType.Output, "model"),
+    }
+
+    shot.metadata["static_instances"] = {"type": "list", "value": []}
+    added, removed = config_loader.update_connections(graph, shot, ["static_instances"])
+    assert added == []
+    assert len(removed) == 2
+    assert graph.incoming(model) == set()
+
+
+def test_update_connections_unrelated_key(config_loader):
+    project = nodes.Node("project", "project")
+    asset = config_loader.create_stage_node("asset", "assetA", {}, project)
+    shot = make_shot(
+        config_loader, project, "shotA", static=[Instance("assetA_1", asset)]
+    )
+    graph = build_graph(config_loader, [asset, shot])
+
+    shot.metadata["static_instances"] = {"type": "list", "value": []}
+    assert config_loader.update_connections(graph, shot, ["animated_instances"]) == (
+        [],
+        [],
+    )
+
+
+def test_update_connections_structure_changed(config_loader):
+    asset = config_loader.create_stage_node("asset", "assetA", {})
+    graph = build_graph(config_loader, [asset])
+
+    asset.metadata["is_rigged"] = {"type": "bool", "value": True}
+    with pytest.raises(ValueError):
+        config_loader.update_connections(graph, asset, ["is_rigged"])
+
+
+def test_update_connections_port_removed(config_loader):
+    project = nodes.Node("project", "project")
+    asset = config_loader.create_stage_node(
+        "asset", "assetA", {"is_rigged": {"type": "bool", "value": True}}, project
+    )
+    shot = make_shot(
+        config_loader, project, "shotA", animated=[Instance("assetA_1", asset)]
+    )
+    graph = build_graph(config_loader, [asset, shot])
+    rig = asset.port(constants.PortType.Output, "rig")
+    outgoing = graph.outgoing(rig)
+    assert outgoing
+
+    asset.metadata["is_rigged"] = {"type": "bool", "value": False}
+    added, removed = config_loader.update_connections(graph, asset, ["is_rigged"])
+    assert added == []
+    assert outgoing <= set(removed)
+    assert graph.outgoing(rig) == set()
+    assert graph.incoming(rig) == set()
+
+
+def test_stage_metadata_not_shared(config_loader):
+    first = config_loader.create_stage_node("asset", "assetA", {})
+    second = config_loader.create_stage_node("asset", "assetB", {})
+    first.metadata["is_rigged"] = {"type": "bool", "value": True}
+
+    assert first["is_rigged"] is True
+    assert second["is_rigged"] is False
+    assert config_loader.metadata("asset")["is_rigged"]["value"] is False
+
+
+def test_stage_metadata_modified_in_place(config_loader):
+    config = copy.deepcopy(config_loader.config())
+    project = nodes.Node("project", "project")
+    first = make_shot(config_loader, project, "shotA")
+    second = make_shot(config_loader, project, "shotB")
+    first.metadata["static_instances"]["value"].append("instance")
+    first.metadata["static_instances"]["value"] = ["replaced"]
+    first.metadata["animated_instances"]["value"].append("instance")
+
+    asset = config_loader.create_stage_node("asset", "assetA", {})
+    texture = asset.child("surfacing").port("output", "texture")
+    texture.metadata["variation"]["value"].append({"type": "str", "value": "new"})
+    texture["variation"].append({"type": "str", "value": "other"})
+
+    assert first["static_instances"] == ["replaced"]
+    assert first["animated_instances"] == ["instance"]
+    assert second["static_instances"] == []
+    assert second["animated_instances"] == []
+    other = config_loader.create_stage_node("asset", "assetB", {})
+    texture = other.child("surfacing").port("output", "texture")
+    assert texture["variation"] == [{"type": "str", "value": "passname"}]
+    assert config_loader.config() == config
+
+
+def test_create_stage_node_lazy(config_loader):
+    def structure(node):
+        return (
+            node.type(),
+            node.name(),
+            port_names(node),
+            [structure(c) for c in node.children()],
+        )
+
+    data = {"is_rigged": {"type": "bool", "value": True}}
+    project = nodes.Node("project", "project")
+    eager = config_loader.create_stage_node("asset", "assetA", data, project)
+    lazy = config_loader.create_stage_node("asset", "assetA", data, project, lazy=True)
+    assert lazy.is_pending()
+    assert lazy["is_rigged"] is True
+    assert lazy.is_pending()
+
+    assert structure(lazy) == structure(eager)
+    assert not lazy.is_pending()
+
+    shot = make_shot(
+        config_loader, project, "shotA", static=[Instance("assetA_1", lazy)]
+    )
+    connections = config_loader.create_connections(shot)
+    assert [c.source().node() for c in connections if not c.is_internal()] == [lazy]
+
+    # Lazy stages are built from their metadata when created, the same as an
+    # eager stage, even if it changes before they are accessed
+    eager = config_loader.create_stage_node("asset", "assetB", {}, project)
+    lazy = config_loader.create_stage_node("asset", "assetB", {}, project, lazy=True)
+    for node in (eager, lazy):
+        node.metadata["is_rigged"] = {"type": "bool", "value": True}
+    assert structure(lazy) == structure(eager)
+    assert lazy.child("rigging") is None
+    assert lazy["is_rigged"] is True
+
+    # Including entries modified in place, which are copied when created
+    data = {"is_rigged": {"type": "bool", "value": False}}
+    eager = config_loader.create_stage_node("asset", "assetC", data, project)
+    lazy = config_loader.create_stage_node("asset", "assetC", data, project, lazy=True)
+    for node in (eager, lazy):
+        node.metadata.mutable("is_rigged")["value"] = True
+    assert structure(lazy) == structure(eager)
+    assert lazy.child("rigging") is None
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_create_stage_nodes(config, monkeypatch, vectorized):
+    if vectorized:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(loader, "numpy", None)
+
+    asset = config["stages"]["asset"]
+    asset["data"]["department"] = {"type": "str", "value": "modeling"}
+    asset["data"]["departments"] = {"type": "list", "value": ["fx", "crowd"]}
+    asset["conditional"].append(
+        {
+            "conditions": [
+                {
+                    "type": "comparison",
+                    "source": "stage[department]",
+                    "comparison": "in",
+                    "target": "stage[departments]",
+                }
+            ],
+            "ports": {"output": {"cache": {}}},
+            "conditional": [
+                {
+                    "conditions": [
+                        {
+                            "type": "boolean",
+                            "source": "stage[is_rigged]",
+                            "invert": True,
+                        }
+                    ],
+                    "ports": {"output": {"proxy": {}}},
+                }
+            ],
+        }
+    )
+    config_loader = loader.ConfigLoader(config)
+
+    stages = [
+        (
+            "asset{}".format(index),
+            {
+                "is_rigged": {"type": "bool", "value": index % 2 == 0},
+                "department": {
+                    "type": "str",
+                    "value": ["fx", "lookdev"][index % 3 % 2],
+                },
+            },
+        )
+        for index in range(12)
+    ]
+    project = nodes.Node("project", "project")
+    created = config_loader.create_stage_nodes("asset", stages, project)
+    expected = [
+        config_loader.create_stage_node("asset", name, data) for name, data in stages
+    ]
+
+    def structure(node):
+        return (
+            node.name(),
+            port_names(node),
+            [structure(c) for c in node.children()],
+        )
+
+    assert project.children() == created
+    assert [structure(n) for n in created] == [structure(n) for n in expected]
+    assert {("output", "proxy") in port_names(n) for n in created} == {True, False}
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+@pytest.mark.parametrize(
+    "target, values, matches",
+    [
+        # Substrings of a shared string
+        ({"type": "str", "value": "abc"}, ["ab", "bd", "c"], [True, False, True]),
+        # Lists in a shared list of lists
+        (
+            {"type": "list", "value": [[1, 2], [3, 4]]},
+            [[1, 2], [2, 1], [3, 4]],
+            [True, False, True],
+        ),
+        # Strings in a shared list of strings
+        ({"type": "list", "value": ["a", "c"]}, ["a", "b", "c"], [True, False, True]),
+        # Values of mixed types, which must not be converted to a common type
+        ({"type": "list", "value": ["a", 1]}, ["1", "a", 2], [False, True, False]),
+    ],
+)
+def test_create_stage_nodes_comparison(
+    config, monkeypatch, vectorized, target, values, matches
+):
+    if vectorized:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(loader, "numpy", None)
+
+    asset = config["stages"]["asset"]
+    asset["data"]["targets"] = target
+    asset["conditional"].append(
+        {
+            "conditions": [
+                {
+                    "type": "comparison",
+                    "source": "stage[value]",
+                    "comparison": "in",
+                    "target": "stage[targets]",
+                }
+            ],
+            "ports": {"output": {"cache": {}}},
+        }
+    )
+    config_loader = loader.ConfigLoader(config)
+    stages = [
+        ("asset{}".format(index), {"value": {"type": "object", "value": value}})
+        for index, value in enumerate(values)
+    ]
+    created = config_loader.create_stage_nodes("asset", stages)
+    expected = [
+        config_loader.create_stage_node("asset", name, data) for name, data in stages
+    ]
+    assert [port_names(n) for n in created] == [port_names(n) for n in expected]
+    assert [("output", "cache") in port_names(n) for n in created] == matches
+
+
+def test_external_sources_resolved_once(config_loader, monkeypatch):
+    project = nodes.Node("project", "project")
+    assetA = config_loader.create_stage_node("asset", "assetA", {}, project)
+    assetB = config_loader.create_stage_node("asset", "assetB", {}, project)
+    instances = [
+        Instance("{}_{}".format(asset.name(), index), asset)
+        for index in range(5)
+        for asset in (assetA, assetB)
+    ]
+    shot = make_shot(config_loader, project, "shotA", static=instances)
+
+    calls = []
+    resolve_source_port = config_loader._resolve_source_port
+    monkeypatch.setattr(
+        config_loader,
+        "_resolve_source_port",
+        lambda *args: calls.append(args[0]) or resolve_source_port(*args),
+    )
+    external = [
+        c for c in config_loader.create_connections(shot) if not c.is_internal()
+    ]
+    assert [c.group for c in external] == instances
+    assert [c.source().node() for c in external] == [assetA, assetB] * 5
+    assert [node for node in calls if node.type() == "asset"] == [assetA, assetB]
+
+
+def test_load_cached(config, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    config_loader = loader.load(CONFIG_PATH, cache_dir=cache_dir)
+    assert config_loader.config() == config
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Later loads use the compiled config without parsing the file
+    def fail(*args, **kwargs):
+        raise AssertionError("Config parsed")
+
+    with monkeypatch.context() as m:
+        m.setattr(loader.yaml, "load", fail)
+        m.setattr(loader.ConfigLoader, "__init__", fail)
+        cached = loader.load(CONFIG_PATH, cache_dir=cache_dir)
+    assert cached.config() == config
+    project = nodes.Node("project", "project")
+    asset = cached.create_stage_node("asset", "assetA", {}, project)
+    assert port_names(asset) == port_names(
+        config_loader.create_stage_node("asset", "assetA", {}, project)
+    )
+
+    # A changed config is compiled again
+    path = str(tmp_path / "graph.yml")
+    config["stages"].pop("shot")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    assert "shot" not in loader.load(path, cache_dir=cache_dir).config()["stages"]
+    assert len(os.listdir(cache_dir)) == 2
+
+    # As is a config compiled by a different version of the loader
+    monkeypatch.setattr(loader, "COMPILED_VERSION", "changed")
+    assert "shot" in loader.load(CONFIG_PATH, cache_dir=cache_dir).config()["stages"]
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_load_invalid_cache(config, tmp_path):
+    cache_dir = str(tmp_path)
+    loader.load(CONFIG_PATH, cache_dir=cache_dir)
+    (cache_path,) = tmp_path.iterdir()
+    cache_path.write_bytes(b"invalid")
+    assert loader.load(CONFIG_PATH, cache_dir=cache_dir).config() == config
@@ -0,0 +1,155 @@
+import pytest
+
+import meta
+
+
+def entry(value, type="int"):
+    return {"type": type, "value": value}
+
+
+def test_shared_until_written():
+    base = {"a": entry(1), "b": entry([1, 2], type="list")}
+    first = meta.Metadata(base)
+    second = meta.Metadata(base)
+    assert first.value("a") == 1
+    assert first.unmodified_base() is base
+
+    first["a"] = entry(2)
+    assert first["a"]["value"] == 2
+    assert second["a"]["value"] == 1
+    assert base["a"]["value"] == 1
+    assert first.unmodified_base() is None
+    assert second.unmodified_base() is base
+
+
+def test_copied_when_read():
+    base = {
+        "b": entry([1, 2], type="list"),
+        "d": {"type": "dict", "value": {"x": [1]}},
+    }
+    first = meta.Metadata(base)
+    second = meta.Metadata(base, {"d": {"type": "dict", "value": {"y": 2}}})
+
+    # Reading an entry from the base doesn't modify the metadata
+    assert first["b"] == base["b"]
+    assert first == meta.Metadata(base)
+    assert first.unmodified_base() is base
+
+    first["b"]["value"].append(3)
+    first.value("d")["x"].append(2)
+    second["d"]["value"]["x"].append(3)
+    assert first.value("b") == [1, 2, 3]
+    assert first.value("d") == {"x": [1, 2]}
+    assert second.value("d") == {"x": [1, 3], "y": 2}
+    assert base == {
+        "b": entry([1, 2], type="list"),
+        "d": {"type": "dict", "value": {"x": [1]}},
+    }
+    assert first.unmodified_base() is None
+
+
+def test_mutable_copies_once():
+    base = {"b": entry([1, 2], type="list")}
+    metadata = meta.Metadata(base)
+    mutable = metadata.mutable("b")
+    mutable["value"].append(3)
+
+    assert metadata.mutable("b") is mutable
+    assert metadata["b"]["value"] == [1, 2, 3]
+    assert base["b"]["value"] == [1, 2]
+
+
+def test_delete():
+    metadata = meta.Metadata({"a": entry(1), "b": entry(2)})
+    del metadata["a"]
+    assert "a" not in metadata
+    assert list(metadata) == ["b"]
+    with pytest.raises(KeyError):
+        metadata["a"]
+    with pytest.raises(KeyError):
+        del metadata["a"]
+
+    metadata["a"] = entry(3)
+    assert dict(metadata) == {"a": entry(3), "b": entry(2)}
+
+
+def test_copy():
+    metadata = meta.Metadata({"a": entry(1)})
+    metadata["b"] = entry(2)
+    copied = metadata.copy()
+    copied["c"] = entry(3)
+
+    assert dict(copied) == {"a": entry(1), "b": entry(2), "c": entry(3)}
+    assert "c" not in metadata
+
+    # Entries are shared unless copied deeply, other values always are
+    value = object()
+    metadata["d"] = entry([value], type="list")
+    assert metadata.copy()["d"] is metadata["d"]
+    copied = metadata.copy(deep=True)
+    copied["d"]["value"].append(1)
+    assert metadata["d"]["value"] == [value]
+    assert copied["d"]["value"][0] is value
+
+
+def test_recursive_merge():
+    base = {
+        "settings": {
+            "type": "dict",
+            "subtype": "mixed",
+            "value": {"a": entry(1), "b": entry(2)},
+        },
+        "plain": {"type": "dict", "value": {"x": {"y": 1, "z": 2}}},
+        "other": entry(0),
+    }
+    data = {
+        "settings": {"type": "dict", "subtype": "mixed", "value": {"b": entry(3)}},
+        "plain": {"type": "dict", "value": {"x": {"z": 3}}},
+    }
+    metadata = meta.Metadata(base, data)
+
+    assert metadata["settings"]["value"] == {"a": entry(1), "b": entry(3)}
+    assert metadata["plain"]["value"] == {"x": {"y": 1, "z": 3}}
+    assert metadata["other"] == base["other"]
+    assert base["settings"]["value"]["b"] == entry(2)
+
+
+def mixed(type, value):
+    return {"type": type, "subtype": "mixed", "value": value}
+
+
+def test_view_collapses_lazily():
+    nested = mixed("dict", {"c": entry(1)})
+    metadata = meta.Metadata(
+        {
+            "a": mixed("dict", {"b": nested, "other": entry(2)}),
+            "l": mixed("list", [entry(1), mixed("dict", {"k": entry("v")})]),
+        }
+    )
+
+    a = metadata.value("a")
+    assert isinstance(a, meta.DictView)
+    assert a["b"]["c"] == 1
+    assert metadata.value("a") is a
+    assert a["b"] is a["b"]
+    assert a == {"b": {"c": 1}, "other": 2}
+
+    items = metadata.value("l")
+    assert items[0] == 1
+    assert items[-1]["k"] == "v"
+    assert items == [1, {"k": "v"}]
+    assert {"k": "v"} in items
+
+
+def test_view_invalidated():
+    metadata = meta.Metadata({"a": mixed("dict", {"b": entry(1)})})
+    assert metadata.value("a")["b"] == 1
+
+    metadata["a"] = mixed("dict", {"b": entry(2)})
+    assert metadata.value("a")["b"] == 2
+
+    # Replacing a nested entry in place invalidates the nested view
+    metadata.mutable("a")["value"]["b"] = mixed("dict", {"c": entry(3)})
+    assert metadata.value("a")["b"]["c"] == 3
+    metadata.mutable("a")["value"]["b"] = mixed("dict", {"c": entry(4)})
+    assert metadata.value("a")["b"]["c"] == 4
@@ -0,0 +1,520 @@
+import sys
+import threading
+
+import pytest
+
+import constants, navigate, nodes, util
+
+
+def make_node(name, inputs=(), outputs=(), multi=False):
+    node = nodes.Node("workspace", name)
+    for port_name in inputs:
+        node.add_port(nodes.Port(constants.PortType.Input, port_name, multi=multi))
+    for port_name in outputs:
+        node.add_port(nodes.Port(constants.PortType.Output, port_name))
+    return node
+
+
+def same_ports(ports, expected):
+    # Ports are compared by identity, as equal ports are each returned
+    return sorted(map(id, ports)) == sorted(map(id, expected))
+
+
+def test_connected():
+    a = make_node("a", outputs=["out"])
+    b = make_node("b", inputs=["in"])
+    c = make_node("c", inputs=["in"])
+    source = a.port(constants.PortType.Output, "out")
+    graph = navigate.Graph()
+    assert graph.add_connection(
+        nodes.Connection(source, b.port(constants.PortType.Input, "in"))
+    )
+    assert graph.add_connection(
+        nodes.Connection(source, c.port(constants.PortType.Input, "in"))
+    )
+
+    assert set(graph.connected(source)) == {
+        b.port(constants.PortType.Input, "in"),
+        c.port(constants.PortType.Input, "in"),
+    }
+    assert list(graph.connected(b.port(constants.PortType.Input, "in"))) == [source]
+    assert len(graph.outgoing(source)) == 2
+    assert not graph.incoming(source)
+
+
+def test_duplicate_connection():
+    a = make_node("a", outputs=["out"])
+    b = make_node("b", inputs=["in"])
+    connection = nodes.Connection(
+        a.port(constants.PortType.Output, "out"), b.port(constants.PortType.Input, "in")
+    )
+    graph = navigate.Graph()
+    assert graph.add_connection(connection)
+    assert not graph.add_connection(connection)
+
+
+def test_single_input():
+    a = make_node("a", outputs=["one", "two"])
+    b = make_node("b", inputs=["in"])
+    target = b.port(constants.PortType.Input, "in")
+    graph = navigate.Graph()
+    graph.add_connection(
+        nodes.Connection(a.port(constants.PortType.Output, "one"), target)
+    )
+    with pytest.raises(ValueError):
+        graph.add_connection(
+            nodes.Connection(a.port(constants.PortType.Output, "two"), target)
+        )
+
+
+def test_multi_input():
+    a = make_node("a", outputs=["one", "two"])
+    b = make_node("b", inputs=["in"], multi=True)
+    target = b.port(constants.PortType.Input, "in")
+    graph = navigate.Graph()
+    for name in ("one", "two"):
+        assert graph.add_connection(
+            nodes.Connection(a.port(constants.PortType.Output, name), target)
+        )
+    assert len(graph.incoming(target)) == 2
+
+
+def test_node_lookup():
+    asset = nodes.Node("asset", "assetA")
+    shot = nodes.Node("shot", "assetA")
+    graph = navigate.Graph()
+    assert graph.add_node(asset)
+    assert graph.add_node(shot)
+    assert not graph.add_node(nodes.Node("asset", "assetA"))
+
+    assert graph.node("assetA", "asset") is asset
+    assert graph.node("assetA", "shot") is shot
+    assert graph.node("assetA") in (asset, shot)
+    assert graph.node("assetA", "project") is None
+    assert graph.node("missing") is None
+    assert set(graph.iter_nodes()) == {asset, shot}
+
+
+def test_remove_connection():
+    a = make_node("a", outputs=["out"])
+    b = make_node("b", inputs=["in"])
+    source = a.port(constants.PortType.Output, "out")
+    target = b.port(constants.PortType.Input, "in")
+    connection = nodes.Connection(source, target)
+    graph = navigate.Graph()
+    graph.add_connection(connection)
+
+    assert graph.remove_connection(connection)
+    assert not graph.remove_connection(connection)
+    assert list(graph.connected(source)) == []
+    assert list(graph.iter_connections()) == []
+    # The single input slot is free again
+    assert graph.add_connection(nodes.Connection(source, target))
+
+
+def test_replace_connections():
+    a = make_node("a", outputs=["one", "two", "three"])
+    b = make_node("b", inputs=["in"], multi=True)
+    target = b.port(constants.PortType.Input, "in")
+    one, two, three = (
+        a.port(constants.PortType.Output, name) for name in ("one", "two", "three")
+    )
+    graph = navigate.Graph()
+    graph.add_connection(nodes.Connection(one, target))
+    graph.add_connection(nodes.Connection(two, target, group="old"))
+
+    added, removed = graph.replace_connections(
+        target,
+        [
+            nodes.Connection(two, target, group="new"),
+            nodes.Connection(three, target),
+        ],
+    )
+    assert {(c.source(), c.group) for c in added} == {(two, "new"), (three, None)}
+    assert {(c.source(), c.group) for c in removed} == {(one, None), (two, "old")}
+    assert set(graph.connected(target)) == {two, three}
+
+
+def chain(*names):
+    # Connects each node's output to the next node's input
+    chained = [make_node(name, inputs=["in"], outputs=["out"]) for name in names]
+    graph = navigate.Graph()
+    for source, target in zip(chained, chained[1:]):
+        graph.add_connection(
+            nodes.Connection(
+                source.port(constants.PortType.Output, "out"),
+                target.port(constants.PortType.Input, "in"),
+            )
+        )
+    return graph, chained
+
+
+def test_downstream_through_workspaces():
+    graph, (a, b, c) = chain("a", "b", "c")
+    assert graph.downstream(a.port(constants.PortType.Output, "out")) == {
+        b.port(constants.PortType.Input, "in"),
+        b.port(constants.PortType.Output, "out"),
+        c.port(constants.PortType.Input, "in"),
+        c.port(constants.PortType.Output, "out"),
+    }
+    assert graph.upstream(c.port(constants.PortType.Input, "in")) == {
+        b.port(constants.PortType.Output, "out"),
+        b.port(constants.PortType.Input, "in"),
+        a.port(constants.PortType.Output, "out"),
+        a.port(constants.PortType.Input, "in"),
+    }
+
+
+def test_downstream_cache_invalidated():
+    graph, (a, b) = chain("a", "b")
+    source = a.port(constants.PortType.Output, "out")
+    assert len(graph.downstream(source)) == 2
+
+    c = make_node("c", inputs=["in"])
+    graph.add_connection(
+        nodes.Connection(
+            b.port(constants.PortType.Output, "out"),
+            c.port(constants.PortType.Input, "in"),
+        )
+    )
+    assert c.port(constants.PortType.Input, "in") in graph.downstream(source)
+
+
+def test_topological_order():
+    graph, chained = chain("a", "b", "c", "d")
+    order = graph.topological_order()
+    assert order == [
+        port
+        for node in chained
+        for port in (
+            node.port(constants.PortType.Input, "in"),
+            node.port(constants.PortType.Output, "out"),
+        )
+    ]
+    assert graph.find_cycle() is None
+
+
+def test_cycle():
+    graph, (a, b) = chain("a", "b")
+    graph.add_connection(
+        nodes.Connection(
+            b.port(constants.PortType.Output, "out"),
+            a.port(constants.PortType.Input, "in"),
+        )
+    )
+    assert len(graph.find_cycle()) == 4
+    with pytest.raises(ValueError):
+        graph.topological_order()
+
+
+def test_query_connections():
+    asset = nodes.Node("asset", "assetA")
+    modeling = make_node("modeling", outputs=["model"])
+    surfacing = make_node("surfacing", inputs=["model"])
+    for workspace in (modeling, surfacing):
+        workspace.set_parent(asset)
+    asset.add_port(nodes.Port(constants.PortType.Output, "model"))
+    shot = nodes.Node("shot", "shotA")
+    shot.add_port(nodes.Port(constants.PortType.Input, "model", multi=True))
+
+    model = modeling.port(constants.PortType.Output, "model")
+    internal = nodes.Connection(
+        model,
+        surfacing.port(constants.PortType.Input, "model"),
+        metadata={"priority": {"type": "int", "value": 1}},
+    )
+    promoted = nodes.Connection(model, asset.port(constants.PortType.Output, "model"))
+    external = nodes.Connection(
+        asset.port(constants.PortType.Output, "model"),
+        shot.port(constants.PortType.Input, "model"),
+        group="assetA_1",
+        internal=False,
+    )
+    graph = navigate.Graph(metadata_keys=["priority"])
+    for connection in (internal, promoted, external):
+        graph.add_connection(connection)
+
+    assert graph.connections() == {internal, promoted, external}
+    assert graph.connections(group="assetA_1") == {external}
+    assert graph.connections(group=None) == {internal, promoted}
+    assert graph.connections(internal=True, stage=asset) == {internal, promoted}
+    assert graph.connections(internal=False, stage=asset) == set()
+    assert graph.connections(stage=shot) == {external}
+    assert graph.connections(metadata="priority") == {internal}
+    with pytest.raises(ValueError):
+        graph.connections(metadata="missing")
+
+    # Indexes are maintained once built
+    graph.remove_connection(external)
+    assert graph.connections(group="assetA_1") == set()
+    assert graph.connections(internal=False) == set()
+    graph.add_connection(external)
+    assert graph.connections(internal=False, stage=shot) == {external}
+
+
+def test_query_ports():
+    asset = nodes.Node("asset", "assetA")
+    modeling = make_node("modeling", inputs=["reference"], outputs=["model"])
+    modeling.set_parent(asset)
+    modeling.port(constants.PortType.Output, "model").metadata["variation"] = {
+        "type": "str",
+        "value": "red",
+    }
+    shot = nodes.Node("shot", "shotA")
+    shot.add_port(nodes.Port(constants.PortType.Input, "model", multi=True))
+    graph = navigate.Graph(metadata_keys=["variation"])
+    graph.add_node(asset)
+    graph.add_node(shot)
+
+    model = modeling.port(constants.PortType.Output, "model")
+    assert same_ports(
+        graph.ports(type=constants.PortType.Input),
+        [
+            modeling.port(constants.PortType.Input, "reference"),
+            shot.port(constants.PortType.Input, "model"),
+        ],
+    )
+    assert same_ports(
+        graph.ports(name="model", multi=True),
+        [shot.port(constants.PortType.Input, "model")],
+    )
+    assert same_ports(
+        graph.ports(type=constants.PortType.Output, name="model"), [model]
+    )
+    assert same_ports(graph.ports(metadata="variation"), [model])
+    assert graph.ports(name="missing") == []
+
+
+def test_query_equal_ports():
+    # Ports on same named workspaces of different stages are equal, but each
+    # is a port of the graph
+    graph = navigate.Graph(metadata_keys=["variation"])
+    models = []
+    textures = []
+    for index in range(3):
+        asset = nodes.Node("asset", "asset{}".format(index))
+        modeling = make_node("modeling", outputs=["model"])
+        modeling.set_parent(asset)
+        surfacing = make_node("surfacing", inputs=["texture"], multi=True)
+        surfacing.set_parent(asset)
+        texture = surfacing.port(constants.PortType.Input, "texture")
+        texture.metadata["variation"] = {"type": "str", "value": "red"}
+        models.append(modeling.port(constants.PortType.Output, "model"))
+        textures.append(texture)
+        graph.add_node(asset)
+    assert models[0] == models[1]
+
+    assert len(graph.ports()) == 6
+    assert same_ports(graph.ports(type=constants.PortType.Output, name="model"), models)
+    assert same_ports(graph.ports(multi=True, metadata="variation"), textures)
+
+    # Removing a stage only removes its own ports
+    graph.remove_node(graph.node("asset1"))
+    assert same_ports(graph.ports(name="model"), [models[0], models[2]])
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_remove_node(indexed):
+    # The project is added too, so its descendants are indexed through it
+    project = nodes.Node("project", "project")
+    asset = nodes.Node("asset", "assetA", project)
+    modeling = make_node("modeling", outputs=["model"])
+    modeling.set_parent(asset)
+    asset.add_port(nodes.Port(constants.PortType.Output, "model"))
+    shot = nodes.Node("shot", "shotA", project)
+    layout = make_node("layout", inputs=["model"], outputs=["layout"])
+    layout.set_parent(shot)
+    lighting = make_node("lighting", inputs=["layout"])
+    lighting.set_parent(shot)
+
+    model = asset.port(constants.PortType.Output, "model")
+    promoted = nodes.Connection(
+        modeling.port(constants.PortType.Output, "model"), model
+    )
+    external = nodes.Connection(
+        model, layout.port(constants.PortType.Input, "model"), internal=False
+    )
+    internal = nodes.Connection(
+        layout.port(constants.PortType.Output, "layout"),
+        lighting.port(constants.PortType.Input, "layout"),
+    )
+    graph = navigate.Graph()
+    graph.add_node(project)
+    graph.add_node(asset)
+    graph.add_node(shot)
+    for connection in (promoted, external, internal):
+        graph.add_connection(connection)
+    if indexed:
+        graph.connections()
+        graph.ports()
+    assert modeling.port(constants.PortType.Output, "model") in graph.upstream(
+        lighting.port(constants.PortType.Input, "layout")
+    )
+
+    assert set(graph.remove_node(shot)) == {external, internal}
+    assert list(graph.iter_connections()) == [promoted]
+    assert list(graph.iter_nodes()) == [project, asset]
+    assert graph.node("shotA") is None
+    # The hierarchy is left as it is, the shot is only skipped
+    assert shot.parent() is project
+    assert project.children() == [asset, shot]
+    assert list(graph.iter_descendants(project)) == [project, asset, modeling]
+    assert not graph.incoming(layout.port(constants.PortType.Input, "model"))
+    assert graph.downstream(model) == frozenset()
+    assert graph.connections(internal=False) == set()
+    assert graph.connections(stage=shot) == set()
+    assert graph.ports(type=constants.PortType.Input) == []
+    assert same_ports(
+        graph.ports(name="model"),
+        [model, modeling.port(constants.PortType.Output, "model")],
+    )
+
+    # Workspaces can be removed from a stage still in the graph
+    assert graph.remove_node(modeling) == [promoted]
+    assert graph.node("assetA") is asset
+    assert asset.children() == [modeling]
+    assert list(graph.iter_connections()) == []
+    assert graph.ports() == [model]
+    assert graph.remove_node(shot) == []
+
+    # Nodes added later are indexed without the removed subtrees
+    other = navigate.Graph()
+    other.add_node(project)
+    assert len(other.ports()) == 5
+    graph.add_node(nodes.Node("asset", "assetB", project))
+    assert graph.ports() == [model]
+
+    # The node can be added again
+    graph.add_node(shot)
+    graph.add_connection(internal)
+    assert graph.connections(stage=shot) == {internal}
+    assert layout.port(constants.PortType.Input, "model") in graph.ports()
+    assert graph.ports(constants.PortType.Output, "model") == [model]
+
+
+def test_remove_node_shared_workspaces():
+    # Same named workspaces are equal, so their connections are only added for
+    # the first stage, and removing another stage leaves them in place
+    source = make_node("source", outputs=["out"])
+    shots = []
+    for name in ("shotA", "shotB"):
+        shot = nodes.Node("shot", name)
+        make_node("layout", inputs=["in"], multi=True).set_parent(shot)
+        shots.append(shot)
+    connections = [
+        nodes.Connection(
+            source.port(constants.PortType.Output, "out"),
+            shot.child("layout").port(constants.PortType.Input, "in"),
+        )
+        for shot in shots
+    ]
+    graph = navigate.Graph()
+    for shot, connection in zip(shots, connections):
+        graph.add_node(shot)
+        graph.add_connection(connection)
+
+    assert graph.remove_node(shots[1]) == []
+    assert list(graph.iter_connections()) == connections[:1]
+    assert graph.remove_node(shots[0]) == connections[:1]
+
+
+def test_remove_pending_node():
+    built = []
+    stage = nodes.Node("shot", "shotA")
+    stage.set_pending(built.append)
+    graph = navigate.Graph()
+    graph.add_node(stage)
+    assert graph.remove_node(stage) == []
+    assert list(graph.iter_nodes()) == []
+    assert graph.ports() == []
+    assert built == []
+
+
+def test_read_write_lock():
+    lock = util.ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    with lock.read():
+        # Readers share the lock
+        with lock.read():
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(0.05)
+            assert events == []
+    writer.join()
+    assert events == ["write"]
+
+
+def test_concurrent_graph():
+    # Readers iterate and query while a writer replaces the connections to
+    # each target port, every view must be between updates, ie, each pair
+    # fully present or absent
+    sources = [
+        make_node("source{}".format(index), outputs=["a", "b"]) for index in range(50)
+    ]
+    targets = [
+        make_node("target{}".format(index), inputs=["in"], multi=True)
+        for index in range(50)
+    ]
+    pairs = [
+        tuple(
+            nodes.Connection(
+                source.port(constants.PortType.Output, name),
+                target.port(constants.PortType.Input, "in"),
+                group=index,
+            )
+            for name in ("a", "b")
+        )
+        for index, (source, target) in enumerate(zip(sources, targets))
+    ]
+    graph = navigate.ConcurrentGraph()
+    for node in sources + targets:
+        graph.add_node(node)
+    done = threading.Event()
+    errors = []
+
+    def write():
+        try:
+            for _ in range(20):
+                for pair in pairs:
+                    graph.replace_connections(pair[0].target(), pair)
+                for pair in pairs:
+                    graph.replace_connections(pair[0].target(), [])
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                connections = list(graph.iter_connections())
+                assert len(connections) % 2 == 0
+                for index, pair in enumerate(pairs):
+                    assert len(graph.connections(group=index)) in (0, 2)
+                    assert len(graph.incoming(pair[0].target())) in (0, 2)
+                assert graph.node("source0", "workspace") is sources[0]
+        except Exception as e:
+            errors.append(e)
+
+    # Threads switch often so that reads land between the writer's steps
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=write)]
+        threads.extend(threading.Thread(target=read) for _ in range(4))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert list(graph.iter_connections()) == []
+
+    for connection, _ in pairs:
+        graph.add_connection(connection)
+    assert len(graph.connections(internal=True)) == len(pairs)
+    assert set(graph.connected(pairs[0][0].source())) == {pairs[0][0].target()}
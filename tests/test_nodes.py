@@ -0,0 +1,103 @@
+import pickle
+
+import constants, nodes
+
+
+def test_child_lookup():
+    parent = nodes.Node("asset", "assetA")
+    modeling = nodes.Node("workspace", "modeling", parent=parent)
+    surfacing = nodes.Node("workspace", "surfacing", parent=parent)
+
+    assert parent.child("modeling") is modeling
+    assert parent.child("surfacing") is surfacing
+    assert parent.child("missing") is None
+    assert parent.children() == [modeling, surfacing]
+
+
+def test_set_parent_moves_child():
+    first = nodes.Node("asset", "assetA")
+    second = nodes.Node("asset", "assetB")
+    child = nodes.Node("workspace", "modeling", parent=first)
+
+    child.set_parent(second)
+    assert child.parent() is second
+    assert first.child("modeling") is None
+    assert first.children() == []
+    assert second.child("modeling") is child
+
+
+def test_port_lookup():
+    node = nodes.Node("workspace", "modeling")
+    output = nodes.Port(constants.PortType.Output, "model")
+    input = nodes.Port(constants.PortType.Input, "model")
+    node.add_port(output)
+    node.add_port(input)
+
+    assert node.port(constants.PortType.Output, "model") is output
+    assert node.port(constants.PortType.Input, "model") is input
+    assert node.port(constants.PortType.Input, "missing") is None
+    assert node.ports() == [output, input]
+
+
+def test_hash_attach():
+    node = nodes.Node("workspace", "modeling")
+    port = nodes.Port(constants.PortType.Output, "model")
+    node.add_port(port)
+
+    other = nodes.Node("workspace", "modeling")
+    other_port = nodes.Port(constants.PortType.Output, "model")
+    other.add_port(other_port)
+    assert port == other_port
+    assert hash(port) == hash(other_port)
+    assert nodes.Connection(port, port) == nodes.Connection(other_port, other_port)
+
+
+def test_pickle():
+    parent = nodes.Node("asset", "assetA")
+    child = nodes.Node("workspace", "modeling", parent=parent)
+    port = nodes.Port(constants.PortType.Output, "model")
+    child.add_port(port)
+    connection = nodes.Connection(port, port, group="group")
+
+    copied = pickle.loads(pickle.dumps(connection))
+    assert copied == connection
+    assert copied.group == "group"
+    copied_port = copied.source()
+    assert copied_port.node().parent().child("modeling") is copied_port.node()
+    assert copied_port in {port}
+    assert copied_port.node().port(constants.PortType.Output, "model") is copied_port
+
+    # The copied hierarchy can be changed
+    copied_child = copied_port.node()
+    copied_parent = copied_child.parent()
+    other = nodes.Node("asset", "assetB")
+    copied_child.set_parent(other)
+    assert copied_parent.children() == []
+    assert copied_parent.child("modeling") is None
+    assert other.children() == [copied_child]
+
+
+def test_pending():
+    built = []
+
+    def build(node):
+        built.append(node)
+        nodes.Node("workspace", "modeling", parent=node)
+        node.add_port(nodes.Port(constants.PortType.Output, "model"))
+
+    node = nodes.Node("asset", "assetA")
+    node.set_pending(build)
+    assert node.is_pending()
+    assert built == []
+
+    assert node.port(constants.PortType.Output, "model") is not None
+    assert built == [node]
+    assert not node.is_pending()
+    assert [c.name() for c in node.children()] == ["modeling"]
+    assert built == [node]
+
+    # Children added later come after the pending ones
+    other = nodes.Node("asset", "assetB")
+    other.set_pending(build)
+    nodes.Node("workspace", "surfacing", parent=other)
+    assert [c.name() for c in other.children()] == ["modeling", "surfacing"]
@@ -0,0 +1,88 @@
+import pytest
+
+import loader, nodes, parallel
+from conftest import Instance
+
+
+def set_groups(config, group):
+    # Replaces the group of every connection in the config
+    if isinstance(config, dict):
+        if "group" in config:
+            config["group"] = group
+        for value in config.values():
+            set_groups(value, group)
+    elif isinstance(config, list):
+        for value in config:
+            set_groups(value, group)
+
+
+# Groups are either objects from the project or, eg, names which are copied
+@pytest.fixture(params=["item", "item.name"])
+def config_loader(request, config):
+    set_groups(config, request.param)
+    return loader.ConfigLoader(config)
+
+
+@pytest.fixture
+def stages(config_loader):
+    project = nodes.Node("project", "project")
+    stages = [config_loader.create_stage_node("project", "project", {}, project)]
+    for index in range(6):
+        stages.append(
+            config_loader.create_stage_node(
+                "asset",
+                "asset{}".format(index),
+                {"is_rigged": {"type": "bool", "value": index % 2 == 0}},
+                project,
+            )
+        )
+    for index in range(4):
+        assets = stages[1:]
+        stages.append(
+            config_loader.create_stage_node(
+                "shot",
+                "shot{}".format(index),
+                {
+                    "animated_instances": {
+                        "type": "list",
+                        "value": [Instance("a", assets[index])],
+                    },
+                    "static_instances": {
+                        "type": "list",
+                        "value": [Instance("b", assets[index + 1])],
+                    },
+                },
+                project,
+            )
+        )
+    return stages
+
+
+def test_build_graph(config_loader, stages):
+    serial = parallel.build_graph(config_loader, stages, processes=1)
+    graph = parallel.build_graph(config_loader, stages, processes=2)
+
+    # Ports and groups resolve to the objects in this process
+    connections = list(graph.iter_connections())
+    expected = list(serial.iter_connections())
+    assert len(connections) == len(expected)
+    for expected, connection in zip(expected, connections):
+        assert connection.source() is expected.source()
+        assert connection.target() is expected.target()
+        assert connection.is_internal() == expected.is_internal()
+        if isinstance(expected.group, str):
+            assert connection.group == expected.group
+        else:
+            assert connection.group is expected.group
+        assert dict(connection.metadata) == dict(expected.metadata)
+    assert list(graph.iter_nodes()) == list(serial.iter_nodes())
+
+
+def test_build_graph_unknown_node(config_loader, stages):
+    other = config_loader.create_stage_node("asset", "other", {})
+    stages[-1].metadata["static_instances"] = {
+        "type": "list",
+        "value": [Instance("c", other)],
+    }
+    with pytest.raises(ValueError):
+        parallel.build_graph(config_loader, stages, processes=2)
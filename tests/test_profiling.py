@@ -0,0 +1,59 @@
+import json
+
+import loader, nodes, profiling, util
+from conftest import Instance, make_shot
+
+
+def test_profiler(config, tmp_path):
+    profiler = profiling.Profiler()
+    config_loader = loader.ConfigLoader(config, profiler=profiler)
+    project = nodes.Node("project", "project")
+    assets = [
+        config_loader.create_stage_node(
+            "asset",
+            "asset{}".format(index),
+            {"is_rigged": {"type": "bool", "value": index == 0}},
+            project,
+        )
+        for index in range(3)
+    ]
+    shot = make_shot(
+        config_loader,
+        project,
+        "shotA",
+        animated=[Instance("a", assets[0])],
+        static=[Instance("b", assets[1]), Instance("c", assets[2])],
+    )
+    for stage in assets + [shot]:
+        config_loader.create_connections(stage)
+    # Copies made by the loader, the defaults and the metadata of lazy stages
+    config_loader.metadata("asset")
+    config_loader.create_stage_node("asset", "lazy", {}, project, lazy=True)
+
+    report = profiler.report()
+    assert report["stages"]["asset"]["created"] == 3
+    assert report["stages"]["asset"]["connected"] == 3
+    assert report["stages"]["shot"]["created"] == 1
+    assert report["stages"]["shot"]["create_seconds"] > 0
+    # Scopes are memoized so each condition is only evaluated once per value
+    assert report["conditions"]["stage[is_rigged]"]["count"] == 4
+    assert report["expressions"]["stage[static_instances]"] == 1
+    assert report["expressions"]["item.asset"] == 4
+    assert report["connections"]["shot.input.model"] == 2
+    assert report["connections"]["shot.lighting.input.camera"] == 1
+    assert report["copies"] == {
+        "ConfigLoader.metadata": 1,
+        "ConfigLoader.lazy_stage": 1,
+    }
+
+    path = str(tmp_path / "report.json")
+    profiler.write(path)
+    with open(path) as f:
+        assert json.load(f) == report
+
+
+def test_parse_expression():
+    profiler = profiling.Profiler()
+    assert util.parse_expression("item.name", {"item": Instance("a", None)}, profiler)
+    util.parse_expression("item.name", {"item": Instance("b", None)}, profiler)
+    assert profiler.report()["expressions"] == {"item.name": 2}
@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+import navigate, nodes, sinks
+from conftest import Instance, make_shot
+
+
+@pytest.fixture
+def stages(config_loader):
+    project = nodes.Node("project", "project")
+    asset = config_loader.create_stage_node("asset", "assetA", {}, project)
+    shot = make_shot(
+        config_loader, project, "shotA", static=[Instance("assetA_1", asset)]
+    )
+    return [asset, shot]
+
+
+def test_stream_connections_graph(config_loader, stages):
+    graph = navigate.Graph()
+    count = config_loader.stream_connections(stages, graph.add_connection)
+
+    expected = [c for stage in stages for c in config_loader.create_connections(stage)]
+    assert count == len(expected)
+    assert set(graph.iter_connections()) == set(expected)
+
+
+def test_file_sink(config_loader, stages):
+    f = io.StringIO()
+    with sinks.FileSink(f) as sink:
+        count = config_loader.stream_connections(stages, sink)
+
+    lines = [json.loads(line) for line in f.getvalue().splitlines()]
+    assert len(lines) == count
+    external = [line for line in lines if not line["internal"]]
+    assert external == [
+        {
+            "source": ["project.assetA", "output", "model"],
+            "target": ["project.shotA", "input", "model"],
+            "internal": False,
+            "group": "assetA_1",
+            "metadata": {},
+        }
+    ]
+
+
+def test_batch_sink(config_loader, stages):
+    batches = []
+    with sinks.BatchSink(batches.append, size=3) as sink:
+        count = config_loader.stream_connections(stages, sink)
+
+    assert [len(batch) for batch in batches[:-1]] == [3] * (len(batches) - 1)
+    assert 0 < len(batches[-1]) <= 3
+    assert sum(len(batch) for batch in batches) == count
@@ -0,0 +1,130 @@
+import pickle
+
+import pytest
+
+import constants, exceptions, meta, nodes, snapshot
+from conftest import Instance, build_graph, describe, make_shot
+
+
+@pytest.fixture
+def graph(config_loader):
+    project = nodes.Node("project", "project")
+    asset = config_loader.create_stage_node(
+        "asset", "assetA", {"is_rigged": {"type": "bool", "value": True}}, project
+    )
+    shot = make_shot(
+        config_loader, project, "shotA", animated=[Instance("assetA_1", asset)]
+    )
+    return build_graph(config_loader, [asset, shot])
+
+
+def test_round_trip(graph, config, tmp_path):
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(graph, path, snapshot.fingerprint(config))
+    loaded = snapshot.load(path, snapshot.fingerprint(config))
+
+    assert sorted(map(describe, loaded.iter_connections())) == sorted(
+        map(describe, graph.iter_connections())
+    )
+    assert [n.path() for n in loaded.iter_nodes()] == [
+        n.path() for n in graph.iter_nodes()
+    ]
+
+    # Nodes referenced from groups and metadata resolve to the loaded nodes
+    asset = loaded.node("assetA", "asset")
+    shot = loaded.node("shotA", "shot")
+    assert asset is not graph.node("assetA", "asset")
+    (instance,) = shot["animated_instances"]
+    assert instance.asset is asset
+    groups = [c.group for c in loaded.iter_connections() if c.group is not None]
+    assert groups and all(group is instance for group in groups)
+
+    assert asset["is_rigged"] is True
+    assert asset.port(constants.PortType.Output, "rig") is not None
+    assert shot.port(constants.PortType.Input, "model").is_multi()
+
+
+def test_stale(graph, config, tmp_path):
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(graph, path, snapshot.fingerprint(config))
+    assert snapshot.read_fingerprint(path) == snapshot.fingerprint(config)
+
+    config["stages"]["asset"]["workspaces"].pop("surfacing")
+    with pytest.raises(exceptions.StaleSnapshot):
+        snapshot.load(path, snapshot.fingerprint(config))
+
+
+def test_invalid(tmp_path):
+    path = tmp_path / "graph.snapshot"
+    path.write_bytes(b"not a snapshot" * 10)
+    with pytest.raises(exceptions.SnapshotError):
+        snapshot.load(str(path))
+
+
+def test_fingerprint_length(graph, tmp_path):
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(graph, path, "f" * snapshot.FINGERPRINT_SIZE)
+    assert snapshot.read_fingerprint(path) == "f" * snapshot.FINGERPRINT_SIZE
+
+    with pytest.raises(ValueError):
+        snapshot.save(graph, path, "f" * (snapshot.FINGERPRINT_SIZE + 1))
+
+
+def test_shared_objects(graph, tmp_path):
+    asset = graph.node("assetA", "asset")
+    shot = graph.node("shotA", "shot")
+    tags = ["hero"]
+    instance = Instance("assetA_2", asset)
+    asset.metadata["tags"] = {"type": "list", "value": tags}
+    shot.metadata["tags"] = {"type": "list", "value": tags}
+    shot.metadata["static_instances"] = {"type": "list", "value": [instance]}
+    asset.metadata["instances"] = {"type": "list", "value": [instance]}
+
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(graph, path)
+    loaded = snapshot.load(path)
+
+    # Objects shared between metadata are still shared once loaded
+    asset = loaded.node("assetA", "asset")
+    shot = loaded.node("shotA", "shot")
+    assert asset["tags"] == ["hero"]
+    assert asset["tags"] is shot["tags"]
+    (instance,) = shot["static_instances"]
+    assert instance.asset is asset
+    assert asset["instances"][0] is instance
+
+    # Copies of loaded metadata are plain metadata
+    assert type(pickle.loads(pickle.dumps(asset.metadata))) is meta.Metadata
+    assert pickle.loads(pickle.dumps(asset.metadata))["tags"]["value"] == ["hero"]
+
+
+def test_shared_cycle(graph, tmp_path):
+    # Shared objects are loaded on their own, so can't reference each other
+    asset = graph.node("assetA", "asset")
+    shot = graph.node("shotA", "shot")
+    first = Instance("first", asset)
+    second = Instance("second", first)
+    first.asset = second
+    asset.metadata["instances"] = {"type": "list", "value": [first]}
+    shot.metadata["static_instances"] = {"type": "list", "value": [second]}
+
+    with pytest.raises(exceptions.SnapshotError):
+        snapshot.save(graph, str(tmp_path / "graph.snapshot"))
+
+
+def test_removed_nodes(graph, tmp_path):
+    asset = graph.node("assetA", "asset")
+    graph.remove_node(asset.child("rigging"))
+    path = str(tmp_path / "graph.snapshot")
+    snapshot.save(graph, path)
+    loaded = snapshot.load(path)
+
+    # Removed nodes are saved in the hierarchy, but stay out of the graph
+    rigging = loaded.node("assetA", "asset").child("rigging")
+    assert rigging is not None
+    assert loaded.removed_nodes() == [rigging]
+    assert sorted(map(describe, loaded.iter_connections())) == sorted(
+        map(describe, graph.iter_connections())
+    )
+    assert len(loaded.ports()) == len(graph.ports())
+    assert not any(port.node() is rigging for port in loaded.ports())